@@ -0,0 +1,104 @@
+"""
+An asyncio flavour of QueryService for loops of independent, latency-bound lookups.
+
+The queries run on a pool of aiomysql connections, so thousands of lookups can be in flight at once
+instead of waiting for each other's round trip. A semaphore bounds the number of queries started at the
+same time. For example:
+
+    async def get_titles(question_ids):
+        async with AsyncQueryService(max_concurrency=200) as qs:
+            await qs.connect(db_name='sotorrent22')
+            return await qs.gather(qs.get_title(question_id) for question_id in question_ids)
+
+    titles = asyncio.run(get_titles(question_ids))
+
+Requires the aiomysql package.
+"""
+import asyncio
+
+from sources.util import get_db_user, get_db_password
+
+
+class AsyncQueryService():
+    """
+    Args:
+        max_concurrency: The maximum number of queries started at the same time. Queries beyond the size of the
+            connection pool wait for a free connection.
+    """
+    def __init__(self, max_concurrency=100):
+        self._max_concurrency = max_concurrency
+        self._semaphore = None
+        self._pool = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def connect(self, host='127.0.0.1', port=3306, db_name='sotorrent22', pool_size=20):
+        """Creates a pool of up to pool_size connections to the MySQL server at host:port using the given database name.
+        """
+        import aiomysql
+
+        if self._pool is None:
+            self._pool = await aiomysql.create_pool(host=host, port=port, user=get_db_user(), password=get_db_password(),
+                                                    db=db_name, minsize=1, maxsize=pool_size, charset='utf8mb4',
+                                                    autocommit=True)
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+    async def execute_and_fetchall(self, query, params=None) -> list:
+        """Executes the given query (using %s placeholders for params) on a pooled connection
+           and returns its rows as dictionaries.
+        """
+        import aiomysql
+
+        async with self._semaphore:
+            async with self._pool.acquire() as connection:
+                async with connection.cursor(aiomysql.DictCursor) as cursor:
+                    await cursor.execute(query, params)
+                    return list(await cursor.fetchall())
+
+    async def execute_and_fetchone(self, query, params=None) -> dict:
+        rows = await self.execute_and_fetchall(query, params)
+        return rows[0] if rows else None
+
+    @staticmethod
+    async def gather(coroutines) -> list:
+        "Runs the given coroutines concurrently and returns their results in order"
+        return await asyncio.gather(*coroutines)
+
+    async def get_title(self, question_id):
+        row = await self.execute_and_fetchone("SELECT Title FROM Posts WHERE Id=%s AND PostTypeId=1", (question_id,))
+        return row['Title']
+
+    async def get_answers_with_body(self, question_id) -> list:
+        query_str = """SELECT Id, Body, CreationDate
+                       FROM Posts
+                       WHERE ParentId=%s AND Body IS NOT NULL"""
+        return [(row['Id'], row['Body'], row['CreationDate'])
+                for row in await self.execute_and_fetchall(query_str, (question_id,))]
+
+    async def getPostCreationDate(self, postid):
+        return (await self.execute_and_fetchone("SELECT CreationDate FROM Posts WHERE Id=%s", (postid,)))['CreationDate']
+
+    async def getposttype(self, postid):
+        row = await self.execute_and_fetchone("SELECT PostTypeId FROM Posts WHERE Id=%s", (postid,))
+        return row['PostTypeId'] if row else None
+
+    async def get_parentId(self, answerid):
+        return (await self.execute_and_fetchone("SELECT ParentId FROM Posts WHERE Id=%s", (answerid,)))['ParentId']
+
+    async def get_accepted_answer(self, questionid):
+        row = await self.execute_and_fetchone("SELECT AcceptedAnswerId FROM Posts WHERE Id=%s", (questionid,))
+        return row['AcceptedAnswerId']
+
+    async def getcodeblockcontent(self, snippetid):
+        return (await self.execute_and_fetchone("SELECT Content FROM PostBlockVersion WHERE Id=%s",
+                                                (snippetid,)))['Content']
@@ -0,0 +1,130 @@
+"""
+Bulk loading of rows into a single table.
+
+BulkLoader buffers the rows it is given and writes them with multi-row INSERT statements (or, with
+use_infile=True, with LOAD DATA LOCAL INFILE from a temporary file), committing once every commit_every
+rows instead of once per row or per call. Use it as a context manager so that the last rows are written
+and committed, e.g.:
+
+    with qs.bulk_loader('CppCheckWeakness', ['RootPostBlockVersionId', 'PostBlockVersionId', 'CWE']) as loader:
+        for row in rows:
+            loader.add(row)
+    print(loader.summary())
+"""
+import os
+import tempfile
+import time
+
+
+def _to_infile_field(value) -> str:
+    # the default escaping of LOAD DATA: \N is NULL, and backslash, tab and newlines are escaped with a backslash
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        value = int(value)
+    elif isinstance(value, (bytes, bytearray)):
+        value = value.decode('utf-8')
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class BulkLoader():
+    """
+    Buffers rows for a table and writes them in batches.
+
+    Args:
+        client: The SOTorrentDB (or EmbeddedDB) client to write through.
+        table: The name of the table to load.
+        columns: The columns of the table, in the order of the values of each row.
+        batch_size: The number of rows written by one INSERT statement or one LOAD DATA file. Keep the
+            statements below the max_allowed_packet of the server.
+        commit_every: The number of rows after which the transaction is committed.
+        use_infile: Whether to write with LOAD DATA LOCAL INFILE instead of INSERT statements. The client must
+            be created with allow_local_infile=True and the server must have local_infile enabled.
+    """
+    def __init__(self, client, table: str, columns: list, batch_size=1000, commit_every=50000, use_infile=False):
+        self._client = client
+        self._table = table
+        self._columns = list(columns)
+        self._batch_size = batch_size
+        self._commit_every = commit_every
+        self._use_infile = use_infile
+        self._buffer = []
+        self._uncommitted = 0
+        self._started = None
+        self._seconds = 0.0
+        self.row_count = 0
+
+        column_list = ', '.join(self._columns)
+        self._row_placeholders = '(' + ', '.join(['%s'] * len(self._columns)) + ')'
+        self._insert_prefix = f"INSERT INTO {table}({column_list}) VALUES "
+        self._load_statement = f"""LOAD DATA LOCAL INFILE %s INTO TABLE {table} CHARACTER SET utf8mb4
+                                   FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' ({column_list})"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # keep what was committed so far, but do not write rows that were buffered before the failure
+            self._buffer = []
+
+    def add(self, row):
+        if self._started is None:
+            self._started = time.perf_counter()
+        self._buffer.append(row)
+        if len(self._buffer) >= self._batch_size:
+            self._write_buffer()
+
+    def add_many(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def _write_buffer(self):
+        rows, self._buffer = self._buffer, []
+        if not rows:
+            return
+        if self._use_infile:
+            self._load_file(rows)
+        else:
+            query_str = self._insert_prefix + ', '.join([self._row_placeholders] * len(rows))
+            self._client.cursor.execute(query_str, [value for row in rows for value in row])
+        self.row_count += len(rows)
+        self._uncommitted += len(rows)
+        if self._uncommitted >= self._commit_every:
+            self._commit()
+
+    def _load_file(self, rows):
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', newline='', suffix='.tsv', delete=False) as infile:
+            for row in rows:
+                infile.write('\t'.join(_to_infile_field(value) for value in row))
+                infile.write('\n')
+        try:
+            self._client.cursor.execute(self._load_statement, (infile.name,))
+        finally:
+            os.remove(infile.name)
+
+    def _commit(self):
+        self._client.db.commit()
+        self._uncommitted = 0
+
+    def flush(self):
+        "Writes and commits the buffered rows"
+        self._write_buffer()
+        self._commit()
+
+    def close(self) -> int:
+        "Writes and commits the remaining rows and returns the number of rows loaded"
+        self.flush()
+        if self._started is not None:
+            self._seconds = time.perf_counter() - self._started
+        return self.row_count
+
+    @property
+    def rows_per_second(self) -> float:
+        seconds = self._seconds if self._seconds else time.perf_counter() - (self._started or time.perf_counter())
+        return self.row_count / seconds if seconds > 0 else 0.0
+
+    def summary(self) -> str:
+        return f"Loaded {self.row_count} rows into {self._table} ({self.rows_per_second:.0f} rows/s)"
@@ -0,0 +1,179 @@
+"""
+Read-through caches for query results.
+
+A SOTorrent release never changes once it is loaded, so the result of a lookup against it can be kept
+for as long as the release is used. QueryCache combines a size-bounded in-process LRU with an optional
+SQLite file that survives across scripts and runs. Entries are keyed by the database name, the
+normalized SQL text and the query parameters.
+"""
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# returned by the caches on a miss, since None is a valid cached value
+MISSING = object()
+
+# DiskCache only updates the access time of an entry once it is older than this many seconds, so that
+# hits from many processes sharing the file rarely need the write lock
+ACCESS_TIME_RESOLUTION = 600
+
+# the number of puts after which a DiskCache reads its size from the file again; other processes
+# writing to the same file are not counted by the size a process tracks itself
+SIZE_SYNC_PUTS = 1000
+
+
+def make_key(db_name: str, query: str, params=None) -> str:
+    """
+    Builds the cache key of a query: the whitespace-normalized SQL is hashed together with the database
+    name and the parameters, so that differently indented copies of a query share their entries.
+    """
+    normalized_query = ' '.join(query.split())
+    key = f"{db_name}\x00{normalized_query}\x00{params!r}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class LRUCache():
+    """
+    An in-process cache that evicts the least recently used entries once the pickled size of all
+    entries exceeds max_bytes.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._size = 0
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        if size is None:
+            size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous[1]
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self._max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCache():
+    """
+    A cache stored in a SQLite file. Once the stored values exceed max_bytes, the least recently
+    used entries are deleted until the cache is back at 90% of that size.
+
+    The file may be shared by several processes; timeout is how long a process waits for the
+    write lock held by another one.
+    """
+    def __init__(self, path: str, max_bytes=4 * 1024 * 1024 * 1024, timeout=60):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS Entries(
+                                      Key TEXT PRIMARY KEY,
+                                      Value BLOB NOT NULL,
+                                      Size INTEGER NOT NULL,
+                                      AccessedAt REAL NOT NULL)""")
+        self._connection.execute('CREATE INDEX IF NOT EXISTS Entries_AccessedAt ON Entries(AccessedAt)')
+        self._size = self._stored_size()
+        self._puts = 0
+
+    def _stored_size(self) -> int:
+        return self._connection.execute('SELECT COALESCE(SUM(Size), 0) FROM Entries').fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            row = self._connection.execute('SELECT Value, AccessedAt FROM Entries WHERE Key=?', (key,)).fetchone()
+            if row is None:
+                return MISSING
+            now = time.time()
+            if now - row[1] > ACCESS_TIME_RESOLUTION:
+                self._connection.execute('UPDATE Entries SET AccessedAt=? WHERE Key=?', (now, key))
+        return pickle.loads(row[0])
+
+    def put(self, key, value, data=None):
+        if data is None:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            previous = self._connection.execute('SELECT Size FROM Entries WHERE Key=?', (key,)).fetchone()
+            self._connection.execute('INSERT OR REPLACE INTO Entries(Key, Value, Size, AccessedAt) VALUES (?, ?, ?, ?)',
+                                     (key, data, len(data), time.time()))
+            self._size += len(data) - (previous[0] if previous else 0)
+            self._puts += 1
+            if self._size > self._max_bytes or self._puts >= SIZE_SYNC_PUTS:
+                self._size = self._stored_size()
+                self._puts = 0
+                if self._size > self._max_bytes:
+                    self._evict(int(self._max_bytes * 0.9))
+
+    def _evict(self, target_bytes):
+        evicted = []
+        for key, size in self._connection.execute('SELECT Key, Size FROM Entries ORDER BY AccessedAt ASC'):
+            if self._size <= target_bytes:
+                break
+            evicted.append((key,))
+            self._size -= size
+        self._connection.executemany('DELETE FROM Entries WHERE Key=?', evicted)
+
+    def close(self):
+        self._connection.close()
+
+
+class QueryCache():
+    """
+    A two-level read-through cache for query results: an in-process LRU in front of an optional DiskCache.
+    Values found on disk are promoted to memory.
+
+    Args:
+        path: The SQLite file of the on-disk level. Without a path, only the in-process level is used.
+        memory_bytes: The maximum (pickled) size of the entries kept in memory.
+        disk_bytes: The maximum size of the entries kept on disk.
+    """
+    def __init__(self, path: str = None, memory_bytes=256 * 1024 * 1024, disk_bytes=4 * 1024 * 1024 * 1024):
+        self._memory = LRUCache(memory_bytes)
+        self._disk = DiskCache(path, disk_bytes) if path else None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self._memory.get(key)
+        if value is MISSING and self._disk is not None:
+            value = self._disk.get(key)
+            if value is not MISSING:
+                self._memory.put(key, value)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._memory.put(key, value, len(data))
+        if self._disk is not None:
+            self._disk.put(key, value, data)
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
@@ -37,18 +37,14 @@ def get_cwe_snippets_dict(cppcheck_version: float = 2.13):
     """
     qs = QueryService()
     qs.connect(host=get_colossus04_ip())
-    rows = qs.execute_and_fetchall(query)
+    df = qs.execute_to_dataframe(query)
     qs.close()
 
     data_dict = {}
-    for row in rows:
-        cwe = row['CWE']
-        post_id = row['PostId']
-        root_id = row['RootPostBlockVersionId']
-        snippet_id = row['PostBlockVersionId']
+    cwes_per_version = df.groupby(['RootPostBlockVersionId', 'PostBlockVersionId'], sort=False)['CWE'].agg(list)
+    for (root_id, snippet_id), cwes in cwes_per_version.items():
         versions_dict = data_dict.setdefault(root_id, {})
-        cwes = versions_dict.setdefault(snippet_id, [])
-        cwes.append(cwe)
+        versions_dict[snippet_id] = cwes
     return data_dict
 
 
@@ -404,16 +400,17 @@ def RQ1_1():
     cwe_dict = get_cwe_snippets_dict()
     total_cwes = []
     answers = set()
-    qs = QueryService()
-    qs.connect()
+    revised_root_ids = []
     for root_id, versions_dict in cwe_dict.items():
         version_ids = sorted(versions_dict.keys())
         if len(version_ids) > 1:
             latest_version = version_ids[-1]
             cwes = versions_dict.get(latest_version)
             total_cwes.extend(cwes)
-            answer_id = qs.get_pbv_postId(root_id)
-            answers.add(answer_id)
+            revised_root_ids.append(root_id)
+    qs = QueryService()
+    qs.connect()
+    answers.update(qs.get_pbv_postId_batch(revised_root_ids).values())
     qs.close()
     print(f"Latest versions of answers: Answers: {len(answers)}, cwes: {len(total_cwes)}")
 
@@ -0,0 +1,123 @@
+"""
+Side-by-side builds of the cppcheck versions used in Case Study 1.
+
+checkout_and_compile() switches the single cppcheck checkout between versions and rebuilds it from scratch,
+so only one version can run at a time. build_cpp_check() instead builds every version once into its own git
+worktree, keyed by the tag and the make flags, and returns the path of its binary; later calls (from any
+process) return the cached build. Analysis jobs pass that path to run_cpp_check() or run_cpp_check_batch(), so
+several versions can analyze the same snippets at the same time, e.g.:
+
+    binaries = {version: build_cpp_check(version) for version in [1.86, 2.13]}
+    results = run_cpp_check_batch(snippet_files, cppcheck=binaries[2.13])
+
+A lock file per build makes concurrent callers wait for the build instead of running make twice.
+"""
+import fcntl
+import hashlib
+import os
+import shutil
+from contextlib import contextmanager
+
+from sources.util import Command
+from sources.case_study_1.cppcheck_cache import cpp_check_version
+
+CPPCHECK_REPOSITORY = '/home/alfusainey.jallow/cppcheck'
+BUILDS_DIRECTORY = f"{CPPCHECK_REPOSITORY}-builds"
+
+# the git tags of the versions the case study uses
+VERSION_TAGS = {1.86: '1.86', 2.13: '2.13.0'}
+
+# name of the file marking a complete build; holds the output of cppcheck --version
+_BUILT_MARKER = '.built'
+
+
+class CppCheckBuildError(RuntimeError):
+    "Raised when a cppcheck version cannot be checked out or compiled"
+
+
+def get_tag(version) -> str:
+    "Returns the git tag of the given version, e.g. '2.13.0' for 2.13"
+    return VERSION_TAGS.get(version, str(version))
+
+
+def build_key(tag: str, make_flags=()) -> str:
+    "Returns the name of the build directory of the given tag and make flags"
+    if not make_flags:
+        return tag
+    flags_hash = hashlib.sha256(' '.join(make_flags).encode('utf-8')).hexdigest()[:12]
+    return f"{tag}-{flags_hash}"
+
+
+@contextmanager
+def _locked(lock_path: str):
+    with open(lock_path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _run(arguments: list, workdir: str, timeout: int):
+    command = Command(arguments)
+    rc, out, error = command.run(timeout, workdir=workdir)
+    if command.is_terminated or rc != 0:
+        raise CppCheckBuildError(f"{' '.join(arguments)} failed in {workdir} (return code {rc}): {out or error}")
+    return out
+
+
+def build_cpp_check(version, make_flags=(), jobs=os.cpu_count(), repository=CPPCHECK_REPOSITORY,
+                    builds_directory=BUILDS_DIRECTORY, timeout=2 * 3600) -> str:
+    """
+    Builds the given cppcheck version (a float of VERSION_TAGS or a git tag) unless it was built before and
+    returns the absolute path of its binary.
+
+    :Args:
+        version: The version of cppcheck to build.
+        make_flags: Additional arguments of make, e.g. ['CXXFLAGS=-O2 -DNDEBUG']. Builds with different flags are
+            kept apart.
+        jobs: The number of parallel make jobs.
+        repository: The cppcheck git repository the worktrees are added to.
+        builds_directory: The directory holding one worktree per build.
+    :Returns:
+        The path of the compiled cppcheck binary.
+    """
+    tag = get_tag(version)
+    os.makedirs(builds_directory, exist_ok=True)
+    build_directory = os.path.join(builds_directory, build_key(tag, make_flags))
+    binary = os.path.join(build_directory, 'cppcheck')
+    marker = os.path.join(build_directory, _BUILT_MARKER)
+
+    with _locked(f"{build_directory}.lock"):
+        if os.path.exists(marker):
+            return binary
+        if os.path.exists(build_directory):
+            # left behind by an interrupted build
+            shutil.rmtree(build_directory)
+        # worktrees of the same repository are added one at a time
+        with _locked(os.path.join(builds_directory, '.worktree.lock')):
+            _run(['git', 'worktree', 'prune'], repository, timeout)
+            _run(['git', 'worktree', 'add', '--detach', build_directory, tag], repository, timeout)
+        _run(['make', f"-j{jobs}", *make_flags], build_directory, timeout)
+
+        compiled_version = cpp_check_version(binary, refresh=True)
+        # e.g. 2.13.0 reports itself as 'Cppcheck 2.13.0', 2.10.0 as 'Cppcheck 2.10'
+        if (tag[:-2] if tag.endswith('.0') else tag) not in compiled_version:
+            raise CppCheckBuildError(f"Built {compiled_version} instead of {tag} in {build_directory}")
+        with open(marker, 'w') as f:
+            f.write(compiled_version)
+    print(f"Built {compiled_version} in {build_directory}", flush=True)
+    return binary
+
+
+def get_builds(builds_directory=BUILDS_DIRECTORY) -> dict:
+    "Returns the complete builds as a dictionary mapping the name of the build directory to its cppcheck --version"
+    builds = {}
+    if not os.path.isdir(builds_directory):
+        return builds
+    for name in sorted(os.listdir(builds_directory)):
+        marker = os.path.join(builds_directory, name, _BUILT_MARKER)
+        if os.path.exists(marker):
+            with open(marker) as f:
+                builds[name] = f.read().strip()
+    return builds
@@ -0,0 +1,85 @@
+"""
+A persistent, content-addressed cache of cppcheck results.
+
+Many PostBlockVersion rows share their content: unchanged blocks across versions, duplicated answers and the
+snippets present in both the 2018 and the 2022 dump. What cppcheck reports for a snippet only depends on its
+content, its language, the version of cppcheck and the flags it runs with, so the parsed results of
+run_cpp_check() and run_cpp_check_batch() are stored in a DiskCache under the SHA-256 of these four and
+cppcheck is only spawned for content that was never analyzed before.
+
+The cache is enabled with use_cpp_check_cache() or the CPPCHECK_CACHE environment variable, e.g.:
+
+    CPPCHECK_CACHE=data/cppcheck_cache.sqlite python sources/case_study_1/weakness_detection.py
+
+Every process opens its own connection to the SQLite file, so the cache can be enabled before a
+multiprocessing Pool is created.
+"""
+import hashlib
+import os
+
+from sources.cache import DiskCache, MISSING
+from sources.util import Command
+
+_cache_path = os.environ.get('CPPCHECK_CACHE')
+_cache = None
+_cache_pid = None
+# binary -> output of <binary> --version
+_versions = {}
+
+
+def use_cpp_check_cache(path='data/cppcheck_cache.sqlite'):
+    "Enables the cache stored in the given SQLite file. Passing None disables it"
+    global _cache_path, _cache
+    _cache_path = path
+    _cache = None
+
+
+def get_cpp_check_cache():
+    "Returns the DiskCache of the current process, or None if the cache is not enabled"
+    global _cache, _cache_pid
+    if _cache_path is None:
+        return None
+    if _cache is None or _cache_pid != os.getpid():
+        # a connection inherited from the parent process must not be used after a fork
+        _cache = DiskCache(_cache_path)
+        _cache_pid = os.getpid()
+    return _cache
+
+
+def cpp_check_version(binary='./cppcheck', refresh=False) -> str:
+    """
+    Returns the output of `binary --version`, e.g. 'Cppcheck 2.13.0'. The binary runs once per process;
+    pass refresh after compiling another version in place.
+    """
+    if refresh or binary not in _versions:
+        rc, out, error = Command([binary, '--version']).run()
+        _versions[binary] = (out or '').strip()
+    return _versions[binary]
+
+
+def result_key(snippet_file: str, language: str, version: str, flags=()) -> str:
+    """
+    Returns the cache key of the results of cppcheck on the given file, or None if the file cannot be read.
+    """
+    try:
+        with open(snippet_file, 'rb') as f:
+            content_hash = hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+    key = '\x00'.join([content_hash, language, version, ' '.join(flags)])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def get_results(key: str):
+    "Returns the cached list of results for the key, or None on a miss or if the cache is not enabled"
+    cache = get_cpp_check_cache()
+    if cache is None or key is None:
+        return None
+    results = cache.get(key)
+    return None if results is MISSING else results
+
+
+def put_results(key: str, results: list):
+    cache = get_cpp_check_cache()
+    if cache is not None and key is not None:
+        cache.put(key, results)
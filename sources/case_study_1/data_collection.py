@@ -28,18 +28,19 @@ def main():
     print(f"Processing {len(records)} records", flush=True)
     qs = QueryService()
     qs.connect(db_name='sotorrent22')
-    query = """INSERT INTO CodeBlockVersionHaoxiangZhang(PostId, PostBlockVersionId, RootPostBlockVersionId, Language, DataSetReleaseDate)
-               VALUES(%s, %s, %s, %s, %s)"""
+    columns = ['PostId', 'PostBlockVersionId', 'RootPostBlockVersionId', 'Language', 'DataSetReleaseDate']
 
     ds_release_date = date(2022, 6, 30) if year == 2022 else date(2018, 12, 9)
-    for record in records:
-        source_code = record['Content']
-        language = get_language(source_code)  # if language is None, then no assignment was possible
-
-        snippet_id = record['PostBlockVersionId']
-        root_id = record['RootPostBlockVersionId']
-        post_id = record['PostId']
-        qs.execute_insert_and_commit(query, [(post_id, snippet_id, root_id, language, ds_release_date)])
+    with qs.bulk_loader('CodeBlockVersionHaoxiangZhang', columns) as loader:
+        for record in records:
+            source_code = record['Content']
+            language = get_language(source_code)  # if language is None, then no assignment was possible
+
+            snippet_id = record['PostBlockVersionId']
+            root_id = record['RootPostBlockVersionId']
+            post_id = record['PostId']
+            loader.add((post_id, snippet_id, root_id, language, ds_release_date))
+    print(loader.summary(), flush=True)
 
     qs.close()
 
@@ -1,6 +1,7 @@
+from itertools import islice
 from multiprocessing import Pool
 
-from case_studies.src.code_weakness_paper.util import get_code_snippets
+from sources.case_study_1.util import get_code_snippets
 
 
 def write_task(record: dict):
@@ -22,9 +23,15 @@ def write_task(record: dict):
 
 def main():
     year = 2022
-    records = get_code_snippets(year)
+    # stream the snippets from the DB and hand them to the workers one batch at a time,
+    # so that at most one batch of snippet bodies is held in memory
+    records = get_code_snippets(year, stream=True)
     with Pool(processes=50) as pool:
-        pool.map(write_task, records)
+        while True:
+            batch = list(islice(records, 10000))
+            if not batch:
+                break
+            pool.map(write_task, batch)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,92 @@
+"""
+A run manifest for weakness_detection.py.
+
+Every snippet file analyzed with a cppcheck version on a dataset is a unit of work. Once the rows of a unit are
+committed to CppCheckWeakness, the unit is recorded in a local SQLite file, so an interrupted run can be started
+again and only analyzes the units that are missing, e.g.:
+
+    manifest = RunManifest('data/weakness_detection_manifest.sqlite')
+    completed = manifest.completed_files(2.13, ds_release_date)
+    snippet_files = [snippet_file for snippet_file in snippet_files if snippet_file not in completed]
+    ...
+    manifest.mark_completed(snippet_files, 2.13, ds_release_date)
+
+Units are recorded after their rows are committed. weakness_detection.py deletes the rows of the units of a batch
+in the transaction that inserts them, so a batch interrupted between the commit and the manifest is analyzed
+again by the next run without duplicating its rows. Files cppcheck could not analyze are not recorded.
+"""
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+
+def _dataset(ds_release_date: datetime) -> str:
+    return ds_release_date.strftime('%Y-%m-%d')
+
+
+class RunManifest():
+    """
+    Args:
+        path: The SQLite file of the manifest. Every process opens its own connection to it, so a manifest
+            created before a multiprocessing Pool can be used by the workers.
+    """
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None or self._pid != os.getpid():
+            # a connection inherited from the parent process must not be used after a fork
+            self._connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False, isolation_level=None)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS CompletedUnits(
+                                          File TEXT NOT NULL,
+                                          Version TEXT NOT NULL,
+                                          DataSet TEXT NOT NULL,
+                                          CompletedAt REAL NOT NULL,
+                                          PRIMARY KEY (Version, DataSet, File))""")
+            self._pid = os.getpid()
+        return self._connection
+
+    def completed_files(self, version: float, ds_release_date: datetime) -> set:
+        "Returns the files that were analyzed with the given cppcheck version on the given dataset"
+        with self._lock:
+            rows = self.connection.execute('SELECT File FROM CompletedUnits WHERE Version=? AND DataSet=?',
+                                           (str(version), _dataset(ds_release_date))).fetchall()
+        return {row[0] for row in rows}
+
+    def is_completed(self, snippet_file: str, version: float, ds_release_date: datetime) -> bool:
+        with self._lock:
+            row = self.connection.execute('SELECT 1 FROM CompletedUnits WHERE Version=? AND DataSet=? AND File=?',
+                                          (str(version), _dataset(ds_release_date), snippet_file)).fetchone()
+        return row is not None
+
+    def mark_completed(self, snippet_files: list, version: float, ds_release_date: datetime):
+        "Records the given files as analyzed with the given cppcheck version on the given dataset"
+        completed_at = time.time()
+        units = [(snippet_file, str(version), _dataset(ds_release_date), completed_at) for snippet_file in snippet_files]
+        with self._lock:
+            connection = self.connection
+            connection.execute('BEGIN')
+            connection.executemany("""INSERT OR IGNORE INTO CompletedUnits(File, Version, DataSet, CompletedAt)
+                                      VALUES (?, ?, ?, ?)""", units)
+            connection.execute('COMMIT')
+
+    def close(self):
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
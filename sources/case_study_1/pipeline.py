@@ -0,0 +1,288 @@
+"""
+A streaming pipeline from SOTorrent to the CppCheckWeakness table.
+
+Instead of writing all snippets to disk first (download_snippets.py), then analyzing the directories
+(weakness_detection.py) and inserting the rows of every task on its own, the stages run concurrently and hand
+batches to each other through bounded queues:
+
+    read the snippets from the DB (get_code_snippets(stream=True))
+      -> write them as .c and .cpp files to a scratch directory on tmpfs
+      -> run cppcheck on batches of files, `workers` batches at a time (run_cpp_check_batch())
+      -> load the weaknesses into CppCheckWeakness (BulkLoader)
+
+A stage that gets ahead of the next one blocks once the queue between them is full, so at most a few batches
+of snippets are held in memory or in the scratch directory. The throughput of every stage and the time it
+waited for the next one are reported while the pipeline runs, e.g.:
+
+    python -m sources.case_study_1.pipeline --year 2022 --version 2.13 --workers 48
+
+The command line builds the requested version with cppcheck_builds.build_cpp_check() (or reuses its build), so
+pipelines of different versions can run at the same time.
+"""
+import argparse
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sources.case_study_1.cppcheck_builds import build_cpp_check
+from sources.case_study_1.util import get_code_snippets, run_cpp_check_batch
+from sources.queryservice import QueryService
+
+COLUMNS = ['Language', 'PostId', 'RootPostBlockVersionId', 'PostBlockVersionId', 'CWE', 'MessageId', 'Severity',
+           'Message', 'DataSetReleaseDate', 'IsGuesslangUsed', 'Version']
+
+DATASET_RELEASE_DATES = {2018: datetime(2018, 12, 9), 2022: datetime(2022, 6, 30)}
+
+# every snippet is analyzed both as C and as C++
+LANGUAGES = {'c': 'C', 'cpp': 'C++'}
+
+# marks the end of the items of a queue
+_DONE = object()
+
+
+class StageStats():
+    "Counts the items a stage processed, the time it spent working and the time it waited for the next stage"
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items=0, busy_seconds=0.0, blocked_seconds=0.0):
+        with self._lock:
+            self.items += items
+            self.busy_seconds += busy_seconds
+            self.blocked_seconds += blocked_seconds
+
+    def summary(self, elapsed: float) -> str:
+        rate = self.items / elapsed if elapsed > 0 else 0.0
+        return (f"{self.name}: {self.items} {self.unit} ({rate:.0f}/s), busy {self.busy_seconds:.0f}s, "
+                f"blocked {self.blocked_seconds:.0f}s")
+
+
+def default_scratch_directory() -> str:
+    "Returns a new directory on tmpfs (/dev/shm) if available, otherwise in the default temporary directory"
+    return tempfile.mkdtemp(prefix='cppcheck_snippets_', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+
+class WeaknessPipeline():
+    """
+    Args:
+        version: The version of cppcheck stored with the weaknesses.
+        ds_release_date: The release date of the SOTorrent dataset the snippets come from.
+        workers: The number of cppcheck processes running at the same time.
+        batch_size: The number of snippets per batch; cppcheck runs once per batch and language.
+        queue_size: The number of batches that may wait between two stages.
+        jobs: The -j of every cppcheck process.
+        timeout: The time cppcheck may take on a single file; batches get more, see run_cpp_check_batch().
+        scratch_directory: Where the snippet files are written. Defaults to a new directory on tmpfs.
+        report_every: The interval in seconds of the throughput reports.
+        cppcheck: The cppcheck binary, e.g. built with build_cpp_check(version). Defaults to the checked out cppcheck.
+    """
+    def __init__(self, version: float, ds_release_date: datetime, workers=8, batch_size=200, queue_size=4, jobs=1,
+                 timeout=300, scratch_directory=None, is_guesslang_used=False, report_every=60, cppcheck='./cppcheck'):
+        self.version = version
+        self.ds_release_date = ds_release_date
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.jobs = jobs
+        self.timeout = timeout
+        self.scratch_directory = scratch_directory
+        self.is_guesslang_used = is_guesslang_used
+        self.report_every = report_every
+        self.cppcheck = cppcheck
+        self.stats = [StageStats('read', 'snippets'), StageStats('write', 'files'),
+                      StageStats('cppcheck', 'files'), StageStats('load', 'rows')]
+        self._stop = threading.Event()
+        self._errors = []
+
+    def run(self, records, qs: QueryService) -> int:
+        """
+        Analyzes the given snippet records (with PostId, RootPostBlockVersionId, PostBlockVersionId and Content)
+        and loads their weaknesses through the connected QueryService. Returns the number of rows loaded.
+        """
+        read_stats, write_stats, cppcheck_stats, load_stats = self.stats
+        scratch_directory = self.scratch_directory or default_scratch_directory()
+        os.makedirs(scratch_directory, exist_ok=True)
+        record_batches = queue.Queue(self.queue_size)
+        file_batches = queue.Queue(self.queue_size)
+        row_batches = queue.Queue(self.queue_size)
+        threads = [threading.Thread(target=self._run_stage, args=(self._read, records, record_batches, read_stats)),
+                   threading.Thread(target=self._run_stage,
+                                    args=(self._write, record_batches, file_batches, scratch_directory, write_stats))]
+        threads.extend(threading.Thread(target=self._run_stage,
+                                        args=(self._analyze, file_batches, row_batches, cppcheck_stats))
+                       for _ in range(self.workers))
+        started = time.perf_counter()
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            row_count = self._load(row_batches, qs, load_stats, started)
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            for thread in threads:
+                thread.join()
+            if self.scratch_directory is None:
+                shutil.rmtree(scratch_directory, ignore_errors=True)
+        if self._errors:
+            raise self._errors[0]
+        self.report(time.perf_counter() - started)
+        return row_count
+
+    def report(self, elapsed: float):
+        for stage_stats in self.stats:
+            print(stage_stats.summary(elapsed), flush=True)
+
+    def _run_stage(self, target, *args):
+        try:
+            target(*args)
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+
+    def _put(self, queue_: queue.Queue, item, stats: StageStats):
+        # blocks while the next stage is behind, unless another stage failed
+        started = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                queue_.put(item, timeout=1)
+                break
+            except queue.Full:
+                continue
+        stats.add(blocked_seconds=time.perf_counter() - started)
+
+    def _get(self, queue_: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return queue_.get(timeout=1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _read(self, records, record_batches: queue.Queue, stats: StageStats):
+        records = iter(records)
+        try:
+            while not self._stop.is_set():
+                started = time.perf_counter()
+                batch = [record for _, record in zip(range(self.batch_size), records)]
+                stats.add(len(batch), busy_seconds=time.perf_counter() - started)
+                if not batch:
+                    break
+                self._put(record_batches, batch, stats)
+        finally:
+            try:
+                # closes the connection of a streamed query that was not read to its end
+                if hasattr(records, 'close'):
+                    records.close()
+            finally:
+                self._put(record_batches, _DONE, stats)
+
+    def _write(self, record_batches: queue.Queue, file_batches: queue.Queue, scratch_directory: str,
+               stats: StageStats):
+        try:
+            for batch in iter(lambda: self._get(record_batches), _DONE):
+                started = time.perf_counter()
+                files = []
+                for record in batch:
+                    ids = (record['PostId'], record['RootPostBlockVersionId'], record['PostBlockVersionId'])
+                    for file_ext, language in LANGUAGES.items():
+                        snippet_file = os.path.join(scratch_directory, f"{ids[0]}_{ids[1]}_{ids[2]}.{file_ext}")
+                        with open(snippet_file, 'w') as f:
+                            f.write(record['Content'])
+                        files.append((snippet_file, language, ids))
+                stats.add(len(files), busy_seconds=time.perf_counter() - started)
+                self._put(file_batches, files, stats)
+        finally:
+            for _ in range(self.workers):
+                self._put(file_batches, _DONE, stats)
+
+    def _analyze(self, file_batches: queue.Queue, row_batches: queue.Queue, stats: StageStats):
+        try:
+            for files in iter(lambda: self._get(file_batches), _DONE):
+                started = time.perf_counter()
+                results = run_cpp_check_batch([snippet_file for snippet_file, _, _ in files], timeout=self.timeout,
+                                              jobs=self.jobs, batch_size=len(files), cppcheck=self.cppcheck)
+                rows = set()
+                for snippet_file, language, ids in files:
+                    # files cppcheck could not analyze (None) get no rows
+                    rows.update(self._to_rows(language, ids, results.get(snippet_file) or []))
+                    os.remove(snippet_file)
+                stats.add(len(files), busy_seconds=time.perf_counter() - started)
+                self._put(row_batches, list(rows), stats)
+        finally:
+            self._put(row_batches, _DONE, stats)
+
+    def _to_rows(self, language: str, ids: tuple, results: list) -> set:
+        post_id, root_id, snippet_id = ids
+        return {(language, post_id, root_id, snippet_id, result['cwe'], result['message_id'], result['severity'],
+                 result['message'], self.ds_release_date, self.is_guesslang_used, self.version)
+                for result in results}
+
+    def _load(self, row_batches: queue.Queue, qs: QueryService, stats: StageStats, started: float) -> int:
+        reported = time.perf_counter()
+        finished_workers = 0
+        with qs.bulk_loader('CppCheckWeakness', COLUMNS) as loader:
+            while finished_workers < self.workers:
+                rows = self._get(row_batches)
+                if rows is _DONE:
+                    if self._stop.is_set():
+                        # another stage failed: drop the buffered rows
+                        raise self._errors[0]
+                    finished_workers += 1
+                    continue
+                load_started = time.perf_counter()
+                loader.add_many(rows)
+                stats.add(len(rows), busy_seconds=time.perf_counter() - load_started)
+                if time.perf_counter() - reported >= self.report_every:
+                    reported = time.perf_counter()
+                    self.report(reported - started)
+        return loader.row_count
+
+
+def run_pipeline(year: int, version: float, **kwargs) -> int:
+    """
+    Streams the C/C++ snippets of the given dataset year through a WeaknessPipeline (kwargs are passed to it) and
+    returns the number of weaknesses loaded into CppCheckWeakness of sotorrent22.
+    """
+    records = get_code_snippets(year, stream=True)
+    qs = QueryService()
+    qs.connect(db_name='sotorrent22')
+    try:
+        pipeline = WeaknessPipeline(version, DATASET_RELEASE_DATES[year], **kwargs)
+        return pipeline.run(records, qs)
+    finally:
+        qs.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs cppcheck on the C/C++ snippets of SOTorrent and loads the '
+                                                 'weaknesses into CppCheckWeakness')
+    parser.add_argument('--year', type=int, choices=sorted(DATASET_RELEASE_DATES), default=2022)
+    parser.add_argument('--version', type=float, required=True, help='the version of cppcheck to build and run')
+    parser.add_argument('--cppcheck', default=None, help='run this cppcheck binary instead of building the version')
+    parser.add_argument('--workers', type=int, default=8, help='cppcheck processes running at the same time')
+    parser.add_argument('--batch-size', type=int, default=200, help='snippets per cppcheck process')
+    parser.add_argument('--queue-size', type=int, default=4, help='batches that may wait between two stages')
+    parser.add_argument('--scratch', default=None, help='directory for the snippet files (default: tmpfs)')
+    parser.add_argument('--report-every', type=float, default=60, help='seconds between throughput reports')
+    args = parser.parse_args()
+
+    cppcheck = args.cppcheck or build_cpp_check(args.version)
+    row_count = run_pipeline(args.year, args.version, workers=args.workers, batch_size=args.batch_size,
+                             queue_size=args.queue_size, scratch_directory=args.scratch,
+                             report_every=args.report_every, cppcheck=cppcheck)
+    print(f"Loaded {row_count} weaknesses", flush=True)
+
+
+if __name__ == '__main__':
+    main()
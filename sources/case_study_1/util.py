@@ -1,10 +1,24 @@
+import os
+import tempfile
+
 from sources.util import Command
 from sources.queryservice import QueryService
+from sources.case_study_1.cppcheck_builds import CPPCHECK_REPOSITORY
+from sources.case_study_1.cppcheck_cache import cpp_check_version, result_key, get_results, put_results
+
+# separates the fields of the --template used by run_cpp_check_batch(); file names and messages may contain ':'
+_BATCH_FIELD_SEPARATOR = ':::'
+_BATCH_TEMPLATE = _BATCH_FIELD_SEPARATOR.join(['{file}', '{cwe}', '{id}', '{severity}', '{message}'])
+# the time a batch of files is given in addition to the timeout, per further file and -j job
+BATCH_SECONDS_PER_FILE = 5
+# flags that change what cppcheck reports; they are part of the key of the cached results
+CPP_CHECK_FLAGS = []
 
 
 def checkout_and_compile(version: float):
     """
     Checks out the given cppcheck version (using Git) and compiles that version (using Make).
+    To keep several versions built side by side, use cppcheck_builds.build_cpp_check() instead.
 
     This is equivalent to:
     $ git checkout 2.13.0
@@ -25,22 +39,30 @@ def checkout_and_compile(version: float):
     make_clean.run()
     make_command = Command('make')
     make_command.run()
-    cpp_check_version = Command('./cppcheck --version')
-    rc, out, error = cpp_check_version.run()
+    # also replaces the version the cached results of this process are keyed by
+    out = cpp_check_version(refresh=True)
     compiled_version = float(out.split(' ', 1)[-1].strip())
     return compiled_version
 
 
-def run_cpp_check(snippet_file: str, timeout=300) -> list:
+def run_cpp_check(snippet_file: str, timeout=300, cppcheck='./cppcheck') -> list:
     """
     Runs the currently checkedout and compiled version of cppcheck on the given snippet file and returns
     a list of dictionary containing the results. When the cppcheck analyzer takes
     longer than the configured timeout value, its process is terminated.
+
+    If the cppcheck cache is enabled (see cppcheck_cache.py), cppcheck only runs on content it has not analyzed before.
+    Pass the path of another binary as cppcheck to run a version built with cppcheck_builds.build_cpp_check().
     """
 
     # run cppcheck --language=c --template={cwe}:{id}:{severity}:{message}
-    language = 'c++' if snippet_file.endswith('.cpp') else 'c'
-    arguments = ['./cppcheck', f"--language={language}", '--template={cwe}:{id}:{severity}:{message}', snippet_file]
+    language = _get_language(snippet_file)
+    key = result_key(snippet_file, language, cpp_check_version(cppcheck), CPP_CHECK_FLAGS)
+    cached_results = get_results(key)
+    if cached_results is not None:
+        return cached_results
+    arguments = [cppcheck, f"--language={language}", '--template={cwe}:{id}:{severity}:{message}',
+                 *CPP_CHECK_FLAGS, snippet_file]
     command = Command(arguments)
     rc, out, error = command.run(timeout)
     results = []
@@ -55,16 +77,169 @@ def run_cpp_check(snippet_file: str, timeout=300) -> list:
     for line in cpp_check_results:
         template_parts = line.split(':', 3)
         assert len(template_parts) == 4
-        results.append({'cwe': int(template_parts[0]),
-                        'message_id': template_parts[1],
-                        'severity': template_parts[2],
-                        'message': template_parts[3]})
+        results.append(_to_cpp_check_result(template_parts))
+    put_results(key, results)
     return results
 
 
-def get_code_snippets(year: int):
+def _to_cpp_check_result(template_parts: list) -> dict:
+    return {'cwe': int(template_parts[0]),
+            'message_id': template_parts[1],
+            'severity': template_parts[2],
+            'message': template_parts[3]}
+
+
+def _get_language(snippet_file: str) -> str:
+    return 'c++' if snippet_file.endswith('.cpp') else 'c'
+
+
+def run_cpp_check_batch(snippet_files: list, timeout=300, jobs=1, batch_size=1000, cppcheck='./cppcheck',
+                        seconds_per_file=BATCH_SECONDS_PER_FILE) -> dict:
+    """
+    Runs the currently checkedout and compiled version of cppcheck (or the binary passed as cppcheck) on many
+    snippet files, batch_size files per cppcheck process (passed with --file-list and analyzed with -j jobs), and
+    returns a dictionary mapping each snippet file to its list of results (see run_cpp_check()), or to None if
+    cppcheck could not analyze it.
+
+    timeout is the time a single file may take. A batch of n files is given
+    timeout + seconds_per_file * (n - 1) / jobs seconds. When a batch takes longer, the files cppcheck completed
+    keep their results, the files it was working on run alone with the timeout and the files it did not start on
+    run as a new batch, so a file that hangs cppcheck costs one batch timeout and its own timeout. A batch that
+    fails is split in half and the halves are run again, until the failing file runs alone. Unlike run_cpp_check(),
+    a file that hangs or fails on its own is mapped to None instead of an empty list, so callers can tell it from a
+    file without weaknesses and analyze it again later.
+
+    If the cppcheck cache is enabled (see cppcheck_cache.py), only one file per content not analyzed before is passed
+    to cppcheck; the other files get the cached results or those of the file with the same content.
+    """
+    version = cpp_check_version(cppcheck)
+    results = {}
+    # language -> key -> files with that content, for the files without cached results
+    files_by_language = {}
+    for snippet_file in snippet_files:
+        language = _get_language(snippet_file)
+        key = result_key(snippet_file, language, version, CPP_CHECK_FLAGS)
+        cached_results = get_results(key)
+        if cached_results is not None:
+            results[snippet_file] = cached_results
+        else:
+            # files that cannot be read (key None) are passed to cppcheck one by one
+            files_by_key = files_by_language.setdefault(language, {})
+            files_by_key.setdefault(key or snippet_file, []).append(snippet_file)
+
+    for language, files_by_key in files_by_language.items():
+        files = {duplicates[0]: key for key, duplicates in files_by_key.items()}
+        analyzed_files = list(files)
+        for start in range(0, len(analyzed_files), batch_size):
+            batch_results = _run_cpp_check_files(analyzed_files[start:start + batch_size], language, timeout, jobs,
+                                                 cppcheck, seconds_per_file)
+            for snippet_file, file_results in batch_results.items():
+                key = files[snippet_file]
+                # terminated or failed files (None) are not cached, so they are analyzed again in the next run
+                if file_results is not None and key != snippet_file:
+                    put_results(key, file_results)
+                for duplicate in files_by_key[key]:
+                    results[duplicate] = file_results
+    return results
+
+
+def _batch_timeout(file_count: int, timeout: int, jobs: int, seconds_per_file: float) -> float:
+    return timeout + seconds_per_file * (file_count - 1) / max(jobs, 1)
+
+
+def _path_key(snippet_file: str) -> str:
+    # cppcheck runs in the checkout and may print the files of the file list in another form, e.g. without ./
+    return os.path.realpath(os.path.join(CPPCHECK_REPOSITORY, snippet_file))
+
+
+def _checked_file(line: str):
+    # cppcheck prints 'Checking <file> ...' (or 'Checking <file>: <configuration>...') when it starts on a file
+    if not line.startswith('Checking ') or not line.endswith('...'):
+        return None
+    return line[len('Checking '):-len('...')].strip().split(': ', 1)[0]
+
+
+def _parse_batch_output(out: str, snippet_files: list) -> tuple:
+    """
+    Returns the results of every snippet file in the output of a batch and the files cppcheck started on, in the
+    order it started on them.
+    """
+    results = {snippet_file: [] for snippet_file in snippet_files}
+    started = {}
+    files_by_path = {_path_key(snippet_file): snippet_file for snippet_file in snippet_files}
+    for line in out.split('\n'):
+        checked_file = _checked_file(line)
+        if checked_file is not None:
+            if _path_key(checked_file) in files_by_path:
+                started.setdefault(files_by_path[_path_key(checked_file)])
+            continue
+        template_parts = line.split(_BATCH_FIELD_SEPARATOR, 4)
+        if len(template_parts) != 5:
+            continue
+        snippet_file = files_by_path.get(_path_key(template_parts[0])) if template_parts[0] else None
+        if snippet_file is None:
+            # e.g. messages about the configuration, which have no file
+            print(f"DEBUG (Unmatched output of a batch of {len(snippet_files)} files): {line}", flush=True)
+            if len(snippet_files) > 1:
+                continue
+            # the only file of a single-file batch gets them, as with run_cpp_check()
+            snippet_file = snippet_files[0]
+        results[snippet_file].append(_to_cpp_check_result(template_parts[1:]))
+    return results, list(started)
+
+
+def _run_cpp_check_files(snippet_files: list, language: str, timeout: int, jobs: int, cppcheck: str,
+                         seconds_per_file=BATCH_SECONDS_PER_FILE) -> dict:
+    batch_timeout = _batch_timeout(len(snippet_files), timeout, jobs, seconds_per_file)
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as file_list:
+        file_list.write('\n'.join(snippet_files))
+    try:
+        # without --quiet, cppcheck reports the file it starts on, so a terminated batch shows its progress
+        arguments = [cppcheck, f"--language={language}", f"--template={_BATCH_TEMPLATE}", f"-j{jobs}",
+                     *CPP_CHECK_FLAGS, f"--file-list={file_list.name}"]
+        command = Command(arguments)
+        rc, out, error = command.run(batch_timeout, workdir=CPPCHECK_REPOSITORY)
+    finally:
+        os.remove(file_list.name)
+
+    def run(files):
+        return _run_cpp_check_files(files, language, timeout, jobs, cppcheck, seconds_per_file)
+
+    if command.is_terminated and len(snippet_files) > 1:
+        # the files cppcheck started on before the last `jobs` ones are complete and keep their results; the
+        # last ones (or the first ones, if it started on none) may hang and run alone with the timeout of a file,
+        # the files it did not start on run as a new batch
+        batch_results, started = _parse_batch_output(out or '', snippet_files)
+        suspects = started[-jobs:] or snippet_files[:jobs]
+        results = {snippet_file: batch_results[snippet_file] for snippet_file in started[:-len(suspects)]}
+        for suspect in suspects:
+            results.update(run([suspect]))
+        remaining_files = [snippet_file for snippet_file in snippet_files
+                           if snippet_file not in results and snippet_file not in suspects]
+        if remaining_files:
+            results.update(run(remaining_files))
+        return results
+    if command.is_terminated or rc != 0:
+        if len(snippet_files) > 1:
+            middle = len(snippet_files) // 2
+            results = run(snippet_files[:middle])
+            results.update(run(snippet_files[middle:]))
+            return results
+        if command.is_terminated:
+            print(f"""CPPCheck terminated: Took longer than {timeout} on {snippet_files[0]}""", flush=True)
+        else:
+            print(f"DEBUG (Return Code): {rc}, Error: {error}", flush=True)
+        # None marks the file as not analyzed, see run_cpp_check_batch()
+        return {snippet_files[0]: None}
+    return _parse_batch_output(out, snippet_files)[0]
+
+
+def get_code_snippets(year: int, stream: bool = False):
     """
     Retrieve all code snippets with at least 5 LoC from answers tagged with C/C++.
+
+    When stream is True, a generator is returned that reads the snippets from the DB in batches
+    instead of loading all of them into memory.
     """
     qs = QueryService()
     if year == 2018:
@@ -77,7 +252,7 @@ def get_code_snippets(year: int):
         qs.connect(db_name='sotorrent22')
         posts_table = 'Posts'
 
-    r = qs.execute_and_fetchall(f"""SELECT Answers.PostId AS PostId, RootPostBlockVersionId, pbv.Id AS PostBlockVersionId, Content
+    query = f"""SELECT Answers.PostId AS PostId, RootPostBlockVersionId, pbv.Id AS PostBlockVersionId, Content
                                     FROM PostBlockVersion pbv
                                     INNER JOIN (SELECT distinct(Id) as PostId from {posts_table}
                                                 WHERE PostTypeId=2 AND ParentId IN 
@@ -87,11 +262,21 @@ def get_code_snippets(year: int):
                                     ON pbv.PostId=Answers.PostId 
                                     WHERE PostBlockTypeId=2 AND (PredEqual=0 OR PredEqual IS NULL) AND LineCount >= 5;
                                     GROUP BY PostId, RootPostBlockVersionId, PostBlockVersionId
-                                """)
+                                """
+    if stream:
+        return _stream_and_close(qs, query)
+    r = qs.execute_and_fetchall(query)
     qs.close()
     return r
 
 
+def _stream_and_close(qs: QueryService, query: str):
+    try:
+        yield from qs.execute_and_stream(query)
+    finally:
+        qs.close()
+
+
 def get_root_id(post_id: int, qs: QueryService, qs_3307: QueryService):
     q = f"""SELECT RootPostBlockVersionId
             FROM PostBlockVersion 
@@ -6,9 +6,13 @@ import os
 from datetime import datetime
 from multiprocessing.pool import Pool
 
-from util import run_cpp_check, checkout_and_compile
+from util import run_cpp_check, run_cpp_check_batch
+from sources.case_study_1.cppcheck_builds import build_cpp_check
+from sources.case_study_1.cppcheck_cache import use_cpp_check_cache
+from sources.case_study_1.manifest import RunManifest
 from sources.util import Command
 from sources.queryservice import QueryService
+from sources.sotorrent import init_process_pool, get_process_pool
 
 
 def write_to_file(records: tuple, year: int, version: float) -> None:
@@ -25,19 +29,85 @@ def write_to_file(records: tuple, year: int, version: float) -> None:
             writer.writerow((post_id, root_id, snippet_id, cwe))
 
 
+INSERT_QUERY = f"""INSERT INTO CppCheckWeakness(Language, PostId, RootPostBlockVersionId, PostBlockVersionId, 
+    CWE, MessageId, Severity, Message, DataSetReleaseDate, IsGuesslangUsed, Version) VALUES(%s, %s, %s, %s, %s, %s, %s, %s, 
+    %s, %s, %s) """
+
+# the rows of a snippet file analyzed with a cppcheck version on a dataset, see _replace_rows()
+DELETE_QUERY = """DELETE FROM CppCheckWeakness WHERE Language=%s AND PostBlockVersionId=%s AND DataSetReleaseDate=%s
+    AND IsGuesslangUsed=%s AND Version=%s"""
+
+
 def cppcheck_task(input_: tuple):
     version, ds_release_date, snippet_file = input_
     results = run_cpp_check(snippet_file)
+    _insert_rows(get_rows_to_insert(version, ds_release_date, snippet_file, results))
+
+
+def cppcheck_batch_task(input_: tuple):
+    """
+    Runs cppcheck once for a whole batch of snippet files and replaces the weaknesses of the analyzed files.
+    The analyzed files are then recorded as completed in the run manifest; files cppcheck could not analyze are
+    left for the next run.
+    """
+    version, cppcheck, ds_release_date, snippet_files = input_
+    results = run_cpp_check_batch(snippet_files, cppcheck=cppcheck)
+    analyzed_files = [snippet_file for snippet_file, file_results in results.items() if file_results is not None]
     rows_to_insert = set()
-    insert_query = f"""INSERT INTO CppCheckWeakness(Language, PostId, RootPostBlockVersionId, PostBlockVersionId, 
-    CWE, MessageId, Severity, Message, DataSetReleaseDate, IsGuesslangUsed, Version) VALUES(%s, %s, %s, %s, %s, %s, %s, %s, 
-    %s, %s, %s) """
+    for snippet_file in analyzed_files:
+        rows_to_insert.update(get_rows_to_insert(version, ds_release_date, snippet_file, results[snippet_file]))
+    _replace_rows([get_unit_key(version, ds_release_date, snippet_file) for snippet_file in analyzed_files],
+                  rows_to_insert)
+    manifest.mark_completed(analyzed_files, version, ds_release_date)
+
+
+def _insert_rows(rows_to_insert: set):
+    if rows_to_insert:
+        qs = QueryService()
+        qs.connect(pool=get_process_pool())
+        qs.execute_insert_and_commit(INSERT_QUERY, list(rows_to_insert))
+        qs.close()
+
+
+def _replace_rows(unit_keys: list, rows_to_insert: set):
+    """
+    Deletes the rows of the given units (see get_unit_key()) and inserts the given rows in one transaction, so the
+    rows of a batch that was inserted before its files were recorded in the manifest are not inserted twice.
+    """
+    if not unit_keys:
+        return
+    qs = QueryService()
+    qs.connect(pool=get_process_pool())
+    try:
+        qs.client.cursor.executemany(DELETE_QUERY, unit_keys)
+        if rows_to_insert:
+            qs.execute_insert_and_commit(INSERT_QUERY, list(rows_to_insert))
+        else:
+            qs.commit()
+    finally:
+        qs.close()
+
+
+def _parse_snippet_file(snippet_file: str) -> tuple:
+    "Returns the language, PostId, RootPostBlockVersionId and PostBlockVersionId of a snippet file"
     # remove the base path
     file_name = snippet_file.rsplit('/', 1)[-1]
     # remove file extension
     file_name, file_ext = file_name.split('.')
     language = 'C++' if file_ext == 'cpp' else 'C'
     post_id, root_id, snippet_id = tuple(map(int, file_name.split('_')))
+    return language, post_id, root_id, snippet_id
+
+
+def get_unit_key(version: float, ds_release_date: datetime, snippet_file: str) -> tuple:
+    "Returns the parameters of DELETE_QUERY matching the rows of the given snippet file"
+    language, _, _, snippet_id = _parse_snippet_file(snippet_file)
+    return language, snippet_id, ds_release_date, is_guesslang_used, version
+
+
+def get_rows_to_insert(version: float, ds_release_date: datetime, snippet_file: str, results: list) -> set:
+    rows_to_insert = set()
+    language, post_id, root_id, snippet_id = _parse_snippet_file(snippet_file)
 
     for result_dict in results:
         cwe = result_dict.get('cwe')
@@ -47,29 +117,37 @@ def cppcheck_task(input_: tuple):
         rows_to_insert.add(
             (language, post_id, root_id, snippet_id, cwe, message_id, severity, message, ds_release_date,
              is_guesslang_used, version))
-
-    if rows_to_insert:
-        qs = QueryService()
-        qs.connect(db_name='sotorrent22')
-        qs.execute_insert_and_commit(insert_query, list(rows_to_insert))
-        qs.close()
+    return rows_to_insert
 
 
 def main():
-    for version in [1.86, 2.13]:
-        compiled_version = checkout_and_compile(version)
-        if version in compiled_version:
-            for ds_release_date in [datetime(2018, 12, 9), datetime(2022, 6, 30)]:
-                year = ds_release_date.year
-                print(f"Running Cppcheck {version} on {year} version of SOTorrent", flush=True)
-                snippets_directory = f"{base_directory}/{year}"
-                for language_dir in os.listdir(snippets_directory):
-                    dir_name = f"{snippets_directory}/{language_dir}"
-                    language_files = [(version, ds_release_date, f"{dir_name}/{snippet_file}") for snippet_file in os.listdir(dir_name)]
-                    print(f"Processing {language_dir} containing {len(language_files)} files", flush=True)
-                    with Pool(processes=50) as pool:
-                        pool.map(cppcheck_task, language_files)
-                    print(f"Completed {dir_name}", flush=True)
+    # snippets with the same content, e.g. in the 2018 and the 2022 dataset, are analyzed once per version
+    use_cpp_check_cache(cache_path)
+    # every version has its own build, so the versions analyze the snippets side by side
+    binaries = {version: build_cpp_check(version) for version in [1.86, 2.13]}
+    for ds_release_date in [datetime(2018, 12, 9), datetime(2022, 6, 30)]:
+        year = ds_release_date.year
+        print(f"Running Cppcheck {', '.join(map(str, binaries))} on {year} version of SOTorrent", flush=True)
+        snippets_directory = f"{base_directory}/{year}"
+        for language_dir in os.listdir(snippets_directory):
+            dir_name = f"{snippets_directory}/{language_dir}"
+            language_files = [f"{dir_name}/{snippet_file}" for snippet_file in os.listdir(dir_name)]
+            batches = []
+            for version, cppcheck in binaries.items():
+                # resume an interrupted run: skip the files whose rows were already inserted
+                completed = manifest.completed_files(version, ds_release_date)
+                remaining_files = [snippet_file for snippet_file in language_files if snippet_file not in completed]
+                print(f"Processing {language_dir} containing {len(language_files)} files with Cppcheck {version}, "
+                      f"{len(language_files) - len(remaining_files)} of them completed before", flush=True)
+                # each task runs one cppcheck process on up to batch_size files
+                batches.extend((version, cppcheck, ds_release_date, remaining_files[start:start + batch_size])
+                               for start in range(0, len(remaining_files), batch_size))
+            if not batches:
+                continue
+            # each worker keeps a single connection to sotorrent22 for all of its tasks
+            with Pool(processes=50, initializer=init_process_pool, initargs=('127.0.0.1', 3306, 'sotorrent22')) as pool:
+                pool.map(cppcheck_batch_task, batches)
+            print(f"Completed {dir_name}", flush=True)
 
 
 def cpp_check_testing():
@@ -102,6 +180,10 @@ def cpp_check_testing():
 if __name__ == '__main__':
     base_directory = '~/dataset/cppcheck_snippets'
     is_guesslang_used = False
+    batch_size = 200
+    cache_path = os.environ.get('CPPCHECK_CACHE', 'data/cppcheck_cache.sqlite')
+    # delete the manifest to analyze all files again
+    manifest = RunManifest('data/weakness_detection_manifest.sqlite')
     # cpp_check_testing()
     main()
     print('DONE!!!')
@@ -2,6 +2,8 @@ import csv
 import datetime
 from statistics import mean
 
+import pandas as pd
+
 from sources.case_study_4 import cliffsDelta
 from sources.case_study_4.util import get_answers_by_type
 from sources.queryservice import QueryService
@@ -19,12 +21,13 @@ def get_users(qs: QueryService) -> dict:
                 ON p.OwnerUserId = u.Id
                WHERE p.PostTypeId = 2 AND OwnerUserId > 0
             """
-    rows = qs.execute_and_fetchall(query)
+    df = qs.execute_to_dataframe(query)
+    # vectorized form of get_normalized_reputation(): reputation per (at least one) month on Stack Overflow
+    duration_months = (pd.to_datetime(df['LastAccessDate']) - pd.to_datetime(df['CreationDate'])).dt.days / 30
+    normalized_reputations = df['Reputation'].astype(float) / duration_months.clip(lower=1)
     users = {}
-    for row in rows:
-        user_id = row['OwnerUserId']
-        post_id = row['PostId']
-        normalized_reputation = get_normalized_reputation(row['Reputation'], row['CreationDate'], row['LastAccessDate'])
+    for post_id, user_id, normalized_reputation in zip(df['PostId'].tolist(), df['OwnerUserId'].tolist(),
+                                                       normalized_reputations.tolist()):
         users.setdefault(post_id, []).append((user_id, normalized_reputation))
     return users
 
@@ -1,9 +1,12 @@
+import asyncio
+
 from nltk.corpus import stopwords
 from nltk.stem.wordnet import WordNetLemmatizer
 import string
 from gensim import corpora
 from gensim.models.ldamodel import LdaModel
 
+from sources.async_queryservice import AsyncQueryService
 from sources.case_study_4.util import get_answers_by_type
 from sources.queryservice import QueryService
 from sources.util import get_colossus04_ip
@@ -58,6 +61,23 @@ def get_titles(question_ids: list, qs: QueryService) -> list:
     return [get_title(question_id, qs) for question_id in question_ids]
 
 
+async def get_titles_async(question_ids: list, qs: AsyncQueryService) -> list:
+    """
+    Get the titles of the questions, looking them up concurrently
+    :param question_ids: list of question ids
+    :return: list of titles, in the order of question_ids
+    """
+    return await qs.gather(qs.get_title(question_id) for question_id in question_ids)
+
+
+async def _get_secure_and_insecure_titles(questions_map: dict) -> tuple:
+    async with AsyncQueryService(max_concurrency=200) as qs:
+        await qs.connect()
+        secure_titles = await get_titles_async(questions_map['secure'], qs)
+        insecure_titles = await get_titles_async(questions_map['insecure'], qs)
+    return secure_titles, insecure_titles
+
+
 def main():
     """
     1. Get the questions with at least one insecure answer and the questions with no insecure answer.
@@ -66,15 +86,8 @@ def main():
     """
     questions_map = get_answers_by_type(post_type_id=1)
 
-    qs = QueryService()
-    qs.connect()
-    # get secure question titles
-    secure_questions = questions_map['secure']
-    secure_titles = [get_title(question_id, qs) for question_id in secure_questions]
-    # get insecure questions
-    insecure_questions = questions_map['insecure']
-    insecure_titles = [get_title(question_id, qs) for question_id in insecure_questions]
-    qs.close()
+    # get the secure and insecure question titles
+    secure_titles, insecure_titles = asyncio.run(_get_secure_and_insecure_titles(questions_map))
 
     # model secure topics
     num_topics = 5
@@ -1,6 +1,8 @@
+import asyncio
 import csv
 from typing import Set, List, Tuple
 
+from sources.async_queryservice import AsyncQueryService
 from sources.case_study_4.util import get_accepted_answers
 from sources.queryservice import QueryService
 from sources.util import get_colossus04_ip
@@ -17,33 +19,51 @@ def get_answers_with_body(question_id: int, qs: QueryService) -> List[Tuple]:
     return results
 
 
-def get_csv_rows(qs: QueryService) -> List[dict]:
-    query = """SELECT Id, Score, ViewCount, CommentCount, FavoriteCount
-               FROM Posts  s
-               WHERE PostTypeId=1 AND AnswerCount > 0 AND Score > 0 AND ViewCount > 0 AND
-                     Id IN (SELECT PostId FROM PostReferenceGH  WHERE FileExt='.py' AND PostTypeId=1 GROUP BY PostId)"""
+QUESTIONS_QUERY = """SELECT Id, Score, ViewCount, CommentCount, FavoriteCount
+                     FROM Posts  s
+                     WHERE PostTypeId=1 AND AnswerCount > 0 AND Score > 0 AND ViewCount > 0 AND
+                           Id IN (SELECT PostId FROM PostReferenceGH  WHERE FileExt='.py' AND PostTypeId=1 GROUP BY PostId)"""
 
-    rows = qs.execute_and_fetchall(query)
+
+def get_csv_rows(qs: QueryService) -> List[dict]:
+    rows = qs.execute_and_fetchall(QUESTIONS_QUERY)
     csv_rows = []
     for row in rows:
-        question_id = row['Id']
-        score = row['Score']
-        view_count = row['ViewCount']
-        comment_count = row['CommentCount']
-        favorite_count = row['FavoriteCount']
-        answers = get_answers_with_body(question_id, qs)
-        for answer in answers:
-            answer_id = answer[0]
-            body = answer[1]
-            creation_date = answer[2]
-            csv_rows.append({'QuestionId': question_id,
-                            'AnswerId': answer_id,
-                            'Score': score,
-                            'ViewCount': view_count,
-                            'CommentCount': comment_count,
-                            'FavouriteCount': favorite_count,
-                            'Body': body,
-                            'CreationDate': creation_date})
+        csv_rows.extend(_to_csv_rows(row, get_answers_with_body(row['Id'], qs)))
+    return csv_rows
+
+
+async def get_csv_rows_async(qs: AsyncQueryService) -> List[dict]:
+    """
+    Same as get_csv_rows(), but looks up the answers of all questions concurrently.
+    """
+    rows = await qs.execute_and_fetchall(QUESTIONS_QUERY)
+    all_answers = await qs.gather(qs.get_answers_with_body(row['Id']) for row in rows)
+    csv_rows = []
+    for row, answers in zip(rows, all_answers):
+        csv_rows.extend(_to_csv_rows(row, answers))
+    return csv_rows
+
+
+def _to_csv_rows(row: dict, answers: List[Tuple]) -> List[dict]:
+    question_id = row['Id']
+    score = row['Score']
+    view_count = row['ViewCount']
+    comment_count = row['CommentCount']
+    favorite_count = row['FavoriteCount']
+    csv_rows = []
+    for answer in answers:
+        answer_id = answer[0]
+        body = answer[1]
+        creation_date = answer[2]
+        csv_rows.append({'QuestionId': question_id,
+                        'AnswerId': answer_id,
+                        'Score': score,
+                        'ViewCount': view_count,
+                        'CommentCount': comment_count,
+                        'FavouriteCount': favorite_count,
+                        'Body': body,
+                        'CreationDate': creation_date})
     return csv_rows
 
 
@@ -88,11 +108,14 @@ def main_data_collection_stats():
     print(f"Questions: {len(r['questions'])}, Answers: {len(r['answers'])}, Accepted Answers: {len(r['accepted_answers'])}, Code Blocks: {len(r['code_blocks'])}")
 
 
+async def _collect_csv_rows() -> List[dict]:
+    async with AsyncQueryService(max_concurrency=200) as qs:
+        await qs.connect(host=get_colossus04_ip())
+        return await get_csv_rows_async(qs)
+
+
 def main():
-    qs = QueryService()
-    qs.connect(host=get_colossus04_ip())
-    csv_rows = get_csv_rows(qs)
-    qs.close()
+    csv_rows = asyncio.run(_collect_csv_rows())
     with open('data.csv', 'w') as f:
         writer = csv.DictWriter(f, fieldnames=set(csv_rows[0].keys()), delimiter='\t')
         writer.writeheader()
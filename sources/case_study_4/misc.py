@@ -9,11 +9,8 @@ def get_question_to_files_mapping(qs: QueryService) -> dict:
                FROM September2018PostReferenceGH 
                WHERE FileExt='.py'
                GROUP BY PostId"""
-    rows = qs.execute_and_fetchall(query)
-    results = {}
-    for row in rows:
-        results[row['PostId']] = row['files']
-    return results
+    df = qs.execute_to_dataframe(query)
+    return dict(zip(df['PostId'].tolist(), df['files'].tolist()))
 
 
 def get_questions_linked_to_GH(qs: QueryService) -> set:
@@ -0,0 +1,185 @@
+"""
+An offline backend for QueryService that runs the queries against an embedded DuckDB database
+instead of the MySQL server.
+
+The tables are read from the files the notebooks export to data/feather_files (*.feather, *.parquet,
+*.tsv and *.csv); each file becomes the table named after it, e.g. PostBlockVersion.feather becomes
+PostBlockVersion. Without a database file, the .parquet, .tsv and .csv files are scanned in place while the
+.feather files are loaded into memory. Queries written for MySQL work as long as they stick to standard SQL
+(MySQL-only syntax such as `LIMIT offset,count` does not).
+
+Requires the duckdb and pyarrow packages.
+"""
+import glob
+import os
+
+# columns the QueryService lookups filter on; an index is created for each one that exists
+INDEXED_COLUMNS = {
+    'Posts': ['Id', 'ParentId'],
+    'PostVersion': ['Id', 'PostId', 'PostHistoryId'],
+    'PostBlockVersion': ['Id', 'PostId', 'RootPostBlockVersionId', 'PostHistoryId'],
+    'CodeBlockVersion': ['Id', 'PostBlockVersionId'],
+    'Comments': ['Id', 'PostId'],
+}
+
+
+def _to_duckdb_placeholders(query_str, params):
+    # QueryService uses the MySQL %s placeholders, DuckDB expects ?
+    return query_str.replace('%s', '?') if params is not None else query_str
+
+
+class EmbeddedCursor():
+    """
+    Wraps a DuckDB cursor so that it behaves like the dictionary cursor of SOTorrentDB.
+    Results are read completely on execute() so that rowcount is known, as with a buffered MySQL cursor.
+    """
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._rows = []
+        self._position = 0
+        self.rowcount = -1
+        self.column_names = []
+
+    def execute(self, query_str, params=None):
+        self._cursor.execute(_to_duckdb_placeholders(query_str, params), None if params is None else list(params))
+        if self._cursor.description is None:
+            self.column_names, self._rows = [], []
+        else:
+            self.column_names = [column[0] for column in self._cursor.description]
+            self._rows = self._cursor.fetchall()
+        self._position = 0
+        self.rowcount = len(self._rows)
+        return self
+
+    def executemany(self, query_str, rows):
+        rows = [list(row) for row in rows]
+        self._cursor.executemany(_to_duckdb_placeholders(query_str, ()), rows)
+        self.rowcount = len(rows)
+        return self.rowcount
+
+    def fetchmany(self, size=1):
+        rows = self._rows[self._position:self._position + size]
+        self._position += len(rows)
+        return [dict(zip(self.column_names, row)) for row in rows]
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchall(self):
+        return self.fetchmany(len(self._rows) - self._position)
+
+    def __iter__(self):
+        row = self.fetchone()
+        while row is not None:
+            yield row
+            row = self.fetchone()
+
+    def close(self):
+        self._cursor.close()
+
+
+class EmbeddedDB():
+    """
+    A drop-in replacement for SOTorrentDB backed by DuckDB.
+
+    Args:
+        data_dir: The directory holding the exported tables.
+        db_file: Optional DuckDB database file. When given, the exported tables are imported into it once
+            and indexed on the columns in INDEXED_COLUMNS, and later runs reuse the file. Without it, the
+            files are scanned in place, which starts instantly but answers point lookups by scanning.
+    """
+    def __init__(self, data_dir='data/feather_files', db_file=None):
+        import duckdb
+
+        self._connection = duckdb.connect(db_file or ':memory:')
+        existing_tables = {row[0] for row in self._connection.execute('SHOW TABLES').fetchall()}
+        for path in sorted(glob.glob(os.path.join(data_dir, '*'))):
+            table_name, file_ext = os.path.splitext(os.path.basename(path))
+            if table_name in existing_tables or file_ext not in ('.feather', '.parquet', '.tsv', '.csv'):
+                continue
+            self._load_table(table_name, path, file_ext, materialize=db_file is not None)
+        self._cursor = EmbeddedCursor(self._connection.cursor())
+
+    def _load_table(self, table_name, path, file_ext, materialize):
+        if file_ext == '.feather':
+            import pyarrow.feather
+
+            # DuckDB cannot read feather files itself, and a registered Arrow table is only visible to the
+            # connection, not to the cursors the queries run on, so the table is always copied into DuckDB
+            arrow_table = pyarrow.feather.read_table(path, memory_map=True)
+            self._connection.register(f"{table_name}_arrow", arrow_table)
+            source = f"{table_name}_arrow"
+            materialize = True
+        elif file_ext == '.parquet':
+            source = f"read_parquet('{path}')"
+        else:
+            delimiter = '\t' if file_ext == '.tsv' else ','
+            source = f"read_csv('{path}', delim='{delimiter}', header=true)"
+
+        if not materialize:
+            self._connection.execute(f"CREATE VIEW {table_name} AS SELECT * FROM {source}")
+            return
+        self._connection.execute(f"CREATE TABLE {table_name} AS SELECT * FROM {source}")
+        columns = {row[0] for row in self._connection.execute(f"DESCRIBE {table_name}").fetchall()}
+        for column in INDEXED_COLUMNS.get(table_name, []):
+            if column in columns:
+                self._connection.execute(f"CREATE INDEX {table_name}_{column} ON {table_name}({column})")
+        if file_ext == '.feather':
+            self._connection.unregister(f"{table_name}_arrow")
+
+    @property
+    def cursor(self):
+        return self._cursor
+    @property
+    def db(self):
+        return self._connection
+    @property
+    def primary(self):
+        return self
+
+    def is_healthy(self):
+        return True
+
+    def close(self):
+        self._connection.close()
+
+    def run_query(self, query_str, params=None, stream=False, fetch_size=1000):
+        if stream:
+            return self.stream_query(query_str, params, fetch_size)
+        return self.run_prepared(query_str, params) if params is not None else self._cursor.execute(query_str)
+
+    def run_prepared(self, query_str, params=()):
+        # DuckDB caches the plans of parameterized statements itself
+        return self._cursor.execute(query_str, tuple(params))
+
+    def stream_query(self, query_str, params=None, fetch_size=1000):
+        cursor = self._connection.cursor()
+        try:
+            cursor.execute(_to_duckdb_placeholders(query_str, params), None if params is None else list(params))
+            column_names = [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(column_names, row))
+        finally:
+            cursor.close()
+
+    def fetch_column_batches(self, query_str, params=None, batch_size=65536):
+        cursor = self._connection.cursor()
+        try:
+            cursor.execute(_to_duckdb_placeholders(query_str, params), None if params is None else list(params))
+            column_names = [column[0] for column in cursor.description]
+            first_batch = True
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if rows or first_batch:
+                    columns = list(zip(*rows)) if rows else [() for _ in column_names]
+                    yield column_names, columns
+                first_batch = False
+                if not rows:
+                    break
+        finally:
+            cursor.close()
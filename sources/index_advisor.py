@@ -0,0 +1,351 @@
+"""
+Index advisor for the queries QueryService actually runs.
+
+The query shapes are read from a query log recorded with the query statistics (see sources.instrumentation),
+e.g. from a run of the analysis scripts:
+
+    SOTORRENT_QUERY_LOG=data/query_log.jsonl python sources/case_study_1/analysis.py
+    python -m sources.index_advisor --db sotorrent22 --query-log data/query_log.jsonl --output migrations/sotorrent22_indexes.sql
+    python -m sources.index_advisor --db sotorrent22 --query-log data/query_log.jsonl --apply
+
+For the shapes that took the most time, the advisor derives the index a shape needs from its SQL: the columns
+compared with =, IN or IS NULL first, then one range column or the GROUP BY/ORDER BY columns, and finally the
+other selected and filtered columns, so that the index covers the query and its rows are not read at all. It
+collects the EXPLAIN plan and the median latency of the recorded sample queries and checks whether an existing
+index already serves the shape. Missing indexes are written to a migration script; with --apply they are also
+created and the shapes are measured again. Shapes without a derivable index (joins, subqueries, expressions on
+columns) are reported with the reason.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import statistics
+import time
+from collections import namedtuple
+
+from sources.queryservice import QueryService
+
+# shape: the SQL with its literals replaced by ? (see sources.instrumentation.query_shape)
+# samples: recorded (query, params) pairs of the shape, run to measure it
+QueryShape = namedtuple('QueryShape', ['shape', 'calls', 'seconds', 'samples'])
+
+# key: the columns the shape filters and sorts on, text columns with the length of their prefix
+# covering: further columns that make the index cover the selected and filtered columns
+IndexSpec = namedtuple('IndexSpec', ['table', 'key', 'covering'])
+
+# longer text columns can only be indexed by a prefix, which never covers them
+TEXT_PREFIX_LENGTH = 191
+_TEXT_TYPES = {'char', 'varchar', 'tinytext', 'text', 'mediumtext', 'longtext', 'binary', 'varbinary', 'tinyblob',
+               'blob', 'mediumblob', 'longblob'}
+_UNCOVERABLE_TYPES = {'tinytext', 'text', 'mediumtext', 'longtext', 'tinyblob', 'blob', 'mediumblob', 'longblob'}
+MAX_INDEX_COLUMNS = 16
+
+_SELECT_PATTERN = re.compile(
+    r"^SELECT\s+(?:DISTINCT\s+)?(?P<columns>.+?)\s+FROM\s+(?P<table>[\w.`]+)"
+    r"(?:\s+(?:AS\s+)?(?!WHERE\b|GROUP\b|ORDER\b|LIMIT\b)(?P<alias>\w+))?"
+    r"(?:\s+WHERE\s+(?P<where>.+?))?(?:\s+GROUP\s+BY\s+(?P<group>.+?))?(?:\s+ORDER\s+BY\s+(?P<order>.+?))?"
+    r"(?:\s+LIMIT\s+[?,\s]+)?\s*;?$", re.IGNORECASE)
+_COLUMN = r"(?:`?\w+`?\.)?`?(?P<column>\w+)`?"
+_EQUALITY_PATTERN = re.compile(_COLUMN + r"\s*(?:(?:=|<=>)\s*(?:\?|TRUE|FALSE)|\s+IN\s*\(\?\)|\s+IS\s+NULL)$",
+                               re.IGNORECASE)
+_RANGE_PATTERN = re.compile(_COLUMN + r"\s*(?:(?:<|>|<=|>=)\s*\?|\s+BETWEEN\s+\?\s+AND\s+\?|\s+LIKE\s+\?)$",
+                            re.IGNORECASE)
+_COLUMN_PATTERN = re.compile(_COLUMN + r"(?:\s+AS\s+\w+)?$", re.IGNORECASE)
+_SORT_PATTERN = re.compile(_COLUMN + r"(?:\s+ASC)?$", re.IGNORECASE)
+_COUNT_PATTERN = re.compile(r"COUNT\(\s*(?:\*|\?)\s*\)(?:\s+AS\s+\w+)?$", re.IGNORECASE)
+
+
+def load_query_log(path: str, db_name: str, top=20) -> list:
+    """
+    Reads the query log written by sources.instrumentation and returns the top SELECT shapes run on the given
+    database, ranked by their total time over all processes and runs.
+    """
+    shapes = {}
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            database = entry.get('database') or ''
+            if database.rsplit('/', 1)[-1] != db_name or not entry['shape'].upper().startswith('SELECT'):
+                continue
+            calls, seconds, samples = shapes.get(entry['shape'], (0, 0.0, []))
+            samples.extend((query, tuple(params) if params is not None else None)
+                           for query, params in entry['samples'][:max(0, 100 - len(samples))])
+            shapes[entry['shape']] = (calls + entry['calls'], seconds + entry['seconds'], samples)
+    ranked = sorted(shapes.items(), key=lambda item: item[1][1], reverse=True)
+    return [QueryShape(shape, calls, seconds, samples) for shape, (calls, seconds, samples) in ranked[:top]]
+
+
+def _split_top_level(text: str, separator: str) -> list:
+    "Splits text at the separator (a regular expression) where it is not inside parentheses"
+    parts, start = [], 0
+    for match in re.finditer(separator, text, re.IGNORECASE):
+        prefix = text[start:match.start()]
+        if text[:match.start()].count('(') == text[:match.start()].count(')'):
+            parts.append(prefix.strip())
+            start = match.end()
+    parts.append(text[start:].strip())
+    return [part for part in parts if part]
+
+
+def _strip_parentheses(text: str) -> str:
+    while text.startswith('(') and text.endswith(')') and _split_top_level(text[1:-1], r'\)\s*\(') == [text[1:-1]]:
+        text = text[1:-1].strip()
+    return text
+
+
+def _filter_columns(where: str):
+    "Returns the equality and range columns of a WHERE clause, or None if a condition cannot use an index"
+    equality, ranges = [], []
+    # protects the AND of BETWEEN ? AND ? from the split into conditions
+    where = re.sub(r"BETWEEN\s+\?\s+AND\s+\?", 'BETWEEN ?~?', where, flags=re.IGNORECASE)
+    for condition in _split_top_level(where, r'\s+AND\s+'):
+        condition = _strip_parentheses(condition.replace('BETWEEN ?~?', 'BETWEEN ? AND ?'))
+        alternatives = [_strip_parentheses(alternative) for alternative in _split_top_level(condition, r'\s+OR\s+')]
+        matches = [_EQUALITY_PATTERN.match(alternative) for alternative in alternatives]
+        if all(matches) and len({match.group('column').lower() for match in matches}) == 1:
+            # e.g. (PredEqual IS NULL OR PredEqual = 0) only compares a single column
+            equality.append(matches[0].group('column'))
+            continue
+        match = _RANGE_PATTERN.match(condition)
+        if match is None:
+            return None
+        ranges.append(match.group('column'))
+    return equality, ranges
+
+
+def derive_index(shape: str, column_types: dict, primary_key: list):
+    """
+    Returns the IndexSpec serving the given query shape, or the reason why none can be derived.
+
+    Args:
+        shape: A query shape of the query log.
+        column_types: Maps the lower-cased column names of the table to (name, DATA_TYPE).
+        primary_key: The primary key columns of the table; InnoDB stores them in every index.
+    """
+    if re.search(r"\bJOIN\b", shape, re.IGNORECASE) or len(re.findall(r"\bSELECT\b", shape, re.IGNORECASE)) > 1:
+        return 'joins and subqueries are not analyzed'
+    match = _SELECT_PATTERN.match(shape)
+    if match is None or not match.group('where'):
+        return 'not a single-table SELECT with a WHERE clause'
+    table = match.group('table').replace('`', '').rsplit('.', 1)[-1]
+    filters = _filter_columns(match.group('where'))
+    if filters is None:
+        return 'a condition of the WHERE clause cannot use an index'
+    equality, ranges = filters
+
+    sort_columns = []
+    for clause in ('group', 'order'):
+        for item in _split_top_level(match.group(clause) or '', r','):
+            sort_match = _SORT_PATTERN.match(item)
+            if sort_match is None:
+                sort_columns = None
+                break
+            sort_columns.append(sort_match.group('column'))
+        if sort_columns is None:
+            break
+
+    selected = []
+    for item in _split_top_level(match.group('columns'), r','):
+        if _COUNT_PATTERN.match(item):
+            continue
+        column_match = _COLUMN_PATTERN.match(item)
+        if column_match is None or item == '*':
+            selected = None
+            break
+        selected.append(column_match.group('column'))
+
+    def resolve(columns):
+        return [column_types[column.lower()][0] for column in dict.fromkeys(columns)]
+
+    referenced = equality + ranges + (sort_columns or []) + (selected or [])
+    unknown = [column for column in referenced if column.lower() not in column_types]
+    if unknown:
+        return f"{', '.join(unknown)} not found in {table}"
+
+    key = resolve(equality)
+    if ranges:
+        key += [column for column in resolve(ranges[:1]) if column not in key]
+    elif sort_columns:
+        key += [column for column in resolve(sort_columns) if column not in key]
+    if not key:
+        return 'no column of the WHERE clause can use an index'
+
+    covering = []
+    if selected is not None and sort_columns is not None:
+        needed = [column for column in resolve(equality + ranges + sort_columns + selected)
+                  if column not in key and column not in primary_key]
+        if (len(key) + len(needed) <= MAX_INDEX_COLUMNS and
+                not any(column_types[column.lower()][1] in _UNCOVERABLE_TYPES for column in key + needed)):
+            covering = needed
+    key = [f"{column}({TEXT_PREFIX_LENGTH})" if column_types[column.lower()][1] in _TEXT_TYPES else column
+           for column in key]
+    return IndexSpec(table, key, covering)
+
+
+def _column_name(column: str) -> str:
+    return column.split('(', 1)[0]
+
+
+def index_name(table: str, columns: list) -> str:
+    name = f"idx_{table}_{'_'.join(_column_name(column) for column in columns)}"
+    if len(name) <= 64:
+        return name
+    # keeps the names of indexes sharing a long prefix apart
+    return f"{name[:55]}_{hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]}"
+
+
+def create_index_statement(index: IndexSpec) -> str:
+    columns = index.key + index.covering
+    return f"CREATE INDEX {index_name(index.table, columns)} ON {index.table}({', '.join(columns)});"
+
+
+def table_columns(qs, table: str):
+    "Returns the columns of the table as {lower-cased name: (name, DATA_TYPE)} and its primary key columns"
+    rows = qs.execute_and_fetchall("""SELECT COLUMN_NAME, DATA_TYPE, COLUMN_KEY FROM information_schema.COLUMNS
+                                      WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s
+                                      ORDER BY ORDINAL_POSITION""", (table,))
+    column_types = {row['COLUMN_NAME'].lower(): (row['COLUMN_NAME'], row['DATA_TYPE'].lower()) for row in rows}
+    return column_types, [row['COLUMN_NAME'] for row in rows if row['COLUMN_KEY'] == 'PRI']
+
+
+def existing_indexes(qs, table: str) -> list:
+    "Returns the column lists of the indexes of the given table"
+    rows = qs.execute_and_fetchall("""SELECT INDEX_NAME, COLUMN_NAME FROM information_schema.STATISTICS
+                                      WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s
+                                      ORDER BY INDEX_NAME, SEQ_IN_INDEX""", (table,))
+    indexes = {}
+    for row in rows:
+        indexes.setdefault(row['INDEX_NAME'], []).append(row['COLUMN_NAME'])
+    return list(indexes.values())
+
+
+def has_index(qs, index: IndexSpec) -> bool:
+    "Returns True if an index of the table starts with the key columns (in any order) and contains the covering ones"
+    key = {_column_name(column).lower() for column in index.key}
+    covering = {column.lower() for column in index.covering}
+    for columns in existing_indexes(qs, index.table):
+        columns = [column.lower() for column in columns]
+        if set(columns[:len(key)]) == key and covering <= set(columns):
+            return True
+    return False
+
+
+def explain(qs, query: str, params) -> list:
+    # EXPLAIN runs on a plain cursor, the parameters are interpolated by the client
+    cursor = qs.client.db.cursor(dictionary=True, buffered=True)
+    try:
+        cursor.execute('EXPLAIN ' + query, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def median_latency(qs, samples: list) -> float:
+    "Runs every sample query (after one warm-up run) and returns the median latency in milliseconds"
+    if not samples:
+        return float('nan')
+    qs.execute_and_fetchall(*samples[0])
+    latencies = []
+    for query, params in samples:
+        started = time.perf_counter()
+        qs.execute_and_fetchall(query, params)
+        latencies.append(1000 * (time.perf_counter() - started))
+    return statistics.median(latencies)
+
+
+def _plan_summary(plan: list) -> str:
+    return '; '.join(f"{row.get('table')}: type={row.get('type')} key={row.get('key')} rows={row.get('rows')}"
+                     for row in plan)
+
+
+def advise(qs, shapes: list, samples=20, apply=False) -> list:
+    """
+    Measures the given query shapes and returns one result dictionary per shape with its plan, its latency,
+    the proposed index statement (None if a matching index exists or none can be derived, see note) and, with
+    apply, the plan and latency after creating the index.
+    """
+    tables = {}
+    results = []
+    for shape in shapes:
+        shape_samples = shape.samples[:samples]
+        result = {'shape': shape.shape,
+                  'calls': shape.calls,
+                  'seconds': shape.seconds,
+                  'plan': _plan_summary(explain(qs, *shape_samples[0])) if shape_samples else None,
+                  'latency_ms': median_latency(qs, shape_samples),
+                  'index': None,
+                  'note': None,
+                  'plan_after': None,
+                  'latency_after_ms': None}
+        match = _SELECT_PATTERN.match(shape.shape)
+        table = match.group('table').replace('`', '').rsplit('.', 1)[-1] if match else None
+        if table is not None and table not in tables:
+            tables[table] = table_columns(qs, table)
+        index = derive_index(shape.shape, *tables[table]) if table is not None else 'not a single-table SELECT'
+        if isinstance(index, str):
+            result['note'] = index
+        elif has_index(qs, index):
+            result['note'] = 'an index serving the shape exists'
+        else:
+            result['index'] = create_index_statement(index)
+        if apply and result['index'] is not None:
+            qs.execute(result['index'].rstrip(';'))
+            result['plan_after'] = _plan_summary(explain(qs, *shape_samples[0])) if shape_samples else None
+            result['latency_after_ms'] = median_latency(qs, shape_samples)
+        results.append(result)
+    return results
+
+
+def write_migration(results: list, path: str, db_name: str):
+    "Writes the proposed indexes as a migration script, with the statements to undo it in comments"
+    proposed = [(result['shape'], result['index']) for result in results if result['index'] is not None]
+    with open(path, 'w') as f:
+        f.write(f"-- Indexes proposed by sources/index_advisor.py for {db_name}\n")
+        f.write(f"USE {db_name};\n\n")
+        for shape, statement in proposed:
+            f.write(f"-- {shape}\n{statement}\n\n")
+        f.write('-- Rollback:\n')
+        for _, statement in proposed:
+            name, table = statement.split()[2], statement.split()[4].split('(', 1)[0]
+            f.write(f"-- DROP INDEX {name} ON {table};\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Proposes and benchmarks indexes for the recorded query shapes')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('--db', default='sotorrent22')
+    parser.add_argument('--query-log', default=os.environ.get('SOTORRENT_QUERY_LOG'),
+                        help='the query log written with SOTORRENT_QUERY_LOG (see sources.instrumentation)')
+    parser.add_argument('--top', type=int, default=20, help='the number of shapes analyzed, by total time')
+    parser.add_argument('--samples', type=int, default=20, help='recorded queries measured per shape')
+    parser.add_argument('--apply', action='store_true', help='create the proposed indexes and measure again')
+    parser.add_argument('--output', default='index_migration.sql', help='path of the migration script')
+    args = parser.parse_args()
+    if not args.query_log:
+        parser.error('--query-log (or SOTORRENT_QUERY_LOG) is required')
+
+    shapes = load_query_log(args.query_log, args.db, args.top)
+    qs = QueryService()
+    qs.connect(host=args.host, port=args.port, db_name=args.db)
+    results = advise(qs, shapes, samples=args.samples, apply=args.apply)
+    qs.close()
+
+    for result in results:
+        print(f"{result['shape']}", flush=True)
+        print(f"    {result['calls']} calls, {result['seconds']:.1f}s recorded, {result['latency_ms']:.2f} ms now")
+        print(f"    plan:  {result['plan']}")
+        if result['index'] is None:
+            print(f"    {result['note']}")
+            continue
+        print(f"    proposed: {result['index']}")
+        if result['latency_after_ms'] is not None:
+            print(f"    after: {result['latency_after_ms']:.2f} ms, plan: {result['plan_after']}")
+    write_migration(results, args.output, args.db)
+    print(f"Migration written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
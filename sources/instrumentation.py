@@ -0,0 +1,282 @@
+"""
+Per-method query statistics for SOTorrentDB/QueryService.
+
+Call enable() (or set the SOTORRENT_QUERY_STATS environment variable) before running a script to record,
+for every QueryService method (or other caller) that runs queries, the number of calls, a latency
+histogram, the rows returned and the approximate bytes transferred. A report ranked by total query time
+is printed when the process exits. Queries slower than a threshold are kept in a slow-query log together
+with their EXPLAIN plan, which is captured on the next connection to the same database that runs a query.
+
+SOTORRENT_QUERY_STATS may hold the slow-query threshold in seconds, e.g. SOTORRENT_QUERY_STATS=2.5;
+any non-numeric value enables the statistics without a slow-query log.
+
+With a query log (enable(query_log=...) or SOTORRENT_QUERY_LOG=<path>), the queries are also grouped by their
+shape (the SQL with its literals replaced by ?) and, when the process exits, every shape is appended to the log
+as a JSON line with its database, calls, total time and a few sample queries with their parameters. The index
+advisor (sources/index_advisor.py) proposes indexes for the shapes in the log.
+"""
+import atexit
+import json
+import os
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+# upper bounds (in milliseconds) of the latency histogram buckets; the last bucket is unbounded
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000]
+
+# source files and QueryService helpers that only pass queries through; statistics are attributed to their callers
+_PASS_THROUGH_FILES = ('sotorrent.py', 'instrumentation.py', 'embedded.py')
+_PASS_THROUGH_FUNCTIONS = {'execute', 'execute_and_fetchall', 'execute_and_fetchone', '_fetchone', '_cached', '<lambda>',
+                           'execute_and_stream', 'execute_to_arrow', 'execute_to_dataframe', 'execute_and_fetch_by_ids',
+                           'wrapper', '<listcomp>', '<genexpr>'}
+
+# the number of sample queries (with their parameters) kept per query shape
+QUERY_SAMPLES = 20
+
+# literals replaced by ? in the shape of a query: quoted strings and numbers, then lists of them
+_LITERAL_PATTERNS = [(re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\""), '?'),
+                     (re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b"), '?'),
+                     (re.compile(r"%s"), '?'),
+                     (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), '(?)')]
+
+_stats = None
+
+
+def query_shape(query_str: str) -> str:
+    "Returns the query with normalized whitespace and its literals and placeholders replaced by ?"
+    shape = ' '.join(query_str.split())
+    for pattern, replacement in _LITERAL_PATTERNS:
+        shape = pattern.sub(replacement, shape)
+    return shape
+
+
+def _caller_name() -> str:
+    frame = sys._getframe(2)
+    while frame is not None:
+        file_name = os.path.basename(frame.f_code.co_filename)
+        function_name = frame.f_code.co_name
+        if file_name not in _PASS_THROUGH_FILES and not (
+                file_name == 'queryservice.py' and function_name in _PASS_THROUGH_FUNCTIONS):
+            if file_name == 'queryservice.py':
+                return f"QueryService.{function_name}"
+            return f"{os.path.splitext(file_name)[0]}.{function_name}"
+        frame = frame.f_back
+    return '<unknown>'
+
+
+def _row_bytes(values) -> int:
+    # approximate wire size: the length of strings and blobs, 8 bytes for every other value
+    return sum(len(value) if isinstance(value, (str, bytes, bytearray)) else 8 for value in values)
+
+
+class MethodStats():
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def percentile_ms(self, fraction: float):
+        "Returns the upper bound of the histogram bucket holding the given fraction of the calls"
+        threshold = fraction * self.calls
+        seen = 0
+        for index, count in enumerate(self.histogram):
+            seen += count
+            if seen >= threshold and count:
+                return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else float('inf')
+        return 0
+
+
+class QueryStats():
+    """
+    Collects the statistics of all queries run in this process.
+
+    Args:
+        slow_query_seconds: Queries taking longer are added to the slow-query log. None disables the log.
+        explain: Whether to capture the EXPLAIN plan of the slow queries.
+    """
+    def __init__(self, slow_query_seconds=None, explain=True, record_shapes=False):
+        self.methods = {}
+        self.slow_queries = []  # dicts with method, database, query, params, seconds and plan
+        # (database, shape) -> dict with database, shape, calls, seconds and samples ([query, params] pairs)
+        self.shapes = {}
+        self.slow_query_seconds = slow_query_seconds
+        self.explain = explain
+        self.record_shapes = record_shapes
+        self._lock = threading.Lock()
+
+    def _method_stats(self, method: str) -> MethodStats:
+        with self._lock:
+            return self.methods.setdefault(method, MethodStats())
+
+    def record_call(self, method: str, query_str: str, params, seconds: float, database=None):
+        stats = self._method_stats(method)
+        with self._lock:
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.histogram[bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)] += 1
+            if self.record_shapes:
+                self._record_shape(query_str, params, seconds, database)
+            if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+                self.slow_queries.append({'method': method, 'database': database, 'query': ' '.join(query_str.split()),
+                                          'params': params, 'seconds': seconds, 'plan': None})
+
+    def _record_shape(self, query_str, params, seconds, database):
+        shape = query_shape(query_str)
+        entry = self.shapes.get((database, shape))
+        if entry is None:
+            entry = self.shapes[(database, shape)] = {'database': database, 'shape': shape, 'calls': 0, 'seconds': 0.0,
+                                                      'samples': []}
+        entry['calls'] += 1
+        entry['seconds'] += seconds
+        if len(entry['samples']) < QUERY_SAMPLES:
+            entry['samples'].append([query_str, None if params is None else list(params)])
+
+    def save_query_log(self, path: str):
+        "Appends the recorded query shapes to the given file, one JSON object per line"
+        with self._lock:
+            entries = list(self.shapes.values())
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'a') as f:
+            for entry in entries:
+                # dates and decimals in the parameters are written as strings
+                f.write(json.dumps(entry, default=str) + '\n')
+
+    def record_rows(self, method: str, rows: int, nbytes: int):
+        stats = self._method_stats(method)
+        with self._lock:
+            stats.rows += rows
+            stats.bytes += nbytes
+
+    def pending_explains(self, database=None) -> list:
+        "The slow SELECT queries run on the given database whose plan has not been captured yet"
+        if not self.explain:
+            return []
+        with self._lock:
+            return [query for query in self.slow_queries if query['plan'] is None and query['database'] == database and
+                    query['query'].lstrip('( ').upper().startswith('SELECT')]
+
+    def track(self, result, query_str: str, params, started: float, column_batches=False, database=None):
+        """
+        Records a query whose execution started at the given perf_counter() time and returns its result
+        wrapped so that the rows read from it are counted. Generators (streamed results) are timed up to their first row.
+        database identifies the database the query ran on, so that its plan is explained there.
+        """
+        method = _caller_name()
+        if hasattr(result, 'fetchone'):
+            self.record_call(method, query_str, params, time.perf_counter() - started, database)
+            return CountingCursor(result, self, method)
+        return self._count_generator(result, method, query_str, params, started, column_batches, database)
+
+    def _count_generator(self, generator, method, query_str, params, started, column_batches, database):
+        first = True
+        try:
+            for item in generator:
+                if first:
+                    self.record_call(method, query_str, params, time.perf_counter() - started, database)
+                    first = False
+                if column_batches:
+                    _, columns = item
+                    rows = len(columns[0]) if columns else 0
+                    self.record_rows(method, rows, sum(_row_bytes(column) for column in columns))
+                else:
+                    self.record_rows(method, 1, _row_bytes(item.values()))
+                yield item
+        finally:
+            if first:
+                self.record_call(method, query_str, params, time.perf_counter() - started, database)
+            generator.close()
+
+    def report(self, top=30) -> str:
+        ranked = sorted(self.methods.items(), key=lambda item: item[1].seconds, reverse=True)
+        lines = ['Query statistics (ranked by total time)',
+                 f"{'Method':<50} {'Calls':>10} {'Total s':>10} {'Mean ms':>9} {'p50 ms':>8} {'p95 ms':>8} "
+                 f"{'Rows':>12} {'MB':>10}"]
+        for method, stats in ranked[:top]:
+            mean_ms = 1000 * stats.seconds / stats.calls if stats.calls else 0
+            lines.append(f"{method:<50} {stats.calls:>10} {stats.seconds:>10.2f} {mean_ms:>9.2f} "
+                         f"{stats.percentile_ms(0.5):>8} {stats.percentile_ms(0.95):>8} {stats.rows:>12} "
+                         f"{stats.bytes / 1024 / 1024:>10.1f}")
+        if self.slow_queries:
+            lines.append(f"Slow queries (>= {self.slow_query_seconds}s): {len(self.slow_queries)}")
+            for query in sorted(self.slow_queries, key=lambda q: q['seconds'], reverse=True)[:top]:
+                lines.append(f"  {query['seconds']:.2f}s {query['method']} on {query['database']}: {query['query']} "
+                             f"{query['params'] or ''}")
+                for plan_row in query['plan'] or []:
+                    lines.append(f"      {plan_row}")
+        return '\n'.join(lines)
+
+
+class CountingCursor():
+    "Wraps a cursor and counts the rows and bytes that are read from it; everything else is passed through"
+    def __init__(self, cursor, stats: QueryStats, method: str):
+        self._cursor = cursor
+        self._stats = stats
+        self._method = method
+
+    def _count(self, rows):
+        self._stats.record_rows(self._method, len(rows), sum(_row_bytes(row.values()) for row in rows))
+        return rows
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._count([row])
+        return row
+
+    def fetchmany(self, size=1):
+        return self._count(self._cursor.fetchmany(size))
+
+    def fetchall(self):
+        return self._count(self._cursor.fetchall())
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._count([row])
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def enable(slow_query_seconds=None, explain=True, report_at_exit=True, query_log=None) -> QueryStats:
+    """
+    Starts recording query statistics for this process and returns the collector.
+
+    Args:
+        slow_query_seconds: Queries taking at least this long are kept in the slow-query log.
+        explain: Whether to capture the EXPLAIN plan of the slow queries.
+        report_at_exit: Whether to print the report to stderr when the process exits.
+        query_log: A file the query shapes are appended to when the process exits.
+    """
+    global _stats
+    _stats = QueryStats(slow_query_seconds, explain, record_shapes=query_log is not None)
+    if report_at_exit:
+        atexit.register(lambda stats=_stats: print(stats.report(), file=sys.stderr))
+    if query_log is not None:
+        atexit.register(_stats.save_query_log, query_log)
+    return _stats
+
+
+def disable():
+    global _stats
+    _stats = None
+
+
+def get_stats():
+    "Returns the statistics collector of this process or None if the statistics are disabled"
+    return _stats
+
+
+if os.environ.get('SOTORRENT_QUERY_STATS') or os.environ.get('SOTORRENT_QUERY_LOG'):
+    try:
+        _slow_query_seconds = float(os.environ.get('SOTORRENT_QUERY_STATS', ''))
+    except ValueError:
+        _slow_query_seconds = None
+    enable(slow_query_seconds=_slow_query_seconds, query_log=os.environ.get('SOTORRENT_QUERY_LOG') or None)
@@ -1,22 +1,39 @@
+import functools
 import json
 import logging
 import os
-from typing import Dict
+from typing import TYPE_CHECKING, Dict
 
-import openai
-import pandas as pd
-import requests
-from sqlalchemy import create_engine
+# openai, pandas, requests, sqlalchemy and tenacity are imported by the functions that use them,
+# so that importing this module (e.g. for get_logger) stays cheap
+if TYPE_CHECKING:
+    import pandas as pd
+    import requests
 
-from tenacity import (
-    retry,
-    stop_after_attempt,
-    wait_random_exponential
-)
+
+def retry_with_backoff(function):
+    """
+    Retries the decorated function up to 6 times with a random exponential backoff between 1 and 10 seconds,
+    i.e. tenacity's @retry(wait=wait_random_exponential(min=1, max=10), stop=stop_after_attempt(6)).
+    tenacity is imported on the first call.
+    """
+    retrying = None
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        nonlocal retrying
+        if retrying is None:
+            from tenacity import retry, stop_after_attempt, wait_random_exponential
+
+            retrying = retry(wait=wait_random_exponential(min=1, max=10), stop=stop_after_attempt(6))(function)
+        return retrying(*args, **kwargs)
+    return wrapper
 
 
-@retry(wait=wait_random_exponential(min=1, max=10), stop=stop_after_attempt(6))
+@retry_with_backoff
 def classify_paper(api_key, paper_abstract, model='gpt-4o') -> tuple:
+    import openai
+
     openai.api_key = api_key
     response = openai.chat.completions.create(  # Updated method
         model=model,  # Replace with "gpt-4-turbo" if preferred
@@ -40,6 +57,8 @@ def classify_paper(api_key, paper_abstract, model='gpt-4o') -> tuple:
 
 def is_dblp_indexed(venue_name: str) -> bool:
     """Check if the venue is indexed in DBLP using GPT-4o."""
+    import openai
+
     openai.api_key = get_api_key()
     model = 'gpt-4o'
     response = openai.chat.completions.create(  # Updated method
@@ -56,9 +75,11 @@ def is_dblp_indexed(venue_name: str) -> bool:
     return answer == "Yes"
 
 
-@retry(wait=wait_random_exponential(min=1, max=10), stop=stop_after_attempt(6))
-def crawl(url: str) -> requests.Response:
+@retry_with_backoff
+def crawl(url: str) -> 'requests.Response':
     """Fetch content from the specified URL."""
+    import requests
+
     response = requests.get(url)
     response.raise_for_status()  # Check for HTTP errors
     return response
@@ -139,6 +160,8 @@ def get_logger(name: str = 'app.log'):
 
 
 def get_db_engine(db_user, db_password, database, db_host='127.0.0.1'):
+    from sqlalchemy import create_engine
+
     return create_engine(f"mysql+mysqlconnector://{db_user}:{db_password}@{db_host}/{database}")
 
 
@@ -282,7 +305,7 @@ def get_abstracts():
     return [a1, a2, a3, a4, a5, a6, a7]
 
 
-def pass_by_reference(df: pd.DataFrame):
+def pass_by_reference(df: 'pd.DataFrame'):
     for index, row in df.iterrows():
         is_relevant, justification = classify_paper(get_api_key(), row['Abstract'])
         df.loc[index, 'IsRelevant'] = is_relevant
@@ -291,6 +314,8 @@ def pass_by_reference(df: pd.DataFrame):
 
 
 def test_pass_by_reference():
+    import pandas as pd
+
     abstracts = get_abstracts()
     df = pd.DataFrame(
         {'Title': ['title 1', 'title 2', 'title 2'], 'Abstract': [abstracts[0], abstracts[1], abstracts[2]]})
@@ -0,0 +1,141 @@
+"""
+Materialized copies of the snippet views (View_JavaCodeSnippets and friends).
+
+The views are plain views over PostBlockVersion, so every query against them recomputes their filters.
+ViewMaterializer copies a view into an indexed table (MView_<name>, e.g. MView_JavaCodeSnippets) and records
+in the MaterializedViews table up to which PostBlockVersion.Id the copy is complete (its watermark). When a
+dump is extended with new versions, refresh() only copies the rows above the watermark. The view's own
+definition stays the single source of truth for which rows belong to it.
+
+    materializer = ViewMaterializer(qs)
+    materializer.materialize('View_JavaCodeSnippets')   # once
+    materializer.refresh('View_JavaCodeSnippets')       # after new versions were loaded
+    qs.use_materialized_views()
+
+Only new versions are picked up by refresh(). If the load also changed existing rows (e.g. the
+MostRecentVersion flags), materialize the view again with rebuild=True.
+"""
+METADATA_TABLE = 'MaterializedViews'
+
+
+def materialized_table_name(view_name: str) -> str:
+    name = view_name[len('View_'):] if view_name.startswith('View_') else view_name
+    return f"MView_{name}"
+
+
+class ViewMaterializer():
+    """
+    Args:
+        qs: A connected QueryService with write access to the database.
+        key_column: The column of the views holding the PostBlockVersion.Id of a row.
+        index_columns: The columns of the views that are indexed in the materialized tables.
+        chunk_size: The number of PostBlockVersion Ids copied (and committed) per INSERT.
+    """
+    def __init__(self, qs, key_column='SnippetId', index_columns=('RootId', 'SnippetId'), chunk_size=1000000):
+        self._qs = qs
+        self._key_column = key_column
+        self._index_columns = index_columns
+        self._chunk_size = chunk_size
+
+    def _create_metadata_table(self):
+        self._qs.execute(f"""CREATE TABLE IF NOT EXISTS {METADATA_TABLE}(
+                                ViewName VARCHAR(255) PRIMARY KEY,
+                                TableName VARCHAR(255) NOT NULL,
+                                Watermark BIGINT NOT NULL,
+                                RowCount BIGINT NOT NULL,
+                                RefreshedAt DATETIME NOT NULL)""")
+
+    def materialize(self, view_name: str, rebuild=False) -> int:
+        """
+        Creates the indexed table of the given view and fills it. An existing table is only refreshed,
+        unless rebuild is True. Returns the number of rows copied.
+        """
+        self._create_metadata_table()
+        table_name = materialized_table_name(view_name)
+        if rebuild:
+            self._qs.execute(f"DROP TABLE IF EXISTS {table_name}")
+            self._qs.execute(f"DELETE FROM {METADATA_TABLE} WHERE ViewName=%s", (view_name,))
+            self._qs.commit()
+        elif self.freshness(view_name) is not None:
+            return self.refresh(view_name)
+
+        self._qs.execute(f"CREATE TABLE {table_name} AS SELECT * FROM {view_name} WHERE 1=0")
+        for column in self._index_columns:
+            self._qs.execute(f"CREATE INDEX {table_name}_{column} ON {table_name}({column})")
+        self._save_metadata(view_name, table_name, watermark=0, row_count=0)
+        return self.refresh(view_name)
+
+    def refresh(self, view_name: str) -> int:
+        """
+        Copies the rows of the view whose PostBlockVersion.Id is above the watermark of its table and
+        advances the watermark. Returns the number of rows copied.
+        """
+        metadata = self.freshness(view_name)
+        if metadata is None:
+            raise ValueError(f"{view_name} has not been materialized")
+        table_name = metadata['TableName']
+        watermark, row_count = metadata['Watermark'], metadata['RowCount']
+        source_max_id = metadata['SourceMaxId'] or 0
+        copied = 0
+        while watermark < source_max_id:
+            chunk_end = min(watermark + self._chunk_size, source_max_id)
+            cursor = self._qs.execute(f"""INSERT INTO {table_name}
+                                          SELECT * FROM {view_name}
+                                          WHERE {self._key_column} > %s AND {self._key_column} <= %s""",
+                                      (watermark, chunk_end))
+            copied += max(cursor.rowcount, 0)
+            watermark = chunk_end
+            # the rows and the watermark that covers them are committed together
+            self._save_metadata(view_name, table_name, watermark, row_count + copied)
+        return copied
+
+    def _save_metadata(self, view_name, table_name, watermark, row_count):
+        self._qs.execute(f"""INSERT INTO {METADATA_TABLE}(ViewName, TableName, Watermark, RowCount, RefreshedAt)
+                             VALUES (%s, %s, %s, %s, NOW())
+                             ON DUPLICATE KEY UPDATE TableName=VALUES(TableName), Watermark=VALUES(Watermark),
+                                                     RowCount=VALUES(RowCount), RefreshedAt=VALUES(RefreshedAt)""",
+                         (view_name, table_name, watermark, row_count))
+        self._qs.commit()
+
+    def freshness(self, view_name: str):
+        """
+        Returns the metadata of the materialized view (TableName, Watermark, RowCount, RefreshedAt), the current
+        maximum PostBlockVersion.Id as SourceMaxId and whether the table is up to date (IsFresh), or None if the
+        view has not been materialized.
+        """
+        self._create_metadata_table()
+        return get_view_freshness(self._qs, view_name)
+
+    def drop(self, view_name: str):
+        self._qs.execute(f"DROP TABLE IF EXISTS {materialized_table_name(view_name)}")
+        self._qs.execute(f"DELETE FROM {METADATA_TABLE} WHERE ViewName=%s", (view_name,))
+        self._qs.commit()
+
+
+def _fetchone_from_primary(qs, query_str, params=None):
+    # the metadata is read where it is written: a read replica (see sources.sotorrent.RoutedDB) may lag behind and
+    # return no or an old watermark, which would make refresh() copy the same rows again
+    rows = qs.client.primary.run_query(query_str, params).fetchall()
+    return rows[0] if rows else None
+
+
+def get_view_freshness(qs, view_name: str):
+    "See ViewMaterializer.freshness(); assumes the metadata table exists"
+    metadata = _fetchone_from_primary(qs, f"""SELECT TableName, Watermark, RowCount, RefreshedAt
+                                              FROM {METADATA_TABLE} WHERE ViewName=%s""", (view_name,))
+    if metadata is None:
+        return None
+    metadata = dict(metadata)
+    metadata['SourceMaxId'] = _fetchone_from_primary(qs, "SELECT MAX(Id) AS MaxId FROM PostBlockVersion")['MaxId']
+    metadata['IsFresh'] = metadata['Watermark'] >= (metadata['SourceMaxId'] or 0)
+    return metadata
+
+
+def get_materialized_tables(qs) -> dict:
+    "Returns the materialized views of the database as a dictionary from view name to table name"
+    exists = qs.execute_and_fetchone("""SELECT COUNT(*) AS count FROM information_schema.TABLES
+                                        WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME=%s""", (METADATA_TABLE,))
+    if not exists['count']:
+        return {}
+    return {row['ViewName']: row['TableName']
+            for row in qs.execute_and_fetchall(f"SELECT ViewName, TableName FROM {METADATA_TABLE}")}
@@ -1,9 +1,100 @@
-"""This script implements unsafe queries and are prone to SQL injection
-   attacks. To fix, implement a run_query() and that take arguments to pass
-   to the underlying execute(...) call.
+"""This script implements the queries run against the SOTorrent DB.
+
+   Many of the older queries interpolate their arguments into the SQL string and are
+   prone to SQL injection attacks. New and point-lookup queries pass their arguments
+   as params to execute(), execute_and_fetchall() or execute_and_fetchone(), which run
+   them as server-side prepared statements that are parsed once per connection.
 """
 
-from sotorrent import SOTorrentDB
+import functools
+import os
+import queue
+import threading
+
+from sources.bulkload import BulkLoader
+from sources.cache import MISSING, make_key
+from sources.embedded import EmbeddedDB
+from sources.materialized_views import get_materialized_tables, get_view_freshness
+from sources.snapshot import SnapshotClient, SnapshotStore
+from sources.sotorrent import RoutedDB, SOTorrentDB
+
+
+def cacheable(method):
+    """Marks a QueryService method whose results may be served from the query cache.
+
+       Only mark lookups against tables that never change within a SOTorrent release. While a marked
+       method runs, execute_and_fetchall() and execute_and_fetchone() read through QueryService.cache.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.cache is None:
+            return method(self, *args, **kwargs)
+        self._cacheable_depth += 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._cacheable_depth -= 1
+    return wrapper
+
+
+def _parse_host(host, default_port):
+    # accepts (host, port) pairs, 'host:port' strings and plain host names
+    if isinstance(host, (tuple, list)):
+        return host[0], int(host[1])
+    name, _, port = host.strip().partition(':')
+    return name, int(port) if port else default_port
+
+
+def _get_read_hosts(read_hosts, db_name):
+    # the replicas serving db_name: from a list, a {db_name: list} mapping or SOTORRENT_READ_HOSTS_<DB_NAME>
+    if read_hosts is None:
+        read_hosts = os.environ.get(f"SOTORRENT_READ_HOSTS_{db_name.upper()}", '')
+        return [read_host for read_host in read_hosts.split(',') if read_host.strip()]
+    if isinstance(read_hosts, dict):
+        return read_hosts.get(db_name, [])
+    return read_hosts
+
+
+def _offline_db_file(db_file, db_name):
+    # one DuckDB file per database, e.g. data/sotorrent.duckdb becomes data/sotorrent_sotorrent22.duckdb
+    if not db_file:
+        return None
+    if '{db_name}' in db_file:
+        return db_file.replace('{db_name}', db_name)
+    root, file_ext = os.path.splitext(db_file)
+    return f"{root}_{db_name}{file_ext}"
+
+
+def _selects_column(columns, column):
+    """Returns True if the result of the SQL column list (e.g. "Id, LEFT(Content, 10) AS Prefix" or "p.*")
+       has a column of the given name.
+    """
+    items, depth, start = [], 0, 0
+    for position, char in enumerate(columns):
+        depth += {'(': 1, ')': -1}.get(char, 0)
+        if char == ',' and depth == 0:
+            items.append(columns[start:position])
+            start = position + 1
+    items.append(columns[start:])
+    for item in items:
+        item = ' '.join(item.split())
+        if item == '*' or item.endswith('.*'):
+            return True
+        name = item.rsplit(' ', 1)[-1] if ' AS ' in item.upper() else item.rsplit('.', 1)[-1]
+        if name.strip('`') == column:
+            return True
+    return False
+
+
+def _unify_schemas(schemas):
+    # promotes the types of a column that differ between batches, e.g. null to int64 or decimal(5, 2) to decimal(7, 2)
+    import pyarrow as pa
+
+    try:
+        return pa.unify_schemas(schemas, promote_options='permissive')
+    except TypeError:
+        # pyarrow < 14 only unifies the null type with other types
+        return pa.unify_schemas(schemas)
 
 
 class QueryService():
@@ -14,30 +105,204 @@ class QueryService():
         # client for connecting to the SOTorrent database.
         # an explicit call to connect() MUST be done to establish a connection to the DB.
         self._client = None
+        # the pool the client was borrowed from, if any
+        self._pool = None
+        # optional read-through cache (see sources.cache.QueryCache) used by the @cacheable methods
+        self._cache = None
+        self._cacheable_depth = 0
+        self._db_name = None
+        # optional sources.version_index.VersionChainIndex answering the version chain lookups
+        self._version_index = None
+        # view name -> materialized table read instead of the view, see use_materialized_views()
+        self._view_tables = {}
+        # optional sources.snapshot.SnapshotStore that the read queries of the client go through
+        self._snapshots = SnapshotStore.from_environment()
+        self._snapshot_client = None
 
     @property
     def client(self):
-        return self._client
+        if self._snapshots is None or self._client is None:
+            return self._client
+        snapshot_client = self._snapshot_client
+        if snapshot_client is None or snapshot_client.client is not self._client or snapshot_client.store is not self._snapshots:
+            snapshot_client = self._snapshot_client = SnapshotClient(self._client, self._snapshots, self._db_name)
+        return snapshot_client
     @client.setter
     def client(self, client):
         self._client = client
 
-    def connect(self, host='127.0.0.1', port=3306, db_name='sotorrent22'):
+    @property
+    def cache(self):
+        return self._cache
+    @cache.setter
+    def cache(self, cache):
+        self._cache = cache
+
+    @property
+    def snapshots(self):
+        return self._snapshots
+    @snapshots.setter
+    def snapshots(self, snapshots):
+        self._snapshots = snapshots
+
+    @property
+    def version_index(self):
+        return self._version_index
+
+    def use_version_index(self, index):
+        """Answers the version chain lookups (getcodeblockversionchain_ids, getcodeblockversionchain_list,
+           getPostBlockVersionIds, getcodeblockversionchain_count, getLatestVersion and getMostRecentVersion)
+           from the given VersionChainIndex instead of the database. Roots missing from the index are still
+           queried. Pass None to stop using the index.
+        """
+        self._version_index = index
+
+    def use_materialized_views(self, enabled=True):
+        """Reads the snippet views (View_JavaCodeSnippets, ...) from their materialized tables where they exist
+           (see sources.materialized_views). Call it again after materializing further views.
+        """
+        self._view_tables = get_materialized_tables(self) if enabled else {}
+
+    def view_freshness(self, databaseView='JavaCodeSnippets'):
+        """Returns the watermark, row count, refresh time and IsFresh flag of the materialized table of
+           View_<databaseView>, or None if the view is not read from a materialized table.
+        """
+        view_name = f"View_{databaseView}"
+        if view_name not in self._view_tables:
+            return None
+        return get_view_freshness(self, view_name)
+
+    def _view_source(self, view_name):
+        return self._view_tables.get(view_name, view_name)
+
+    def _indexed(self, lookup, rootid):
+        # the answer of the version index, or None if there is no index or it does not know the root
+        if self._version_index is None:
+            return None
+        return getattr(self._version_index, lookup)(rootid)
+
+    def connect(self, host='127.0.0.1', port=3306, db_name='sotorrent22', pool=None, allow_local_infile=False,
+                read_hosts=None, routing='round_robin'):
         """Connects to the MySQL server at host:port using the given database name.
+
+           When a SOTorrentDBPool is given, a connection is borrowed from the pool instead (host, port and
+           db_name are then taken from the pool) and close() hands it back to the pool.
+
+           When the SOTORRENT_DATA_DIR environment variable is set, no MySQL server is used at all and the
+           queries run against the exported tables of the database in <SOTORRENT_DATA_DIR>/<db_name>
+           (see connect_offline). SOTORRENT_DUCKDB_FILE optionally names the DuckDB file they are imported into;
+           a {db_name} in it is replaced by the database name, otherwise the name is appended to the file name.
+
+           Set allow_local_infile to let bulk_loader(use_infile=True) send LOAD DATA LOCAL INFILE statements.
+
+           read_hosts lists read replicas of the database as host or (host, port) entries, or maps database names
+           to such lists. Reads are then spread over the replicas of db_name using the given routing strategy
+           ('round_robin' or 'least_loaded'), while writes and commits go to host:port (see
+           sources.sotorrent.RoutedDB). When read_hosts is not given, the replicas are taken from the
+           SOTORRENT_READ_HOSTS_<DB_NAME> environment variable of the database, e.g.
+           SOTORRENT_READ_HOSTS_SOTORRENT22=10.0.0.2:3306,10.0.0.3:3306. Databases without replicas are not routed.
         """
+        if self.client is None and os.environ.get('SOTORRENT_DATA_DIR'):
+            offline_db_name = pool.db_name if pool is not None else db_name
+            self.connect_offline(os.path.join(os.environ['SOTORRENT_DATA_DIR'], offline_db_name),
+                                 _offline_db_file(os.environ.get('SOTORRENT_DUCKDB_FILE'), offline_db_name),
+                                 db_name=offline_db_name)
         if self.client is None:
-            self.client = SOTorrentDB(host=host, port=port, db=db_name)
+            if pool is not None:
+                self._db_name = pool.db_name
+                self.client = pool.acquire()
+                self._pool = pool
+            else:
+                self._db_name = db_name
+                primary = SOTorrentDB(host=host, port=port, db=db_name, allow_local_infile=allow_local_infile)
+                read_hosts = _get_read_hosts(read_hosts, db_name)
+                if read_hosts:
+                    replicas = [SOTorrentDB(host=replica_host, port=replica_port, db=db_name)
+                                for replica_host, replica_port in (_parse_host(read_host, port) for read_host in read_hosts)]
+                    self.client = RoutedDB(primary, replicas, strategy=routing)
+                else:
+                    self.client = primary
+
+    def connect_offline(self, data_dir='data/feather_files', db_file=None, db_name=None):
+        """Runs the queries against an embedded DuckDB database over the tables exported to data_dir
+           (see sources.embedded.EmbeddedDB) instead of a MySQL server. db_name names the database the tables
+           were exported from, so that cached and snapshotted results are shared with connections to it.
+        """
+        if self.client is None:
+            if not os.path.isdir(data_dir):
+                raise FileNotFoundError(f"No exported tables of {db_name or 'the database'} in {data_dir}")
+            self._db_name = db_name or f"offline:{os.path.abspath(data_dir)}"
+            self.client = EmbeddedDB(data_dir=data_dir, db_file=db_file)
+
+    def execute(self, query, params=None):
+        """Executes the given query. When params is given, the query must use %s placeholders
+           and is run as a prepared statement.
+        """
+        return self.client.run_query(query, params)
+
+    def execute_and_fetchall(self, query, params=None) -> tuple:
+        if self._cacheable_depth:
+            return self._cached('all', query, params, lambda: self.execute(query, params).fetchall())
+        return self.execute(query, params).fetchall()
+
+    def _cached(self, kind, query, params, run_query):
+        # cached rows are shared between callers and must not be modified
+        key = make_key(self._db_name, f"{kind}:{query}", params)
+        result = self.cache.get(key)
+        if result is MISSING:
+            result = run_query()
+            self.cache.put(key, result)
+        return result
+
+    def execute_and_stream(self, query, params=None, fetch_size=1000):
+        """Executes the given query and returns a generator over its rows, reading fetch_size rows
+           from the server at a time. Use it for scans whose result does not fit into memory. The
+           connection cannot run other queries until the generator is exhausted or closed.
+        """
+        return self.client.run_query(query, params, stream=True, fetch_size=fetch_size)
+
+    def execute_to_arrow(self, query, params=None, batch_size=65536):
+        """Executes the given query and returns its result as a pyarrow.Table.
+
+           The rows are decoded batch by batch straight into typed Arrow arrays instead of per-row dictionaries.
+           Requires the pyarrow package.
+        """
+        import pyarrow as pa
 
-    def execute(self, query):
-        return self.client.run_query(query)
+        tables = [pa.table([pa.array(column) for column in columns], names=column_names)
+                  for column_names, columns in self.client.fetch_column_batches(query, params, batch_size)]
+        # the types are inferred per batch, e.g. a column that is NULL throughout a batch has the null type there
+        schema = _unify_schemas([table.schema for table in tables])
+        return pa.concat_tables([table.cast(schema) for table in tables])
 
-    def execute_and_fetchall(self, query) -> tuple:
-        return self.execute(query).fetchall()
+    def execute_to_dataframe(self, query, params=None, batch_size=65536):
+        """Executes the given query and returns its result as a pandas.DataFrame with one column per result column.
 
-    def execute_and_fetchone(self, query) -> dict:
+           Uses Arrow for the decoding when pyarrow is installed and builds the columns with pandas otherwise.
+        """
+        try:
+            return self.execute_to_arrow(query, params, batch_size).to_pandas()
+        except ImportError:
+            pass
+        import pandas as pd
+
+        frames = [pd.DataFrame(dict(zip(column_names, columns)), columns=column_names)
+                  for column_names, columns in self.client.fetch_column_batches(query, params, batch_size)]
+        return pd.concat(frames, ignore_index=True)
+
+    def execute_and_fetchone(self, query, params=None) -> dict:
         '''Executes the given query and returns a dictionary containing a single row of a DB table.
         '''
-        return self.execute(query).fetchone()
+        if self._cacheable_depth:
+            return self._cached('one', query, params, lambda: self._fetchone(query, params))
+        return self._fetchone(query, params)
+
+    def _fetchone(self, query, params):
+        if params is None:
+            return self.execute(query).fetchone()
+        # read the complete result so that the prepared statement can be re-executed right away
+        rows = self.execute(query, params).fetchall()
+        return rows[0] if rows else None
 
     def execute_insert_and_commit(self, query : str, rows_to_insert : list) -> int:
         """
@@ -67,31 +332,188 @@ class QueryService():
         """
         self.client.db.commit()
 
+    def bulk_loader(self, table: str, columns: list, batch_size=1000, commit_every=50000, use_infile=False) -> BulkLoader:
+        """
+        Returns a BulkLoader that writes rows into the given table in multi-row batches and commits every
+        commit_every rows (see sources.bulkload). Use it instead of execute_insert_and_commit() when inserting
+        rows one record at a time.
+        """
+        return BulkLoader(self.client, table, columns, batch_size=batch_size, commit_every=commit_every,
+                          use_infile=use_infile)
+
+    def _bulk_insert(self, table: str, columns: list, rows_to_insert) -> int:
+        with self.bulk_loader(table, columns) as loader:
+            loader.add_many(rows_to_insert)
+        return loader.row_count
+
     def close(self):
-        if self.client:
-            self.client.close()
+        if self._client:
+            if self._pool is not None:
+                self._pool.release(self._client)
+                self._pool = None
+            else:
+                self._client.close()
             self.client = None
+            self._snapshot_client = None
+
+    def execute_and_fetch_by_ids(self, query, ids, key, value=None, chunk_size=1000) -> dict:
+        """
+        Runs a set-based lookup for many ids and returns a dictionary keyed by id.
+
+        Args:
+            query: A SELECT query containing a single `IN ({})` clause to be filled with the ids.
+            ids: An iterable of ids to look up. Duplicates are only queried once.
+            key: The result column holding the id.
+            value: The result column to return for each id. When None, the whole row is returned.
+            chunk_size: The number of ids sent per query.
+        Returns:
+            A dictionary mapping each id found in the DB to its value. Ids without a matching row are absent. Of
+            several rows of an id the first is kept, like the single-id lookups using execute_and_fetchone().
+        """
+        ids = list(dict.fromkeys(ids))
+        result = {}
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            size = min(chunk_size, len(ids))
+            # pad the last chunk with its last id so that all chunks share one prepared statement
+            chunk.extend([chunk[-1]] * (size - len(chunk)))
+            chunk_query = query.format(', '.join(['%s'] * size))
+            for row in self.execute_and_fetchall(chunk_query, chunk):
+                result.setdefault(row[key], row if value is None else row[value])
+        return result
+
+    def iter_table(self, table, key='Id', columns='*', where=None, params=(), batch_size=10000,
+                   start_after=None, end_at=None):
+        """
+        Yields the rows of a table in key order, batch_size rows per query, using keyset pagination
+        (`WHERE key > last ORDER BY key LIMIT n`) so that every page costs the same however deep the scan is.
+
+        Args:
+            table: The table (or view) to scan.
+            key: A unique, indexed column to page by.
+            columns: The columns to select, either as a list or as SQL. The key is always selected.
+            where: An optional SQL condition on the rows, using %s placeholders for params.
+            params: The values of the placeholders in where.
+            batch_size: The number of rows fetched per query.
+            start_after: Only rows with a key greater than this are returned. Pass the key of the last row
+                processed to resume an interrupted scan.
+            end_at: Only rows with a key up to and including this are returned.
+        """
+        for page in self._iter_pages(table, key, columns, where, params, batch_size, start_after, end_at):
+            yield from page
+
+    def _iter_pages(self, table, key, columns, where, params, batch_size, start_after, end_at):
+        if not isinstance(columns, str):
+            columns = ', '.join(columns if key in columns else [key, *columns])
+        elif not _selects_column(columns, key):
+            columns = f"{key}, {columns}"
+        last_key = start_after
+        while True:
+            conditions = [f"({where})"] if where else []
+            query_params = list(params)
+            if last_key is not None:
+                conditions.append(f"{key} > %s")
+                query_params.append(last_key)
+            if end_at is not None:
+                conditions.append(f"{key} <= %s")
+                query_params.append(end_at)
+            where_clause = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+            query_str = f"SELECT {columns} FROM {table}{where_clause} ORDER BY {key} ASC LIMIT {int(batch_size)}"
+            page = self.execute_and_fetchall(query_str, query_params)
+            if page:
+                yield page
+            if len(page) < batch_size:
+                return
+            last_key = page[-1][key]
+
+    def key_ranges(self, table, partitions, key='Id', where=None, params=()) -> list:
+        """
+        Splits the (integer) key range of a table into up to the given number of equally wide ranges and returns
+        them as (start_after, end_at) pairs for iter_table().
+        """
+        where_clause = f" WHERE {where}" if where else ''
+        bounds = self.execute_and_fetchone(f"SELECT MIN({key}) AS low, MAX({key}) AS high FROM {table}{where_clause}",
+                                           params)
+        if bounds is None or bounds['low'] is None:
+            return []
+        low, high = bounds['low'] - 1, bounds['high']
+        step = -(-(high - low) // partitions)
+        return [(start, min(start + step, high)) for start in range(low, high, step)]
+
+    def iter_table_parallel(self, pool, table, key='Id', columns='*', where=None, params=(), batch_size=10000,
+                            partitions=4):
+        """
+        Like iter_table(), but scans the table in key ranges (see key_ranges()) on one thread per partition,
+        each on a connection borrowed from the given SOTorrentDBPool. Rows arrive in key order within a
+        partition, but the partitions are interleaved.
+        """
+        pages = queue.Queue(maxsize=2 * partitions)
+        stop = threading.Event()
+        done = object()
+
+        def offer(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=1)
+                    return
+                except queue.Full:
+                    continue
+
+        def scan(start_after, end_at):
+            qs = QueryService()
+            try:
+                qs.connect(pool=pool)
+                for page in qs._iter_pages(table, key, columns, where, params, batch_size, start_after, end_at):
+                    offer(page)
+                    if stop.is_set():
+                        return
+            except Exception as e:
+                offer(e)
+            finally:
+                qs.close()
+                offer(done)
+
+        threads = [threading.Thread(target=scan, args=key_range, daemon=True)
+                   for key_range in self.key_ranges(table, partitions, key, where, params)]
+        for thread in threads:
+            thread.start()
+        finished = 0
+        try:
+            while finished < len(threads):
+                item = pages.get()
+                if item is done:
+                    finished += 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield from item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
 
     def getLatestVersion(self, rootid):
         '''Gets the last snippet version ID for the version chain of the specified rootid
         '''
-        query_str = f"""SELECT Id
+        version_id = self._indexed('latest', rootid)
+        if version_id is not None:
+            return version_id
+        query_str = """SELECT Id
                        FROM PostBlockVersion
-                       WHERE RootPostBlockVersionId={rootid} AND
+                       WHERE RootPostBlockVersionId=%s AND
                              (PredEqual IS NULL OR PredEqual = 0)
                        ORDER BY PostHistoryId ASC
         """
-        cursor = self.client.run_query(query_str)
-        version_ids = [row['Id'] for row in cursor]
+        version_ids = [row['Id'] for row in self.execute_and_fetchall(query_str, (rootid,))]
         return version_ids[-1]
 
     def get_commit_date(self, repo_name, repo_file, commit):
-        query = f"""SELECT CommitDate
+        query = """SELECT CommitDate
                     FROM CloneFileCommits
-                    WHERE RepoName='{repo_name}' AND
-                    RepoFile='{repo_file}' AND
-                    Commit='{commit}'"""
-        ret = self.execute_and_fetchone(query)
+                    WHERE RepoName=%s AND
+                    RepoFile=%s AND
+                    Commit=%s"""
+        ret = self.execute_and_fetchone(query, (repo_name, repo_file, commit))
         if ret:
             return ret['CommitDate']
         return None
@@ -102,33 +524,30 @@ class QueryService():
            Assumes that a connection to the SOTorrent database is already established.
         """
         query_str = """SELECT CreationDate FROM sotorrent19_03.PostVersion 
-                       WHERE PostId={} AND MostRecentVersion=true
-        """.format(postid)
-        iter_cursor = self.client.run_query(query_str)
-        if iter_cursor.rowcount > 0:
-            return iter_cursor.fetchone()['CreationDate']
+                       WHERE PostId=%s AND MostRecentVersion=true
+        """
+        rdict = self.execute_and_fetchone(query_str, (postid,))
+        if rdict:
+            return rdict['CreationDate']
         return None
 
+    @cacheable
     def getPostCreationDate(self, postid):
-        query_str = f"""SELECT CreationDate
+        query_str = """SELECT CreationDate
                         FROM   Posts
-                        WHERE  Id={postid}
+                        WHERE  Id=%s
                     """
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['CreationDate']
+        return self.execute_and_fetchone(query_str, (postid,))['CreationDate']
 
-    def queryCodeBlockIdandContent(self):
+    def queryCodeBlockIdandContent(self, fetch_size=1000):
         query_str = """SELECT Id, Content FROM CodeBlockVersion"""
-        iter_cursor = self.client.run_query(query_str)
-        if iter_cursor.rowcount > 0:
-            return iter_cursor
-        return []
+        return self.execute_and_stream(query_str, fetch_size=fetch_size)
 
     def queryCodeBlockContent(self, snippetid):
-        query_str = f"SELECT Content FROM PostBlockVersion WHERE Id={snippetid}"
-        iter_cursor = self.client.run_query(query_str)
-        if iter_cursor.rowcount > 0:
-            return iter_cursor.fetchone()['Content']
+        query_str = "SELECT Content FROM PostBlockVersion WHERE Id=%s"
+        rdict = self.execute_and_fetchone(query_str, (snippetid,))
+        if rdict:
+            return rdict['Content']
         return None
 
     def queryNullLanguageCodeBlocks(self):
@@ -147,17 +566,15 @@ class QueryService():
         return cursor.fetchall()
 
     def get_descriptions(self, postHistoryid):
-        query_str = f"""SELECT Content 
+        query_str = """SELECT Content 
                        FROM PostBlockVersion 
-                       WHERE PostBlockTypeId=1 AND PostHistoryId={postHistoryid}
+                       WHERE PostBlockTypeId=1 AND PostHistoryId=%s
                     """
-        cursor = self.client.run_query(query_str)
-        return [row['Content'] for row in cursor.fetchall()]
+        return [row['Content'] for row in self.execute_and_fetchall(query_str, (postHistoryid,))]
 
     def getCodeBlockVersionLanguage(self, id_key):
-        query_str = """SELECT Language FROM CodeBlockVersion WHERE Id={}""".format(id_key)
-        iter_cursor = self.client.run_query(query_str)
-        return iter_cursor.fetchone()['Language']
+        query_str = """SELECT Language FROM CodeBlockVersion WHERE Id=%s"""
+        return self.execute_and_fetchone(query_str, (id_key,))['Language']
 
     def update_CodeBlockVersionlanguage(self, id_key, language):
         if not self.getCodeBlockVersionLanguage(id_key):
@@ -196,18 +613,17 @@ class QueryService():
         query_str = """SELECT VersionId, Content FROM CodeBlockVersion WHERE PostId={}""".format(postid)
         return self.client.run_query(query_str)
     
-    def getAllCodeSnippets(self):
+    def getAllCodeSnippets(self, fetch_size=1000):
         query_str = """SELECT VersionId, PostId, Content FROM CodeBlockVersion
         """
-        iter_cursor = self.client.run_query(query_str)
-        return iter_cursor
+        return self.execute_and_stream(query_str, fetch_size=fetch_size)
 
-    def getCodeSnippetsByLanguage_deprecated(self, language):
-        query_str = """SELECT VersionId, PostId, Content FROM CodeBlockVersion WHERE Language='{}'""".format(language)
-        iter_cursor = self.client.run_query(query_str)
-        return iter_cursor
+    def getCodeSnippetsByLanguage_deprecated(self, language, fetch_size=1000):
+        query_str = """SELECT VersionId, PostId, Content FROM CodeBlockVersion WHERE Language=%s"""
+        return self.execute_and_stream(query_str, (language,), fetch_size=fetch_size)
 
     def get_root_postblockversion_ids(self, database_table_or_view, language='Java', limit=None, is_view=False):
+        database_table_or_view = self._view_source(database_table_or_view)
         if limit:
             query_str = f"""SELECT RootPostBlockVersionId
                        FROM {database_table_or_view}
@@ -231,15 +647,14 @@ class QueryService():
         """Get the number of code snippets >=10 LoC rooted at the given rootid.
         """
         query_str = f"""SELECT COUNT(DISTINCT(SnippetId)) as count
-                       FROM  View_{databaseView}
-                       WHERE RootId={rootid}
+                       FROM  {self._view_source(f"View_{databaseView}")}
+                       WHERE RootId=%s
         """
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['count']
+        return self.execute_and_fetchone(query_str, (rootid,))['count']
 
     def get_versions(self, post_id) -> dict:
-        query = f"SELECT Id, CreationDate FROM PostVersion WHERE PostId={post_id} ORDER BY CreationDate"
-        records = self.execute_and_fetchall(query)
+        query = "SELECT Id, CreationDate FROM PostVersion WHERE PostId=%s ORDER BY CreationDate"
+        records = self.execute_and_fetchall(query, (post_id,))
         r = {}
         for row in records:
             r[row['Id']] = row['CreationDate']
@@ -247,11 +662,10 @@ class QueryService():
 
     def get_view_snippet_ids(self, rootid, databaseView='JavaCodeSnippets'):
         query_str = f"""SELECT SnippetId
-                        FROM  View_{databaseView}
-                        WHERE RootId={rootid}
+                        FROM  {self._view_source(f"View_{databaseView}")}
+                        WHERE RootId=%s
         """
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchall()
+        return self.execute_and_fetchall(query_str, (rootid,))
 
     def get_view_snippets_content(self, rootid, databaseView='JavaCodeSnippets'):
         query_str = f"""SELECT Id, Content
@@ -266,25 +680,25 @@ class QueryService():
     def getMostRecentVersion(self, rootid):
         # Get the most recent code snippet version in this version chain identified
         # by the given rootId
+        version_id = self._indexed('most_recent_version', rootid)
+        if version_id is not None:
+            return version_id
 
-        query_str = f"SELECT Id FROM PostBlockVersion WHERE RootPostBlockVersionId={rootid} AND MostRecentVersion=True"
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['Id']
+        query_str = "SELECT Id FROM PostBlockVersion WHERE RootPostBlockVersionId=%s AND MostRecentVersion=True"
+        return self.execute_and_fetchone(query_str, (rootid,))['Id']
 
     def getPostBlockContent(self, snippetid):
-        query_str = f"SELECT Content FROM PostBlockVersion WHERE Id={snippetid}"
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['Content']
+        query_str = "SELECT Content FROM PostBlockVersion WHERE Id=%s"
+        return self.execute_and_fetchone(query_str, (snippetid,))['Content']
 
     def queryclones(self, reponame, repofile, startline, endline, rootid):
-        query_str = f"""SELECT SnippetId, Similarity
+        query_str = """SELECT SnippetId, Similarity
                        FROM CloneResultsTMP
-                       WHERE RepoName='{reponame}' AND RepoFile='{repofile}'
-                             AND StartLine={startline} AND EndLine={endline}
-                             AND RootId={rootid}
+                       WHERE RepoName=%s AND RepoFile=%s
+                             AND StartLine=%s AND EndLine=%s
+                             AND RootId=%s
         """
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchall()
+        return self.execute_and_fetchall(query_str, (reponame, repofile, startline, endline, rootid))
 
     def get_codesnippets_postBlockVersionIds(self, language):
         query_str = f"""SELECT Id, PostBlockVersionId
@@ -295,9 +709,8 @@ class QueryService():
         return cursor.fetchall()
     
     def hasSnippets(self, postid):
-        query_str = """SELECT Id FROM CodeBlockVersion WHERE PostId={} LIMIT 1""".format(postid)
-        iter_cursor = self.client.run_query(query_str)
-        if iter_cursor.rowcount > 0:
+        query_str = """SELECT Id FROM CodeBlockVersion WHERE PostId=%s LIMIT 1"""
+        if self.execute_and_fetchone(query_str, (postid,)):
             return True
         return False
 
@@ -309,31 +722,25 @@ class QueryService():
         cursor = self.client.run_query(query_str)
         return cursor.fetchall()
 
+    @cacheable
     def getposttype(self, postid):
-        query_str = """SELECT PostTypeId FROM Posts WHERE Id={}""".format(postid)
-        iter_cursor = self.client.run_query(query_str)
-        if iter_cursor.rowcount > 0:
-            rdict = iter_cursor.fetchone()
+        query_str = """SELECT PostTypeId FROM Posts WHERE Id=%s"""
+        rdict = self.execute_and_fetchone(query_str, (postid,))
+        if rdict:
             return rdict['PostTypeId']
         return None
 
     def getanswers(self, postid):
         """Returns a set of answers for the given question.
         """
-        query_str = """SELECT Id FROM Posts WHERE ParentId={}""".format(postid)
-        iter_cursor = self.client.run_query(query_str)
-        rows = [row['Id'] for row in iter_cursor]
+        query_str = """SELECT Id FROM Posts WHERE ParentId=%s"""
+        rows = [row['Id'] for row in self.execute_and_fetchall(query_str, (postid,))]
         return set(rows)
 
     def insertClones(self, rows_to_insert):
-        query_str = """
-        INSERT INTO ClonesCprojects(RepoName, Language, RootPostBlockVersionId, PostBlockVersionId, RepoFileStartLine, 
-                        RepoFileEndLine, Similarity, RepoFile, SnippetFile, SnippetFileStartLine, SnippetFileEndLine)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        inserted_row_count = self.client.cursor.executemany(query_str, rows_to_insert)
-        self.client.db.commit()
-        return inserted_row_count
+        columns = ['RepoName', 'Language', 'RootPostBlockVersionId', 'PostBlockVersionId', 'RepoFileStartLine',
+                   'RepoFileEndLine', 'Similarity', 'RepoFile', 'SnippetFile', 'SnippetFileStartLine', 'SnippetFileEndLine']
+        return self._bulk_insert('ClonesCprojects', columns, rows_to_insert)
 
     def insertIntoCrossProductClonesFromClones(self, rows_to_insert):
         query_str = """
@@ -347,22 +754,14 @@ class QueryService():
         return inserted_row_count
 
     def insertIntoCrossProductClones(self, rows_to_insert):
-        query_str = """
-        INSERT INTO CrossProductClones(RepoName, Language, RootPostBlockVersionId, PostBlockVersionId, RepoFileStartLine, 
-                        RepoFileEndLine, Similarity, RepoFile, SnippetFile, SnippetFileStartLine, SnippetFileEndLine, Commit)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        inserted_row_count = self.client.cursor.executemany(query_str, rows_to_insert)
-        self.client.db.commit()
-        return inserted_row_count
+        columns = ['RepoName', 'Language', 'RootPostBlockVersionId', 'PostBlockVersionId', 'RepoFileStartLine',
+                   'RepoFileEndLine', 'Similarity', 'RepoFile', 'SnippetFile', 'SnippetFileStartLine', 'SnippetFileEndLine',
+                   'Commit']
+        return self._bulk_insert('CrossProductClones', columns, rows_to_insert)
 
     def insertIntoCloneFileCommits(self, rows_to_insert):
-        query_str = """INSERT INTO CloneFileCommits(RepoName, RepoFile, Commit, CommitDate, Language)
-                       VALUES (%s, %s, %s, %s, %s)
-        """
-        inserted_row_count = self.client.cursor.executemany(query_str, rows_to_insert)
-        self.client.db.commit()
-        return inserted_row_count
+        columns = ['RepoName', 'RepoFile', 'Commit', 'CommitDate', 'Language']
+        return self._bulk_insert('CloneFileCommits', columns, rows_to_insert)
 
     def insertTimelineAnalysis(self, rows_to_insert):
         query_str = """INSERT INTO TimelineAnalysis(CloneId, Category, Comment, IsSimilar, RepoSnippet, DiffSnippet)
@@ -437,17 +836,16 @@ class QueryService():
         return iter_cursor
 
     def getSnippet(self, snippetid):
-        query_str = "SELECT Content FROM CodeBlockVersion WHERE VersionId={}".format(snippetid)
-        iter_cursor = self.client.run_query(query_str)
-        rdict = iter_cursor.fetchone()
+        query_str = "SELECT Content FROM CodeBlockVersion WHERE VersionId=%s"
+        rdict = self.execute_and_fetchone(query_str, (snippetid,))
         return rdict['Content']
 
     def get_commitdate(self, cloneReposId):
-        query_str = f"""SELECT CommitDate
+        query_str = """SELECT CommitDate
                         FROM CloneCommits 
-                        WHERE CloneReposId={cloneReposId}
+                        WHERE CloneReposId=%s
                     """
-        rdict = self.client.run_query(query_str).fetchone()
+        rdict = self.execute_and_fetchone(query_str, (cloneReposId,))
         return rdict['CommitDate']
 
     def getCopiedSnippetsWithComments(self):
@@ -488,73 +886,112 @@ class QueryService():
         return self.client.run_query(query_str)
 
     def getPostId(self, snippetid):
-        query_str = """SELECT PostId FROM CloneResults WHERE SnippetId={} LIMIT 1
-        """.format(snippetid)
-        iter_cursor = self.client.run_query(query_str)
-        rdict = iter_cursor.fetchone()
+        query_str = """SELECT PostId FROM CloneResults WHERE SnippetId=%s LIMIT 1
+        """
+        rdict = self.execute_and_fetchone(query_str, (snippetid,))
         return rdict['PostId']
 
+    @cacheable
     def get_parentId(self, answerid):
         '''Gets the question the specified answer belongs to.
         '''
-        query_str = f"SELECT ParentId FROM Posts WHERE Id={answerid}"
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['ParentId']
+        query_str = "SELECT ParentId FROM Posts WHERE Id=%s"
+        return self.execute_and_fetchone(query_str, (answerid,))['ParentId']
 
+    @cacheable
     def get_accepted_answer(self, questionid):
-        query_str = f"SELECT AcceptedAnswerId FROM Posts WHERE Id={questionid}"
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['AcceptedAnswerId']
+        query_str = "SELECT AcceptedAnswerId FROM Posts WHERE Id=%s"
+        return self.execute_and_fetchone(query_str, (questionid,))['AcceptedAnswerId']
 
+    @cacheable
     def get_pbv_postId(self, rowid):
-        query_str = f"""SELECT PostId 
+        query_str = """SELECT PostId 
                        FROM PostBlockVersion 
-                       WHERE Id={rowid}
+                       WHERE Id=%s
                        GROUP BY PostId
         """
-        iter_cursor = self.client.run_query(query_str)
-        rdict = iter_cursor.fetchone()
+        rdict = self.execute_and_fetchone(query_str, (rowid,))
         return rdict['PostId']
     
+    @cacheable
     def get_pbv_LocalId(self, postBlockVersionId):
-        query_str = f"""SELECT LocalId 
+        query_str = """SELECT LocalId 
                        FROM PostBlockVersion 
-                       WHERE Id={postBlockVersionId}
+                       WHERE Id=%s
                        GROUP BY LocalId
         """
-        iter_cursor = self.client.run_query(query_str)
-        rdict = iter_cursor.fetchone()
+        rdict = self.execute_and_fetchone(query_str, (postBlockVersionId,))
         return rdict['LocalId']
     
+    @cacheable
     def get_pbv_PostHistoryId(self, postBlockVersionId):
-        query_str = f"""SELECT PostHistoryId 
+        query_str = """SELECT PostHistoryId 
                        FROM PostBlockVersion 
-                       WHERE Id={postBlockVersionId}
+                       WHERE Id=%s
                        GROUP BY PostHistoryId
         """
-        iter_cursor = self.client.run_query(query_str)
-        rdict = iter_cursor.fetchone()
+        rdict = self.execute_and_fetchone(query_str, (postBlockVersionId,))
         return rdict['PostHistoryId']
     
+    @cacheable
     def get_pbv_Content(self, postBlockVersionId):
-        query_str = f"""SELECT Content 
+        query_str = """SELECT Content 
                        FROM PostBlockVersion 
-                       WHERE Id={postBlockVersionId}
+                       WHERE Id=%s
         """
-        iter_cursor = self.client.run_query(query_str)
-        rdict = iter_cursor.fetchone()
+        rdict = self.execute_and_fetchone(query_str, (postBlockVersionId,))
         return rdict['Content']
 
+    @cacheable
     def get_pbv_rootId(self, postBlockVersionId):
-        query_str = f"""SELECT RootPostBlockVersionId 
+        query_str = """SELECT RootPostBlockVersionId 
                        FROM PostBlockVersion 
-                       WHERE Id={postBlockVersionId}
+                       WHERE Id=%s
                        GROUP BY RootPostBlockVersionId
         """
-        iter_cursor = self.client.run_query(query_str)
-        rdict = iter_cursor.fetchone()
+        rdict = self.execute_and_fetchone(query_str, (postBlockVersionId,))
         return rdict['RootPostBlockVersionId']
 
+    # Batched counterparts of the point lookups above. Each takes an iterable of ids and
+    # returns a dictionary keyed by id, using one query per chunk of ids.
+    @cacheable
+    def get_pbv_PostHistoryId_batch(self, postBlockVersionIds) -> dict:
+        query_str = "SELECT Id, PostHistoryId FROM PostBlockVersion WHERE Id IN ({})"
+        return self.execute_and_fetch_by_ids(query_str, postBlockVersionIds, 'Id', 'PostHistoryId')
+
+    @cacheable
+    def get_pbv_postId_batch(self, rowids) -> dict:
+        query_str = "SELECT Id, PostId FROM PostBlockVersion WHERE Id IN ({})"
+        return self.execute_and_fetch_by_ids(query_str, rowids, 'Id', 'PostId')
+
+    @cacheable
+    def get_pbv_rootId_batch(self, postBlockVersionIds) -> dict:
+        query_str = "SELECT Id, RootPostBlockVersionId FROM PostBlockVersion WHERE Id IN ({})"
+        return self.execute_and_fetch_by_ids(query_str, postBlockVersionIds, 'Id', 'RootPostBlockVersionId')
+
+    @cacheable
+    def getcodeblock_linecount_batch(self, snippetids) -> dict:
+        query_str = "SELECT Id, LineCount FROM PostBlockVersion WHERE Id IN ({})"
+        return self.execute_and_fetch_by_ids(query_str, snippetids, 'Id', 'LineCount')
+
+    @cacheable
+    def getSnippetCreationDate_batch(self, historyids) -> dict:
+        """Returns the creation dates of the given post histories. Histories without a
+           PostVersion record are absent from the result (getSnippetCreationDate returns None for them).
+        """
+        query_str = "SELECT PostHistoryId, CreationDate FROM PostVersion WHERE PostHistoryId IN ({})"
+        return self.execute_and_fetch_by_ids(query_str, historyids, 'PostHistoryId', 'CreationDate')
+
+    @cacheable
+    def get_parentId_batch(self, answerids) -> dict:
+        query_str = "SELECT Id, ParentId FROM Posts WHERE Id IN ({})"
+        return self.execute_and_fetch_by_ids(query_str, answerids, 'Id', 'ParentId')
+
+    @cacheable
+    def get_accepted_answer_batch(self, questionids) -> dict:
+        query_str = "SELECT Id, AcceptedAnswerId FROM Posts WHERE Id IN ({})"
+        return self.execute_and_fetch_by_ids(query_str, questionids, 'Id', 'AcceptedAnswerId')
+
     def updateClonesRootId(self, rowid, rootid):
         query_str = f"""UPDATE CloneResultsNew SET RootId={rootid} WHERE Id={rowid}
         """
@@ -590,15 +1027,15 @@ class QueryService():
         return cursor.fetchall()
 
     def get_CrossProductClonesId(self, clonereposId, rootPostBlockVersionId, postBlockVersionId, similarity):
-        query_str = f"""SELECT Id
+        query_str = """SELECT Id
                        FROM CrossProductClones
-                       WHERE CloneReposId={clonereposId} 
-                             AND Similarity={similarity}
-                             AND PostBlockVersionId={postBlockVersionId}
-                             AND RootPostBlockVersionId={rootPostBlockVersionId}
+                       WHERE CloneReposId=%s 
+                             AND Similarity=%s
+                             AND PostBlockVersionId=%s
+                             AND RootPostBlockVersionId=%s
         """
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['Id']
+        params = (clonereposId, similarity, postBlockVersionId, rootPostBlockVersionId)
+        return self.execute_and_fetchone(query_str, params)['Id']
 
     def queryOutdatedClones(self, language='java'):
         query_str = f"""SELECT CrossProductClonesId 
@@ -636,13 +1073,12 @@ class QueryService():
     
     def get_clone_postid(self, rootid):
         # TODO: remove method, not
-        query_str = f"""SELECT PostId
+        query_str = """SELECT PostId
                        FROM CloneResultsNew
-                       WHERE RootId={rootid}
+                       WHERE RootId=%s
                        GROUP BY PostId
         """
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['PostId']
+        return self.execute_and_fetchone(query_str, (rootid,))['PostId']
 
     def get_sample_clones_for_testing(self, similarity=83, limit=10):
         query_str = f""" SELECT RepoName, RepoFile, StartLine, EndLine
@@ -685,34 +1121,30 @@ class QueryService():
         return cursor.fetchall() # returns ({}, {}, {}, {})
 
     def get_clones_rowid(self, cloneReposId, similarity, postblockversionId):
-        query_str = f""" SELECT Id
+        query_str = """ SELECT Id
                          FROM Clones
-                         WHERE CloneReposId={cloneReposId} AND
-                               Similarity={similarity} AND
-                               PostBlockVersionId={postblockversionId}
+                         WHERE CloneReposId=%s AND
+                               Similarity=%s AND
+                               PostBlockVersionId=%s
         """
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['Id']
+        return self.execute_and_fetchone(query_str, (cloneReposId, similarity, postblockversionId))['Id']
 
     def get_post_score(self, postid):
-        query_str = f"""SELECT Score
+        query_str = """SELECT Score
                         FROM Posts
-                        WHERE Id={postid}
+                        WHERE Id=%s
         """
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['Score']
+        return self.execute_and_fetchone(query_str, (postid,))['Score']
 
     def getSnippetPostId(self, snippetid):
-        query_str = f"""SELECT PostId FROM PostBlockVersion WHERE Id={snippetid} LIMIT 1
+        query_str = """SELECT PostId FROM PostBlockVersion WHERE Id=%s LIMIT 1
         """
-        iter_cursor = self.client.run_query(query_str)
-        rdict = iter_cursor.fetchone()
+        rdict = self.execute_and_fetchone(query_str, (snippetid,))
         return rdict['PostId']
 
     def getPostId_from_codeblockversion_table(self, snippetid):
-        query_str = f"SELECT PostId FROM CodeBlockVersion WHERE VersionId={snippetid} LIMIT 1"
-        iter_cursor = self.client.run_query(query_str)
-        rdict = iter_cursor.fetchone()
+        query_str = "SELECT PostId FROM CodeBlockVersion WHERE VersionId=%s LIMIT 1"
+        rdict = self.execute_and_fetchone(query_str, (snippetid,))
         return rdict['PostId']
 
     def updateEvaluationTable(self, postid, snippetid):
@@ -747,26 +1179,24 @@ class QueryService():
         return self.client.run_query(query_str)
 
     def getCloneRepos(self, cloneReposId):
-        query_str = f"""SELECT *
+        query_str = """SELECT *
                        FROM CloneRepos
-                       WHERE Id={cloneReposId}
+                       WHERE Id=%s
         """
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()
+        return self.execute_and_fetchone(query_str, (cloneReposId,))
 
     def getCloneReposId(self, reponame, repofile, startline, endline):
         """Get the rowid (primary key id) matching the given arguments.
         """
-        query_str = f"""SELECT Id 
+        query_str = """SELECT Id 
                         FROM CloneRepos
-                        WHERE RepoName='{reponame}' AND
-                              RepoFile='{repofile}' AND
-                              RepoFileStartLine={startline} AND
-                              RepoFileEndLine={endline}
+                        WHERE RepoName=%s AND
+                              RepoFile=%s AND
+                              RepoFileStartLine=%s AND
+                              RepoFileEndLine=%s
                     """
 
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['Id']
+        return self.execute_and_fetchone(query_str, (reponame, repofile, startline, endline))['Id']
 
     def get_clone_ids(self, similarity):
         query_str = f"""SELECT Id
@@ -854,9 +1284,8 @@ class QueryService():
         self.client.db.commit()
 
     def getRootCreationDate(self, historyid):
-        query_str = f"""SELECT CreationDate FROM RootSnippetDates WHERE PostHistoryId = {historyid} AND CreationDate IS NOT NULL LIMIT 1"""
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['CreationDate']
+        query_str = """SELECT CreationDate FROM RootSnippetDates WHERE PostHistoryId = %s AND CreationDate IS NOT NULL LIMIT 1"""
+        return self.execute_and_fetchone(query_str, (historyid,))['CreationDate']
 
     def getRootHistoriesWithNullDates(self):
         query_str = """SELECT PostHistoryId FROM RootSnippetDates WHERE CreationDate IS NULL 
@@ -880,34 +1309,32 @@ class QueryService():
         return list(rows)
 
     def getcomments(self, postid):
-        query_str = f"SELECT Id, Text, CreationDate FROM Comments WHERE PostId={postid}"
-        return self.client.run_query(query_str)
+        query_str = "SELECT Id, Text, CreationDate FROM Comments WHERE PostId=%s"
+        return self.execute_and_fetchall(query_str, (postid,))
 
     def get_commit_message(self, commit_id):
-        query_str = f"SELECT Comment FROM PostVersion WHERE Id={commit_id}"
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['Comment']
+        query_str = "SELECT Comment FROM PostVersion WHERE Id=%s"
+        return self.execute_and_fetchone(query_str, (commit_id,))['Comment']
 
     def get_commit(self, postid, posthistoryid):
-        query_str = f"""SELECT Id, Comment
+        query_str = """SELECT Id, Comment
                         FROM PostVersion
-                        WHERE PostId={postid} AND PostHistoryId={posthistoryid}
+                        WHERE PostId=%s AND PostHistoryId=%s
         """
-        cursor = self.client.run_query(query_str)
-        if cursor.rowcount == 0:
+        rdict = self.execute_and_fetchone(query_str, (postid, posthistoryid))
+        if rdict is None:
             return None, None
-        rdict = cursor.fetchone()
         return rdict['Id'], rdict['Comment']
 
     def get_commit_messages_after_posthistory(self, postid, posthistoryid):
         '''Returns all the commit messages made to a post revision after the given
            posthistory.
         '''
-        query_str = f"""SELECT Comment
+        query_str = """SELECT Comment
                         FROM PostVersion
-                        WHERE PostId={postid} AND PostHistoryId > {posthistoryid}
+                        WHERE PostId=%s AND PostHistoryId > %s
         """
-        return [ row['Comment'] for row in self.client.run_query(query_str) if row['Comment'] ]
+        return [ row['Comment'] for row in self.execute_and_fetchall(query_str, (postid, posthistoryid)) if row['Comment'] ]
 
     def getcomments_aslist(self, post_id):
         """
@@ -950,44 +1377,44 @@ class QueryService():
         return result
 
     def getInsecureComments(self, postid):
-        query_str = f"SELECT CommentId, CommentText, SecurityRelevant FROM RelevantInsecurePostComments WHERE PostId={postid}"
-        return self.client.run_query(query_str)
+        query_str = "SELECT CommentId, CommentText, SecurityRelevant FROM RelevantInsecurePostComments WHERE PostId=%s"
+        return self.execute_and_fetchall(query_str, (postid,))
 
+    @cacheable
     def getPostHistoryId(self, snippetid) -> int:
         """Returns the PostBlockVersion.PostHistoryId associated with the given snippet
         """
-        query_str = f"SELECT PostHistoryId FROM PostBlockVersion WHERE Id={snippetid}"
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['PostHistoryId']
+        query_str = "SELECT PostHistoryId FROM PostBlockVersion WHERE Id=%s"
+        return self.execute_and_fetchone(query_str, (snippetid,))['PostHistoryId']
     
+    @cacheable
     def getPostHistoryIds(self, postid) -> list:
         """Returns the PostBlockVersion.PostHistoryId associated with the given post
         """
-        query_str = f"""SELECT PostHistoryId 
+        query_str = """SELECT PostHistoryId 
                         FROM PostBlockVersion 
-                        WHERE PostId={postid}
+                        WHERE PostId=%s
                         GROUP BY PostHistoryId
                         ORDER BY PostHistoryId ASC
                         """
-        cursor = self.client.run_query(query_str)
-        return [ row['PostHistoryId'] for row in cursor.fetchall() ]
+        return [ row['PostHistoryId'] for row in self.execute_and_fetchall(query_str, (postid,)) ]
 
+    @cacheable
     def getSnippetCreationDate(self, historyid):
         """Returns the date the given snippet was created.
            Checks the PostVersion table 
         """
-        query_str = f"SELECT CreationDate FROM PostVersion WHERE PostHistoryId={historyid}"
-        cursor = self.client.run_query(query_str)
-        if cursor.rowcount > 0:
-            return cursor.fetchone()['CreationDate']
+        query_str = "SELECT CreationDate FROM PostVersion WHERE PostHistoryId=%s"
+        rdict = self.execute_and_fetchone(query_str, (historyid,))
+        if rdict:
+            return rdict['CreationDate']
         return None
 
     def getRecord(self, snippetid) -> int:
         """Gets the record matching the given snippet
         """
-        query_str = f"SELECT PredCount, SuccCount, MostRecentVersion FROM PostBlockVersion WHERE Id={snippetid}"
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()
+        query_str = "SELECT PredCount, SuccCount, MostRecentVersion FROM PostBlockVersion WHERE Id=%s"
+        return self.execute_and_fetchone(query_str, (snippetid,))
 
     def get_timeline_clones(self, category):
         '''Gets either outdated or potentially up-to-date clones. Currently we have two categories:
@@ -999,17 +1426,16 @@ class QueryService():
         return cursor.fetchall()
 
     def get_crossproductclone(self, clone_id):
-        query_str = f"SELECT * FROM CrossProductClones WHERE Id={clone_id}"
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()
+        query_str = "SELECT * FROM CrossProductClones WHERE Id=%s"
+        return self.execute_and_fetchone(query_str, (clone_id,))
 
     def getPostVersionCount(self, postid) -> int:
         """Gets the number of versions this post has
         """
-        query_str = f"SELECT COUNT(Id) as count FROM PostVersion WHERE PostId={postid}"
-        cursor = self.client.run_query(query_str)
-        if cursor.rowcount > 0:
-            return cursor.fetchone()['count']
+        query_str = "SELECT COUNT(Id) as count FROM PostVersion WHERE PostId=%s"
+        rdict = self.execute_and_fetchone(query_str, (postid,))
+        if rdict:
+            return rdict['count']
         return 0
 
     def get_cloneresults(self):
@@ -1043,12 +1469,11 @@ class QueryService():
         return self.client.run_query(query_str).fetchall()
 
     def get_subsampling_clone_record(self, row_id):
-        query_str = f"""SELECT RootId, SnippetId, RepoSnippet
+        query_str = """SELECT RootId, SnippetId, RepoSnippet
                        FROM CloneResultsNew
-                       WHERE Id={row_id}
+                       WHERE Id=%s
         """
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()
+        return self.execute_and_fetchone(query_str, (row_id,))
 
     def get_android_cloneresults(self):
         query_str = f"""SELECT RepoName, RepoFile, StartLine, EndLine, SnippetId, PostId, Similarity FROM CloneResultsAndroid 
@@ -1090,9 +1515,8 @@ class QueryService():
         return self.client.run_query(query_str)
 
     def getCommentCount(self, postid):
-        query_str = f"SELECT COUNT(Id) as count FROM Comments WHERE PostId={postid}"
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['count']
+        query_str = "SELECT COUNT(Id) as count FROM Comments WHERE PostId=%s"
+        return self.execute_and_fetchone(query_str, (postid,))['count']
 
     def getSnippetsWithNullCreationDates(self):
         query_str = "SELECT SnippetId FROM CloneResults_SnippetRevisionHistory WHERE CreationDate IS NULL GROUP BY SnippetId"
@@ -1117,14 +1541,12 @@ class QueryService():
         return self.client.run_query(query_str)
 
     def getsnippetSuccCount(self, snippetid):
-        query_str = f"SELECT SuccCount FROM PostBlockVersion WHERE Id={snippetid}"
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['SuccCount']
+        query_str = "SELECT SuccCount FROM PostBlockVersion WHERE Id=%s"
+        return self.execute_and_fetchone(query_str, (snippetid,))['SuccCount']
 
     def getrootcodeblock(self, snippetid):
-        query_str = f"SELECT RootPostBlockVersionId FROM PostBlockVersion WHERE ID={snippetid}"
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['RootPostBlockVersionId']
+        query_str = "SELECT RootPostBlockVersionId FROM PostBlockVersion WHERE ID=%s"
+        return self.execute_and_fetchone(query_str, (snippetid,))['RootPostBlockVersionId']
     
     def getRootPostBlockIds(self, postid, totuple=False):
         query_str = f"""SELECT RootPostBlockVersionId 
@@ -1145,55 +1567,62 @@ class QueryService():
         return cursor
 
     def getPredEqualAndSimilarity(self, snippetid):
-        query_str = f"SELECT PredEqual, PredSimilarity FROM PostBlockVersion WHERE Id={snippetid}"
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()
+        query_str = "SELECT PredEqual, PredSimilarity FROM PostBlockVersion WHERE Id=%s"
+        return self.execute_and_fetchone(query_str, (snippetid,))
 
     def getcodeblockversionchain_count(self, rootid):
-        query_str = f"""SELECT COUNT(Id) AS count 
+        count = self._indexed('count', rootid)
+        if count is not None:
+            return count
+        query_str = """SELECT COUNT(Id) AS count 
                         FROM PostBlockVersion 
-                        WHERE RootPostBlockVersionId={rootid} AND (PredEqual IS NULL OR PredEqual = 0) 
+                        WHERE RootPostBlockVersionId=%s AND (PredEqual IS NULL OR PredEqual = 0) 
                         ORDER BY PostHistoryId ASC"""
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['count']
+        return self.execute_and_fetchone(query_str, (rootid,))['count']
 
     def hasMostRecentVersion(self, rootid, linecount=10):
-        query_str = f"""SELECT Id
+        query_str = """SELECT Id
                         FROM PostBlockVersion
-                        WHERE RootPostBlockVersionId={rootid} AND LineCount >= {linecount} AND MostRecentVersion=True
+                        WHERE RootPostBlockVersionId=%s AND LineCount >= %s AND MostRecentVersion=True
                     """
-        cursor = self.client.run_query(query_str)
-        if cursor.rowcount > 0:
+        if self.execute_and_fetchall(query_str, (rootid, linecount)):
             return True
         else:
             return False
 
+    @cacheable
     def getcodeblockcontent(self, snippetid):
-        query_str = f"""SELECT Content
+        query_str = """SELECT Content
                         FROM PostBlockVersion
-                        WHERE Id={snippetid}
+                        WHERE Id=%s
         """
-        return self.client.run_query(query_str).fetchone()['Content']
+        return self.execute_and_fetchone(query_str, (snippetid,))['Content']
 
+    @cacheable
     def getcodeblock_linecount(self, snippetid):
-        query_str = f"""SELECT LineCount
+        query_str = """SELECT LineCount
                         FROM PostBlockVersion
-                        WHERE Id={snippetid}
+                        WHERE Id=%s
         """
-        return self.client.run_query(query_str).fetchone()['LineCount']
+        return self.execute_and_fetchone(query_str, (snippetid,))['LineCount']
 
     def getcodeblockversionchain_ids(self, rootid):
-        query_str = f"SELECT Id FROM PostBlockVersion WHERE RootPostBlockVersionId={rootid} AND (PredEqual IS NULL OR PredEqual = 0) ORDER BY PostHistoryId ASC"
-        return [row['Id'] for row in self.client.run_query(query_str)]
+        version_ids = self._indexed('versions', rootid)
+        if version_ids is not None:
+            return version_ids
+        query_str = "SELECT Id FROM PostBlockVersion WHERE RootPostBlockVersionId=%s AND (PredEqual IS NULL OR PredEqual = 0) ORDER BY PostHistoryId ASC"
+        return [row['Id'] for row in self.execute_and_fetchall(query_str, (rootid,))]
 
     def getcodeblockversionchain_list(self, rootid):
-        query_str = f"""SELECT Id 
+        version_ids = self._indexed('versions', rootid)
+        if version_ids is not None:
+            return version_ids
+        query_str = """SELECT Id 
                         FROM PostBlockVersion 
-                        WHERE RootPostBlockVersionId={rootid} 
+                        WHERE RootPostBlockVersionId=%s 
                         AND (PredEqual IS NULL OR PredEqual = 0) 
                         ORDER BY PostHistoryId ASC"""
-        cursor = self.client.run_query(query_str)
-        return [row['Id'] for row in cursor]
+        return [row['Id'] for row in self.execute_and_fetchall(query_str, (rootid,))]
 
     def deleterows(self, tablename, startrow, endrow):
         query_str = f"""DELETE FROM {tablename} WHERE Id between {startrow} and {endrow}
@@ -1204,13 +1633,15 @@ class QueryService():
         return affected_rows
 
     def getPostBlockVersionIds(self, rootPostBlockVersionId):
-        query_str = f""" SELECT Id
+        version_ids = self._indexed('versions', rootPostBlockVersionId)
+        if version_ids is not None:
+            return version_ids
+        query_str = """ SELECT Id
                         FROM PostBlockVersion
-                        WHERE RootPostBlockVersionId={rootPostBlockVersionId}
+                        WHERE RootPostBlockVersionId=%s
                               AND (PredEqual IS NULL OR PredEqual = 0)
                               ORDER BY PostHistoryId ASC """
-        cursor = self.client.run_query(query_str)
-        return [ row['Id'] for row in cursor.fetchall() ]
+        return [ row['Id'] for row in self.execute_and_fetchall(query_str, (rootPostBlockVersionId,)) ]
 
     def getcodeblockversionchain(self, rootid, linecount, ignoreRecent=False):
         if ignoreRecent:
@@ -1228,16 +1659,15 @@ class QueryService():
         return self.client.run_query(query_str)
 
     def insertIntoRespiceAdspiceProspice(self, rows_to_insert):
-        self.client.cursor.executemany(
-            """INSERT INTO RespiceAdspiceProspice(Org, RepoName, RepoFile, RepoSnippet, StartLine, EndLine,
-                CommitHash, CommitDate, RepoFileCommitCount, CommitCountSinceSnippetAdded, 
-                RootSnippetVersionId, RootSnippetVersionDate, SnippetId, LastSnippetVersionDate,
-                SnippetModificationCount, PostId, PostTypeId, CommentCount, ResultTypeId, SecurityRelevant, Similarity)
-               VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, rows_to_insert)
-        self.client.db.commit()
+        columns = ['Org', 'RepoName', 'RepoFile', 'RepoSnippet', 'StartLine', 'EndLine',
+                   'CommitHash', 'CommitDate', 'RepoFileCommitCount', 'CommitCountSinceSnippetAdded',
+                   'RootSnippetVersionId', 'RootSnippetVersionDate', 'SnippetId', 'LastSnippetVersionDate',
+                   'SnippetModificationCount', 'PostId', 'PostTypeId', 'CommentCount', 'ResultTypeId', 'SecurityRelevant',
+                   'Similarity']
+        return self._bulk_insert('RespiceAdspiceProspice', columns, rows_to_insert)
 
     def getOutdatedResults(self, startlimit, endlimit, resulttypeid=3):
+        # OFFSET paging; use iter_table('RespiceAdspiceProspice', where='ResultTypeId=%s', ...) for full scans
         query_str = f"""SELECT Id, Org, RepoSnippet, SnippetId, SecurityRelevant, CloneRelevant 
                         FROM RespiceAdspiceProspice
                         WHERE ResultTypeId={resulttypeid} LIMIT {startlimit},{endlimit}"""
@@ -1264,9 +1694,8 @@ class QueryService():
         return self.client.run_query(query_str)
 
     def get_commentdate(self, commentid):
-        query_str = f"SELECT CreationDate FROM Comments WHERE Id={commentid}"
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['CreationDate']
+        query_str = "SELECT CreationDate FROM Comments WHERE Id=%s"
+        return self.execute_and_fetchone(query_str, (commentid,))['CreationDate']
     
     def getRespiceSnippet(self):
         query_str = "SELECT Id, PostId, ResultTypeId, CommentCount FROM RespiceAdspiceProspice WHERE ResultTypeId=1 OR ResultTypeId=4"
@@ -1345,10 +1774,9 @@ class QueryService():
         return self.client.run_query(query_str)
 
     def get_root_id(self, snippetid):
-        query_str = f"""SELECT RootSnippetVersionId FROM RespiceAdspiceProspice 
-                        WHERE SnippetId={snippetid} LIMIT 1"""
-        cursor = self.client.run_query(query_str)
-        return cursor.fetchone()['RootSnippetVersionId']
+        query_str = """SELECT RootSnippetVersionId FROM RespiceAdspiceProspice 
+                        WHERE SnippetId=%s LIMIT 1"""
+        return self.execute_and_fetchone(query_str, (snippetid,))['RootSnippetVersionId']
 
     def getCrawledSnippets(self):
         query_str = "SELECT Domain, Snippet FROM CrawledTutorials GROUP BY Domain, Snippet"
@@ -1452,11 +1880,11 @@ class QueryService():
         return [ row['RootSnippetVersionId'] for row in self.client.run_query(query_str)]
     
     def getClonesPerResultSnippetIds(self, rootid):
-        query_str = f"""SELECT SnippetVersionId
+        query_str = """SELECT SnippetVersionId
                        FROM ClonesPerCommitResult
-                       WHERE RootSnippetVersionId={rootid}
+                       WHERE RootSnippetVersionId=%s
         """
-        return [row['SnippetVersionId'] for row in self.client.run_query(query_str)]
+        return [row['SnippetVersionId'] for row in self.execute_and_fetchall(query_str, (rootid,))]
 
     def getRepoFileCommitHash(self, rootid):
         query_str = f"""SELECT RepoName, OriginalRepoFile, CommitHash 
@@ -1467,16 +1895,16 @@ class QueryService():
         return self.client.run_query(query_str)
 
     def getCloneSimilarity(self, reponame, repofile, commithash, rootid, snippetid):
-        query_str = f"""SELECT Similarity FROM ClonesPerCommitResult
-                        WHERE RepoName='{reponame}' AND OriginalRepoFile='{repofile}' 
-                              AND CommitHash='{commithash}'
-                              AND RootSnippetVersionId={rootid} AND SnippetVersionId={snippetid}
+        query_str = """SELECT Similarity FROM ClonesPerCommitResult
+                        WHERE RepoName=%s AND OriginalRepoFile=%s 
+                              AND CommitHash=%s
+                              AND RootSnippetVersionId=%s AND SnippetVersionId=%s
         """
-        cursor = self.client.run_query(query_str)
-        if cursor.rowcount == 0:
+        rdict = self.execute_and_fetchone(query_str, (reponame, repofile, commithash, rootid, snippetid))
+        if rdict is None:
             # NotFound
             return -1
-        return cursor.fetchone()['Similarity']
+        return rdict['Similarity']
     
     def stats_root_snippets_locations(self):
         query_str = """SELECT RootSnippetVersionId, COUNT(DISTINCT(OriginalRepoFile)) as Locations 
@@ -1589,13 +2017,12 @@ class QueryService():
 
     def getcodeblockscount(self, postid):
         # Does this post contains code blocks?
-        query_str = f"""SELECT COUNT(Id) as count
+        query_str = """SELECT COUNT(Id) as count
                        FROM PostBlockVersion
-                       WHERE PostBlockTypeId=2 AND PostId={postid}
+                       WHERE PostBlockTypeId=2 AND PostId=%s
                   
         """
-        cursor = self.client.run_query(query_str)
-        d = cursor.fetchone()
+        d = self.execute_and_fetchone(query_str, (postid,))
         count = d['count']
         return 1 if count > 0 else 0
     
@@ -1649,9 +2076,9 @@ class QueryService():
         return cursor.fetchall()
     
     def getLineCount(self, snippetid):
-        query_str =  f"""SELECT LineCount FROM PostBlockVersion
-                        WHERE Id={snippetid}"""
-        return self.client.run_query(query_str).fetchone()['LineCount']
+        query_str =  """SELECT LineCount FROM PostBlockVersion
+                        WHERE Id=%s"""
+        return self.execute_and_fetchone(query_str, (snippetid,))['LineCount']
 
     def get_comment(self, comment_id):
         """
@@ -1662,8 +2089,8 @@ class QueryService():
         Returns:
             A comment text corresponding to the given ID.
         """
-        query = f"SELECT Text FROM Comments WHERE Id={comment_id}"
-        return self.execute_and_fetchone(query)['Text']
+        query = "SELECT Text FROM Comments WHERE Id=%s"
+        return self.execute_and_fetchone(query, (comment_id,))['Text']
 
 
 
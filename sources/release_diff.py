@@ -0,0 +1,181 @@
+"""
+Diffs between two SOTorrent releases (e.g. sotorrent18_12 and sotorrent22).
+
+Both releases are streamed sorted by a key that is stable across releases and merged in a single pass,
+so reconciling two releases costs two ordered scans instead of one query pair per post. PostBlockVersion
+Ids are renumbered in every release, so post blocks are matched by (PostHistoryId, LocalId); posts are
+matched by their Id. The differences are returned as column batches or as a DataFrame, e.g.:
+
+    qs_18 = QueryService()
+    qs_18.connect(port=3307, db_name='sotorrent18_12')
+    qs_22 = QueryService()
+    qs_22.connect(db_name='sotorrent22')
+    versions = diff_to_dataframe(diff_post_block_versions(qs_18, qs_22))
+    for root in diff_root_snippets(diff_post_block_versions(qs_18, qs_22, include_unchanged=True)):
+        ...
+"""
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'
+
+POST_BLOCK_VERSION_KEY = ['PostHistoryId', 'LocalId']
+POSTS_KEY = ['Id']
+
+
+def merge_diff(old_rows, new_rows, key_columns, compare_columns, include_unchanged=False):
+    """
+    Merges two row streams that are sorted by key_columns and yields (status, old_row, new_row) for every key
+    that was added, removed or whose compare_columns differ (and, with include_unchanged, for all other keys).
+    The row missing on one side is None.
+
+    Both streams are closed when the merge ends, is closed early or raises, so that streamed queries release
+    their connections.
+    """
+    def keyed(rows):
+        for row in rows:
+            yield tuple(row[column] for column in key_columns), row
+
+    old_keyed, new_keyed = keyed(old_rows), keyed(new_rows)
+    try:
+        old, new = next(old_keyed, None), next(new_keyed, None)
+        while old is not None or new is not None:
+            if new is None or (old is not None and old[0] < new[0]):
+                yield REMOVED, old[1], None
+                old = next(old_keyed, None)
+            elif old is None or new[0] < old[0]:
+                yield ADDED, None, new[1]
+                new = next(new_keyed, None)
+            else:
+                if any(old[1][column] != new[1][column] for column in compare_columns):
+                    yield CHANGED, old[1], new[1]
+                elif include_unchanged:
+                    yield UNCHANGED, old[1], new[1]
+                old, new = next(old_keyed, None), next(new_keyed, None)
+    finally:
+        for rows in (old_rows, new_rows):
+            if hasattr(rows, 'close'):
+                rows.close()
+
+
+def diff_tables(qs_old, qs_new, table, key_columns, compare_columns, other_columns=(), where=None,
+                include_unchanged=False, batch_size=65536, fetch_size=10000):
+    """
+    Streams a table of two releases sorted by key_columns and yields the differences as column batches:
+    dictionaries with a Status column, the key columns and an Old/New column for each compared and other column.
+
+    Args:
+        qs_old, qs_new: QueryServices connected to the old and the new release.
+        table: The table to compare.
+        key_columns: The columns identifying a row in both releases.
+        compare_columns: The columns (or SQL expressions with an alias) whose difference marks a row as changed.
+        other_columns: Further columns to carry into the output without comparing them.
+        where: An optional SQL condition applied to both releases.
+    """
+    def select(column):
+        # the name of an `expression AS alias` column in the result
+        return column.rsplit(' AS ', 1)[-1].strip()
+
+    columns = list(dict.fromkeys([*key_columns, *compare_columns, *other_columns]))
+    where_clause = f" WHERE {where}" if where else ''
+    query_str = f"SELECT {', '.join(columns)} FROM {table}{where_clause} ORDER BY {', '.join(key_columns)}"
+    compared = [select(column) for column in compare_columns]
+    carried = [select(column) for column in [*compare_columns, *other_columns] if column not in key_columns]
+
+    def empty_batch():
+        batch = {'Status': []}
+        batch.update({column: [] for column in key_columns})
+        for column in carried:
+            batch[f"Old{column}"] = []
+            batch[f"New{column}"] = []
+        return batch
+
+    old_rows = qs_old.execute_and_stream(query_str, fetch_size=fetch_size)
+    new_rows = qs_new.execute_and_stream(query_str, fetch_size=fetch_size)
+    diff = merge_diff(old_rows, new_rows, key_columns, compared, include_unchanged)
+    batch = empty_batch()
+    try:
+        for status, old_row, new_row in diff:
+            batch['Status'].append(status)
+            key_row = old_row if old_row is not None else new_row
+            for column in key_columns:
+                batch[column].append(key_row[column])
+            for column in carried:
+                batch[f"Old{column}"].append(None if old_row is None else old_row[column])
+                batch[f"New{column}"].append(None if new_row is None else new_row[column])
+            if len(batch['Status']) >= batch_size:
+                yield batch
+                batch = empty_batch()
+    finally:
+        # closes the streams of both releases if the diff is not read to its end
+        diff.close()
+    if batch['Status']:
+        yield batch
+
+
+def diff_post_block_versions(qs_old, qs_new, where=None, include_unchanged=False, batch_size=65536):
+    """
+    Diffs the PostBlockVersion tables of two releases. Versions are matched by (PostHistoryId, LocalId) and
+    compared by their type, line count, PredEqual and a hash of their content. Each side's Id and
+    RootPostBlockVersionId are carried along so that roots can be mapped across releases (see diff_root_snippets).
+    """
+    return diff_tables(qs_old, qs_new, 'PostBlockVersion', POST_BLOCK_VERSION_KEY,
+                       ['PostBlockTypeId', 'LineCount', 'PredEqual', 'MD5(Content) AS ContentHash'],
+                       other_columns=['Id', 'RootPostBlockVersionId', 'PostId'], where=where,
+                       include_unchanged=include_unchanged, batch_size=batch_size)
+
+
+def diff_posts(qs_old, qs_new, posts_table='Posts', where=None, include_unchanged=False, batch_size=65536):
+    "Diffs the posts of two releases by Id, comparing their type, score and edit dates"
+    return diff_tables(qs_old, qs_new, posts_table, POSTS_KEY,
+                       ['PostTypeId', 'Score', 'LastEditDate', 'LastActivityDate'], where=where,
+                       include_unchanged=include_unchanged, batch_size=batch_size)
+
+
+def diff_to_dataframe(batches):
+    "Concatenates the column batches of a diff into a pandas.DataFrame"
+    import pandas as pd
+
+    frames = [pd.DataFrame(batch) for batch in batches]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def diff_root_snippets(version_diff):
+    """
+    Summarizes the batches of diff_post_block_versions(..., include_unchanged=True) per root snippet and yields one
+    dictionary with OldRootPostBlockVersionId, NewRootPostBlockVersionId and Status per root: roots sharing a version
+    in both releases are changed if any of their versions was added, removed or changed, and unchanged otherwise.
+    Roots without any version in the other release were added or removed.
+
+    The versions of a root are spread over the whole diff, so the roots are yielded once it is consumed; only
+    their Ids are kept in the meantime, not the versions.
+    """
+    old_root, new_root = 'OldRootPostBlockVersionId', 'NewRootPostBlockVersionId'
+    # dictionaries are used as insertion-ordered sets
+    matched, removed, added = {}, {}, {}
+    changed_old, changed_new = set(), set()
+    for batch in version_diff:
+        for status, old_id, new_id in zip(batch['Status'], batch[old_root], batch[new_root]):
+            if status in (CHANGED, UNCHANGED):
+                matched[(old_id, new_id)] = None
+            if status in (CHANGED, REMOVED):
+                changed_old.add(old_id)
+            if status in (CHANGED, ADDED):
+                changed_new.add(new_id)
+            if status == REMOVED:
+                removed[old_id] = None
+            elif status == ADDED:
+                added[new_id] = None
+
+    matched_old, matched_new = set(), set()
+    for old_id, new_id in matched:
+        matched_old.add(old_id)
+        matched_new.add(new_id)
+        status = CHANGED if old_id in changed_old or new_id in changed_new else UNCHANGED
+        yield {old_root: old_id, new_root: new_id, 'Status': status}
+    for old_id in removed:
+        if old_id not in matched_old:
+            yield {old_root: old_id, new_root: None, 'Status': REMOVED}
+    for new_id in added:
+        if new_id not in matched_new:
+            yield {old_root: None, new_root: new_id, 'Status': ADDED}
@@ -0,0 +1,80 @@
+"""
+Membership of posts in a Stack Overflow data dump release.
+
+ReleaseIndex holds the sorted Ids of the posts present in a release (e.g. the September2023Posts table)
+together with their LastEditDate, so that checking whether the posts of a whole data set were deleted or
+modified since a release takes one vectorized lookup instead of one query per post, e.g.:
+
+    index = ReleaseIndex.build(qs, 'September2023Posts')
+    deleted = index.is_deleted(post_ids)
+    modified = index.is_modified_since(post_ids, get_release_date('fischer'))
+"""
+import os
+
+import numpy as np
+
+_ARRAYS = ('ids', 'last_edit_dates')
+
+
+class ReleaseIndex():
+    """
+    Args:
+        ids: The sorted Ids of the posts in the release.
+        last_edit_dates: The LastEditDate of each post as datetime64[s], NaT if the post was never edited.
+    """
+    def __init__(self, ids, last_edit_dates):
+        self.ids = ids
+        self.last_edit_dates = last_edit_dates
+
+    @classmethod
+    def build(cls, qs, posts_table='September2023Posts', batch_size=65536):
+        "Reads the Ids and LastEditDates of all posts in the given table of the release"
+        ids, dates = [], []
+        for _, columns in qs.client.fetch_column_batches(f"SELECT Id, LastEditDate FROM {posts_table}",
+                                                         batch_size=batch_size):
+            ids.append(np.asarray(columns[0], dtype=np.int64))
+            dates.append(np.array(columns[1], dtype='datetime64[s]'))
+        ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+        dates = np.concatenate(dates) if dates else np.empty(0, dtype='datetime64[s]')
+        order = np.argsort(ids, kind='stable')
+        return cls(ids[order], dates[order])
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        for name in _ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory: str, mmap=True):
+        mmap_mode = 'r' if mmap else None
+        return cls(*[np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode) for name in _ARRAYS])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _positions(self, post_ids):
+        # the position of each post in the index and whether it is present at all
+        post_ids = np.asarray(post_ids, dtype=np.int64)
+        positions = np.searchsorted(self.ids, post_ids)
+        found = positions < len(self.ids)
+        found[found] = self.ids[positions[found]] == post_ids[found]
+        return positions, found
+
+    def is_deleted(self, post_ids) -> np.ndarray:
+        "Returns a boolean array that is True for the posts that are not in the release"
+        _, found = self._positions(post_ids)
+        return ~found
+
+    def is_modified_since(self, post_ids, release_date) -> np.ndarray:
+        """
+        Returns a boolean array that is True for the posts last edited at or after release_date.
+        Posts that were never edited or are not in the release are not modified.
+        """
+        return self.last_edit_dates_of(post_ids) >= np.datetime64(release_date, 's')
+
+    def last_edit_dates_of(self, post_ids) -> np.ndarray:
+        "Returns the LastEditDate of each post as datetime64[s], NaT for unedited posts and posts not in the release"
+        positions, found = self._positions(post_ids)
+        dates = np.full(len(positions), np.datetime64('NaT'), dtype='datetime64[s]')
+        dates[found] = self.last_edit_dates[positions[found]]
+        return dates
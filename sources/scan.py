@@ -0,0 +1,71 @@
+"""
+Partitioned scans of the large SOTorrent tables (PostBlockVersion, CodeBlockVersion, ...) on a process pool.
+
+A scan query is split into Id-range partitions that run concurrently, one connection per worker process,
+so that a full-table job uses several server cores instead of one. The query marks where the range
+condition goes with `{partition}`, e.g.:
+
+    query = '''SELECT PostId, Language
+               FROM PostBlockVersion pbv
+               INNER JOIN CodeBlockVersion cbv ON pbv.Id = cbv.PostBlockVersionId
+               WHERE {partition}
+               GROUP BY PostId, Language'''
+    for row in scan_partitions(query, 'PostBlockVersion', key_column='pbv.Id'):
+        ...
+
+Every partition returns its own result, so aggregations (GROUP BY, DISTINCT, COUNT) are per partition
+and have to be merged by the caller.
+"""
+from multiprocessing import Pool
+
+from sources.queryservice import QueryService
+from sources.sotorrent import init_process_pool, get_process_pool
+
+
+def _scan_partition(task):
+    query_str, params = task
+    qs = QueryService()
+    qs.connect(pool=get_process_pool())
+    try:
+        return qs.execute_and_fetchall(query_str, params)
+    finally:
+        qs.close()
+
+
+def partition_queries(query: str, table: str, partitions: int, key='Id', key_column=None,
+                      host='127.0.0.1', port=3306, db_name='sotorrent22') -> list:
+    """
+    Returns one copy of the query per Id-range partition of the table, with `{partition}` replaced by the
+    range condition on key_column (defaults to key; qualify it when the query joins several tables).
+    """
+    qs = QueryService()
+    qs.connect(host=host, port=port, db_name=db_name)
+    try:
+        key_ranges = qs.key_ranges(table, partitions, key)
+    finally:
+        qs.close()
+    key_column = key_column or key
+    return [query.replace('{partition}', f"({key_column} > {int(start_after)} AND {key_column} <= {int(end_at)})")
+            for start_after, end_at in key_ranges]
+
+
+def scan_partitions(query: str, table: str, key='Id', key_column=None, params=None, partitions=64, processes=8,
+                    host='127.0.0.1', port=3306, db_name='sotorrent22'):
+    """
+    Runs the query once per Id-range partition of the table on a pool of worker processes and yields the rows
+    of the partitions as they complete (so partitions are not in key order).
+
+    Args:
+        query: A SELECT query with a `{partition}` placeholder in its WHERE clause.
+        table: The table whose key range is partitioned.
+        key: The integer key column of the table.
+        key_column: The key as it is referenced in the query, e.g. 'pbv.Id'. Defaults to key.
+        params: The values of the %s placeholders of the query.
+        partitions: The number of partitions. Use more partitions than processes so that skewed ranges balance out.
+        processes: The number of worker processes, i.e. concurrent connections.
+    """
+    tasks = [(partition_query, params) for partition_query in
+             partition_queries(query, table, partitions, key, key_column, host, port, db_name)]
+    with Pool(processes=processes, initializer=init_process_pool, initargs=(host, port, db_name)) as pool:
+        for rows in pool.imap_unordered(_scan_partition, tasks):
+            yield from rows
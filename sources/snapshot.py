@@ -0,0 +1,226 @@
+"""
+A disk-backed store of query results for reproducible reruns.
+
+When a SnapshotStore is configured, QueryService wraps its client in a SnapshotClient, so every read query
+(whether run through execute_and_fetchall(), execute_and_fetchone(), execute_to_dataframe() or a method using
+the client directly) reads through the store: every result is saved with its column names as a zstd-compressed
+Parquet file keyed by the database, the release and a hash of the SQL and its parameters. In 'record' mode
+results missing from the store are queried and saved; in 'replay' mode the store is the only source and a
+missing result raises SnapshotMissingError, so reviewers and CI can re-run the analysis scripts without a
+MySQL server. Writes are passed to the wrapped client.
+
+The store is configured through the environment:
+
+    SOTORRENT_SNAPSHOT_DIR=data/snapshots SOTORRENT_SNAPSHOT_MODE=record python sources/case_study_1/analysis.py
+    SOTORRENT_SNAPSHOT_DIR=data/snapshots SOTORRENT_SNAPSHOT_MODE=replay python sources/case_study_1/analysis.py
+
+SOTORRENT_SNAPSHOT_RELEASE names the release of the dump (defaults to the database name),
+SOTORRENT_SNAPSHOT_MAX_AGE_DAYS and SOTORRENT_SNAPSHOT_MAX_MB bound the store.
+
+Requires the pyarrow package.
+"""
+import os
+import time
+
+from sources.cache import make_key
+from sources.sotorrent import is_read_query
+
+MODES = ('record', 'replay')
+
+
+class SnapshotMissingError(KeyError):
+    "Raised in replay mode when a query has no snapshot"
+
+
+class SnapshotStore():
+    """
+    Args:
+        directory: The directory holding the snapshots.
+        mode: 'record' to query and save missing results, 'replay' to only read saved results.
+        release: The name of the frozen dump the results belong to. Defaults to the database name.
+        max_age_days: Snapshots not read or written for longer are deleted by evict().
+        max_bytes: Once the snapshots are larger, the least recently used ones are deleted by evict().
+    """
+    def __init__(self, directory: str, mode='record', release=None, max_age_days=None, max_bytes=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown snapshot mode: {mode}")
+        self.directory = directory
+        self.mode = mode
+        self.release = release
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if max_age_days is not None or max_bytes is not None:
+            self.evict()
+
+    @classmethod
+    def from_environment(cls):
+        "Returns the store configured by the SOTORRENT_SNAPSHOT_* environment variables, or None"
+        directory = os.environ.get('SOTORRENT_SNAPSHOT_DIR')
+        if not directory:
+            return None
+        max_age_days = os.environ.get('SOTORRENT_SNAPSHOT_MAX_AGE_DAYS')
+        max_mb = os.environ.get('SOTORRENT_SNAPSHOT_MAX_MB')
+        return cls(directory, mode=os.environ.get('SOTORRENT_SNAPSHOT_MODE', 'record'),
+                   release=os.environ.get('SOTORRENT_SNAPSHOT_RELEASE'),
+                   max_age_days=float(max_age_days) if max_age_days else None,
+                   max_bytes=int(float(max_mb) * 1024 * 1024) if max_mb else None)
+
+    def _path(self, db_name: str, query: str, params) -> str:
+        release = self.release or db_name
+        key = make_key(f"{db_name}@{release}", query, params)
+        return os.path.join(self.directory, release, key[:2], f"{key}.parquet")
+
+    def fetch_columns(self, db_name: str, query: str, params, run_query) -> tuple:
+        """
+        Returns the saved result of the query as (column_names, columns), with one list of values per column.
+        In record mode, a missing result is read with run_query(), which returns it in the same form, and saved.
+        """
+        import pyarrow.parquet as pq
+
+        path = self._path(db_name, query, params)
+        if os.path.exists(path):
+            self.hits += 1
+            os.utime(path)  # marks the snapshot as recently used for evict()
+            table = pq.read_table(path)
+            return table.column_names, [column.to_pylist() for column in table.columns]
+        self.misses += 1
+        if self.mode == 'replay':
+            raise SnapshotMissingError(f"No snapshot of {' '.join(query.split())} {params or ''} in {self.directory}")
+        column_names, columns = run_query()
+        self._save(path, column_names, columns)
+        return column_names, columns
+
+    def _save(self, path: str, column_names: list, columns: list):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        try:
+            table = pa.table([pa.array(column) for column in columns], names=column_names)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            # columns mixing value types cannot be stored in Parquet; such results are always queried
+            print(f"Not saving snapshot {path}: {e}", flush=True)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        pq.write_table(table, temp_path, compression='zstd')
+        os.replace(temp_path, path)
+
+    def evict(self):
+        """
+        Deletes the snapshots that were not used for max_age_days, then the least recently used ones until the
+        store is within max_bytes. Returns the number of deleted snapshots.
+        """
+        snapshots = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.parquet'):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    snapshots.append((stat.st_mtime, stat.st_size, path))
+        snapshots.sort()
+        evicted = []
+        if self.max_age_days is not None:
+            oldest_kept = time.time() - self.max_age_days * 24 * 3600
+            evicted = [snapshot for snapshot in snapshots if snapshot[0] < oldest_kept]
+            snapshots = snapshots[len(evicted):]
+        if self.max_bytes is not None:
+            size = sum(snapshot[1] for snapshot in snapshots)
+            for snapshot in snapshots:
+                if size <= self.max_bytes:
+                    break
+                evicted.append(snapshot)
+                size -= snapshot[1]
+        for _, _, path in evicted:
+            os.remove(path)
+        return len(evicted)
+
+
+class SnapshotCursor():
+    "A cursor over the rows of a snapshot, with the interface of the dictionary cursors of SOTorrentDB"
+    def __init__(self, column_names: list, columns: list):
+        self.column_names = list(column_names)
+        self._rows = list(zip(*columns)) if columns else []
+        self._position = 0
+        self.rowcount = len(self._rows)
+
+    def fetchmany(self, size=1):
+        rows = self._rows[self._position:self._position + size]
+        self._position += len(rows)
+        return [dict(zip(self.column_names, row)) for row in rows]
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchall(self):
+        return self.fetchmany(len(self._rows) - self._position)
+
+    def __iter__(self):
+        row = self.fetchone()
+        while row is not None:
+            yield row
+            row = self.fetchone()
+
+    def close(self):
+        pass
+
+
+class SnapshotClient():
+    """
+    Wraps a SOTorrentDB, RoutedDB or EmbeddedDB client so that its read queries are answered from a SnapshotStore.
+
+    Writes, commits and everything else are passed to the wrapped client, which in replay mode is never
+    connected as long as only read queries are run. Reads run on its primary are not snapshotted.
+
+    Args:
+        client: The wrapped client.
+        store: The SnapshotStore.
+        db_name: The name of the database the client is connected to, part of the snapshot keys.
+    """
+    def __init__(self, client, store: SnapshotStore, db_name: str):
+        self.client = client
+        self.store = store
+        self.db_name = db_name
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _fetch_columns(self, query_str, params):
+        def run_query():
+            column_names, columns = [], None
+            for column_names, batch in self.client.fetch_column_batches(query_str, params):
+                if columns is None:
+                    columns = [list(column) for column in batch]
+                else:
+                    for column, values in zip(columns, batch):
+                        column.extend(values)
+            return column_names, columns or []
+        return self.store.fetch_columns(self.db_name, query_str, params, run_query)
+
+    def run_query(self, query_str, params=None, stream=False, fetch_size=1000):
+        if not is_read_query(query_str):
+            return self.client.run_query(query_str, params, stream, fetch_size)
+        if stream:
+            return self.stream_query(query_str, params, fetch_size)
+        return SnapshotCursor(*self._fetch_columns(query_str, params))
+
+    def run_prepared(self, query_str, params=()):
+        if not is_read_query(query_str):
+            return self.client.run_prepared(query_str, params)
+        return SnapshotCursor(*self._fetch_columns(query_str, params))
+
+    def stream_query(self, query_str, params=None, fetch_size=1000):
+        if not is_read_query(query_str):
+            return self.client.stream_query(query_str, params, fetch_size)
+        return iter(SnapshotCursor(*self._fetch_columns(query_str, params)))
+
+    def fetch_column_batches(self, query_str, params=None, batch_size=65536):
+        if not is_read_query(query_str):
+            return self.client.fetch_column_batches(query_str, params, batch_size)
+        column_names, columns = self._fetch_columns(query_str, params)
+        row_count = len(columns[0]) if columns else 0
+        # at least one (possibly empty) batch, as from the wrapped clients
+        return ((column_names, [tuple(column[start:start + batch_size]) for column in columns])
+                for start in range(0, max(row_count, 1), batch_size))
@@ -1,22 +1,58 @@
+import threading
+import time
+from collections import OrderedDict
+
 import mysql.connector as mysql
 
+from sources.instrumentation import get_stats
 from sources.util import get_db_user, get_db_password
 
 
 class SOTorrentDB():
     # replace DB_NAME with the name of the database
-    def __init__(self, host='127.0.0.1', port= 3306, user=get_db_user(), passwd=get_db_password(), db='DB_NAME'):
-        self._connection = mysql.connect(host=host, port=port, user=user, passwd=passwd, db=db, use_unicode=True)
-        self._connection.set_charset_collation(charset='utf8', collation='utf8mb4_unicode_ci')
-        self._cursor = self._connection.cursor(dictionary=True)
+    # user and passwd default to the DB_USER and DB_PASSWORD environment variables.
+    # The connection (and the lookup of the credentials) only happens when the client is first used.
+    def __init__(self, host='127.0.0.1', port= 3306, user=None, passwd=None, db='DB_NAME',
+                 max_statements=256, allow_local_infile=False):
+        self._connect_kwargs = dict(host=host, port=port, user=user, passwd=passwd, db=db,
+                                    use_unicode=True, allow_local_infile=allow_local_infile)
+        self._connection = None
+        self._cursor = None
+        # server-side prepared statements of this connection, keyed by the SQL text.
+        # Each entry keeps the SQL string object the statement was prepared with, since the
+        # prepared cursor only skips re-preparing when it is handed that very same object.
+        self._statements = OrderedDict()
+        self._max_statements = max_statements
 
     @property
     def cursor(self):
+        if self._cursor is None:
+            self._cursor = self.db.cursor(dictionary=True)
         return self._cursor
     @property
     def db(self):
+        if self._connection is None:
+            kwargs = dict(self._connect_kwargs)
+            kwargs['user'] = kwargs['user'] if kwargs['user'] is not None else get_db_user()
+            kwargs['passwd'] = kwargs['passwd'] if kwargs['passwd'] is not None else get_db_password()
+            self._connection = mysql.connect(**kwargs)
+            self._connection.set_charset_collation(charset='utf8', collation='utf8mb4_unicode_ci')
         return self._connection
 
+    @property
+    def primary(self):
+        "The client writes go to; reads that must see the latest writes run on it, see RoutedDB"
+        return self
+
+    @property
+    def is_connected(self):
+        return self._connection is not None
+
+    @property
+    def database(self) -> str:
+        "host:port/db of the database this client connects to"
+        return f"{self._connect_kwargs['host']}:{self._connect_kwargs['port']}/{self._connect_kwargs['db']}"
+
     def fetchall_changed_versions(self, root_post_block_version_id):
         """
         TODO: remove
@@ -32,13 +68,343 @@ class SOTorrentDB():
         result = self.cursor.fetchone() # there MUST be at least one record in case there are no edits to the postblocks (it points to itself)
         return result['edits']
 
+    def is_healthy(self):
+        "Returns True if the server still answers on this connection (or no connection has been made yet)"
+        if self._connection is None:
+            return True
+        try:
+            self.db.ping()
+        except mysql.Error:
+            return False
+        return True
+
+    def reset(self):
+        """
+        Discards a result that was not read to its end and rolls back the open transaction. Connections run with
+        autocommit off, so a connection that is only read from keeps the snapshot of its first query until then.
+        """
+        if self._connection is None:
+            return
+        self._connection.consume_results()
+        self._connection.rollback()
+
+    def _close_unbuffered(self, cursor):
+        # the rows that were not fetched must be read before the cursor can be closed or the connection can run
+        # another statement, e.g. when a stream is closed early or its consumer raised
+        try:
+            if self._connection is not None:
+                self._connection.consume_results()
+            cursor.close()
+        except mysql.Error:
+            # the connection broke while reading the rest of the result; the next query reconnects
+            self._statements.clear()
+            connection, self._connection, self._cursor = self._connection, None, None
+            try:
+                if connection is not None:
+                    connection.close()
+            except mysql.Error:
+                pass
+
     def close(self):
         "Closes the underlying connection to the database"
-        self.db.close()
+        stats = get_stats()
+        if stats is not None and self._connection is not None:
+            self._explain_slow_queries(stats)
+        for _, cursor in self._statements.values():
+            cursor.close()
+        self._statements.clear()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+            self._cursor = None
 
-    def run_query(self, query_str):
+    def run_query(self, query_str, params=None, stream=False, fetch_size=1000):
         """
         Execute the given query against the SOTorrent database and return an iterator over the result.
+
+        When params is given, the query is executed as a server-side prepared statement (see run_prepared).
+        When stream is True, the query is executed on an unbuffered cursor and a generator is returned that
+        reads the rows from the server fetch_size rows at a time (see stream_query).
+        While query statistics are enabled (see sources.instrumentation), the result is wrapped to count its rows.
+        """
+        stats = get_stats()
+        if stats is not None:
+            self._explain_slow_queries(stats)
+            started = time.perf_counter()
+        if stream:
+            result = self.stream_query(query_str, params, fetch_size)
+        elif params is not None:
+            result = self.run_prepared(query_str, params)
+        else:
+            self.cursor.execute(query_str)
+            result = self.cursor
+        return result if stats is None else stats.track(result, query_str, params, started, database=self.database)
+
+    def _explain_slow_queries(self, stats):
+        # the plans are captured before the next query on the same database (or when closing the connection),
+        # once the result of the slow query has been read
+        for query in stats.pending_explains(self.database):
+            cursor = self.db.cursor(dictionary=True, buffered=True)
+            try:
+                cursor.execute('EXPLAIN ' + query['query'], query['params'])
+                query['plan'] = cursor.fetchall()
+            except mysql.Error as e:
+                query['plan'] = [f"EXPLAIN failed: {e}"]
+            finally:
+                cursor.close()
+
+    def stream_query(self, query_str, params=None, fetch_size=1000):
+        """
+        Execute the given query on an unbuffered cursor and yield its rows as dictionaries.
+
+        Only fetch_size rows are held in client memory at any time, so full-table scans run in constant memory.
+        The query is sent when the first row is requested. Until the generator is exhausted or closed, the
+        connection is busy with the result and cannot run other queries.
+        """
+        cursor = self.db.cursor(dictionary=True, buffered=False)
+        try:
+            cursor.execute(query_str, params)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            # discards the rows that were not read if the generator is closed early
+            self._close_unbuffered(cursor)
+
+    def fetch_column_batches(self, query_str, params=None, batch_size=65536):
+        """
+        Execute the given query and yield its result as (column_names, columns) batches of up to batch_size rows,
+        where columns holds one tuple of values per column.
+
+        Rows are read as plain tuples and transposed per batch, so no per-row dictionaries are built.
+        At least one (possibly empty) batch is yielded so that callers always learn the column names.
+        """
+        stats = get_stats()
+        if stats is None:
+            return self._column_batches(query_str, params, batch_size)
+        self._explain_slow_queries(stats)
+        return stats.track(self._column_batches(query_str, params, batch_size), query_str, params,
+                           time.perf_counter(), column_batches=True, database=self.database)
+
+    def _column_batches(self, query_str, params, batch_size):
+        cursor = self.db.cursor(buffered=False)
+        try:
+            cursor.execute(query_str, params)
+            column_names = list(cursor.column_names)
+            first_batch = True
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if rows or first_batch:
+                    columns = list(zip(*rows)) if rows else [() for _ in column_names]
+                    yield column_names, columns
+                first_batch = False
+                if not rows:
+                    break
+        finally:
+            self._close_unbuffered(cursor)
+
+    def run_prepared(self, query_str, params=()):
+        """
+        Execute the given parameterized query (using %s placeholders) as a server-side prepared statement.
+
+        Statements are prepared once per connection and kept in a bounded cache, so repeated executions of
+        the same statement shape only send the parameters to the server. The least recently used statement
+        is deallocated once more than max_statements distinct statements have been prepared.
+        """
+        entry = self._statements.get(query_str)
+        if entry is None:
+            entry = (query_str, self.db.cursor(prepared=True, dictionary=True))
+            self._statements[query_str] = entry
+            if len(self._statements) > self._max_statements:
+                _, (_, evicted) = self._statements.popitem(last=False)
+                evicted.close()
+        else:
+            self._statements.move_to_end(query_str)
+        statement, cursor = entry
+        cursor.execute(statement, tuple(params))
+        return cursor
+
+
+class SOTorrentDBPool():
+    """
+    A thread-safe pool of SOTorrentDB connections to a single database.
+
+    Connections are created lazily up to max_size and handed out with acquire(). A connection
+    that has been idle for longer than health_check_interval seconds is pinged before it is handed
+    out again and replaced if the server no longer answers. acquire() blocks while all max_size
+    connections are in use.
+    """
+    def __init__(self, host='127.0.0.1', port=3306, db='sotorrent22', max_size=4, health_check_interval=60):
+        self._kwargs = dict(host=host, port=port, db=db)
+        self._idle = []  # (client, released_at) pairs, most recently released last
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._health_check_interval = health_check_interval
+
+    @property
+    def db_name(self) -> str:
+        return self._kwargs['db']
+
+    def acquire(self, timeout=None) -> SOTorrentDB:
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(f"No connection to {self._kwargs['db']} became available within {timeout}s")
+        try:
+            while True:
+                with self._lock:
+                    client, released_at = self._idle.pop() if self._idle else (None, None)
+                if client is None:
+                    return SOTorrentDB(**self._kwargs)
+                if time.monotonic() - released_at < self._health_check_interval or client.is_healthy():
+                    return client
+                try:
+                    client.close()
+                except mysql.Error:
+                    pass  # the connection is already gone
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, client: SOTorrentDB):
         """
-        self.cursor.execute(query_str)
-        return self.cursor
+        Hands the connection back to the pool. Its unread results are discarded and its transaction is rolled back
+        (see SOTorrentDB.reset), so the next borrower starts on a fresh snapshot; a connection that fails to do so
+        is closed instead.
+        """
+        try:
+            try:
+                client.reset()
+            except mysql.Error:
+                try:
+                    client.close()
+                except mysql.Error:
+                    pass  # the connection is already gone
+                return
+            with self._lock:
+                self._idle.append((client, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def close(self):
+        "Closes all idle connections. Connections that are still in use are not affected"
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for client, _ in idle:
+            client.close()
+
+
+# statements that only read and may run on a replica; SELECT ... FOR UPDATE/INTO is sent to the primary
+_READ_VERBS = ('SELECT', 'SHOW', 'EXPLAIN', 'DESCRIBE', 'DESC', 'WITH')
+
+
+def is_read_query(query_str: str) -> bool:
+    "Returns True if the given statement only reads data"
+    words = query_str.lstrip(' \t\r\n(').split(None, 1)
+    if not words or words[0].upper() not in _READ_VERBS:
+        return False
+    statement = ' '.join(query_str.upper().split())
+    return ' FOR UPDATE' not in statement and ' INTO ' not in statement.replace('INSERT INTO', '')
+
+
+class RoutedDB():
+    """
+    A client that sends reads to a set of read replicas and everything else to the primary.
+
+    Statements are classified by their SQL verb (see is_read_query): reads are spread over the replicas,
+    while writes, the cursor used by executemany() and the BulkLoader, and commit() (through db) always
+    use the primary. Replicas may lag behind the primary, so read rows you have just written from the primary.
+
+    Args:
+        primary: The SOTorrentDB client of the primary.
+        replicas: The SOTorrentDB clients of the read replicas. Without replicas, reads go to the primary.
+        strategy: 'round_robin' to rotate over the replicas, or 'least_loaded' to read from the replica with the
+            fewest running threads, re-checked every load_check_interval seconds.
+    """
+    def __init__(self, primary, replicas, strategy='round_robin', load_check_interval=5):
+        if strategy not in ('round_robin', 'least_loaded'):
+            raise ValueError(f"Unknown routing strategy: {strategy}")
+        self._primary = primary
+        self._replicas = list(replicas) or [primary]
+        self._strategy = strategy
+        self._load_check_interval = load_check_interval
+        self._next_replica = 0
+        self._least_loaded = None
+        self._load_checked_at = 0
+
+    @property
+    def primary(self):
+        return self._primary
+    @property
+    def cursor(self):
+        return self._primary.cursor
+    @property
+    def db(self):
+        return self._primary.db
+
+    @staticmethod
+    def _threads_running(client):
+        cursor = client.db.cursor(dictionary=True, buffered=True)
+        try:
+            cursor.execute("SHOW GLOBAL STATUS LIKE 'Threads_running'")
+            return int(cursor.fetchone()['Value'])
+        except mysql.Error:
+            return float('inf')
+        finally:
+            cursor.close()
+
+    def _reader(self):
+        if self._strategy == 'least_loaded':
+            if self._least_loaded is None or time.monotonic() - self._load_checked_at >= self._load_check_interval:
+                self._least_loaded = min(self._replicas, key=self._threads_running)
+                self._load_checked_at = time.monotonic()
+            return self._least_loaded
+        client = self._replicas[self._next_replica % len(self._replicas)]
+        self._next_replica += 1
+        return client
+
+    def _route(self, query_str):
+        return self._reader() if is_read_query(query_str) else self._primary
+
+    def is_healthy(self):
+        return self._primary.is_healthy() and all(replica.is_healthy() for replica in self._replicas)
+
+    def close(self):
+        for client in {id(client): client for client in [self._primary, *self._replicas]}.values():
+            client.close()
+
+    def run_query(self, query_str, params=None, stream=False, fetch_size=1000):
+        return self._route(query_str).run_query(query_str, params, stream, fetch_size)
+
+    def run_prepared(self, query_str, params=()):
+        return self._route(query_str).run_prepared(query_str, params)
+
+    def stream_query(self, query_str, params=None, fetch_size=1000):
+        return self._route(query_str).stream_query(query_str, params, fetch_size)
+
+    def fetch_column_batches(self, query_str, params=None, batch_size=65536):
+        return self._route(query_str).fetch_column_batches(query_str, params, batch_size)
+
+
+# The connection pool of the current (worker) process, see init_process_pool()
+_process_pool = None
+
+
+def init_process_pool(host='127.0.0.1', port=3306, db='sotorrent22', max_size=1, health_check_interval=60):
+    """
+    Creates the connection pool of the current process. Pass it as the initializer of a multiprocessing Pool
+    so that every worker process connects once instead of once per task, e.g.:
+
+        Pool(processes=50, initializer=init_process_pool, initargs=('127.0.0.1', 3306, 'sotorrent22'))
+    """
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.close()
+    _process_pool = SOTorrentDBPool(host=host, port=port, db=db, max_size=max_size,
+                                    health_check_interval=health_check_interval)
+    return _process_pool
+
+
+def get_process_pool():
+    "Returns the connection pool of the current process or None if init_process_pool() was not called"
+    return _process_pool
@@ -6,10 +6,12 @@ import subprocess
 import traceback
 import shlex
 from datetime import datetime
+from typing import TYPE_CHECKING
 
-from sqlalchemy import create_engine
-
-from sources.queryservice import QueryService
+# sqlalchemy and the DB layer are imported where they are used: sources.sotorrent imports this module,
+# and scripts that only need the helpers below should not pay for loading them
+if TYPE_CHECKING:
+    from sources.queryservice import QueryService
 
 
 class Command(object):
@@ -58,13 +60,15 @@ def get_db_password():
 
 
 def get_db_engine(db_user, db_password, database, db_host='127.0.0.1'):
+    from sqlalchemy import create_engine
+
     return create_engine(f"mysql+mysqlconnector://{db_user}:{db_password}@{db_host}/{database}")
 
 
 def get_base_path() -> str:
     return '/home/alfusainey.jallow/gitlab' if len(sys.argv) > 1 else '/Users/alfu/phd/gitlab'
 
-def get_snippet_creation_date(snippet_id, qs: QueryService):
+def get_snippet_creation_date(snippet_id, qs: 'QueryService'):
     history_id = qs.get_pbv_PostHistoryId(snippet_id)
     return qs.getSnippetCreationDate(history_id)
 
@@ -81,17 +85,19 @@ def str_to_datetime(date_str: str) -> datetime:
     return datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
 
 
-def get_posts_with_code():
+def get_posts_with_code(partitions=64, processes=8):
+    from sources.scan import scan_partitions
+
+    # each PostBlockVersion Id range is grouped on its own worker; the set below merges the partitions
     query = """SELECT PostId, Language
                FROM PostBlockVersion pbv
                INNER JOIN CodeBlockVersion cbv
                  ON pbv.Id = cbv.PostBlockVersionId
+               WHERE {partition}
                GROUP BY PostId, Language
             """
-    qs = QueryService()
-    qs.connect(db_name='sotorrent22')
-    records = qs.execute_and_fetchall(query)
-    qs.close()
+    records = scan_partitions(query, 'PostBlockVersion', key_column='pbv.Id', partitions=partitions,
+                              processes=processes, db_name='sotorrent22')
 
     posts = set()
     for row in records:
@@ -168,16 +174,23 @@ def get_snippet_length_data(input_tuple):
                 WHERE PostId={post_id} AND PostBlockTypeId=2
                 GROUP BY RootPostBlockVersionId, Id, LineCount
     """
+    from sources.queryservice import QueryService
+    from sources.sotorrent import get_process_pool
+
     qs = QueryService()
-    qs.connect(db_name='sotorrent22')
+    # reuse the worker's pooled connection when running inside a Pool initialized with init_process_pool
+    qs.connect(db_name='sotorrent22', pool=get_process_pool())
     records = qs.execute_and_fetchall(query)
 
+    root_ids = {row['RootPostBlockVersionId'] for row in records}
+    history_ids = qs.get_pbv_PostHistoryId_batch(root_ids)
+    creation_dates = qs.getSnippetCreationDate_batch(history_ids.values())
+
     rows_to_insert = []
     for row in records:
         snippet_id = row['Id']
         root_id = row['RootPostBlockVersionId']
-        post_history_id = qs.get_pbv_PostHistoryId(root_id)
-        creation_date = qs.getSnippetCreationDate(post_history_id)
+        creation_date = creation_dates.get(history_ids[root_id])
         line_count = row['LineCount']
         rows_to_insert.append((post_id, root_id, language, snippet_id, line_count, creation_date))
     qs.close()
@@ -185,17 +198,21 @@ def get_snippet_length_data(input_tuple):
     return rows_to_insert
 
 
-def get_language(snippet_id: int, qs: QueryService):
-    return qs.execute_and_fetchone(f"SELECT Language FROM CodeBlockVersion WHERE PostBlockVersionId={snippet_id}")['Language']
+def get_language(snippet_id: int, qs: 'QueryService'):
+    return qs.execute_and_fetchone("SELECT Language FROM CodeBlockVersion WHERE PostBlockVersionId=%s", (snippet_id,))['Language']
 
 
-def is_modified_since(post_id: int, release_date: datetime, qs: QueryService):
+def is_modified_since(post_id: int, release_date: datetime, qs: 'QueryService', release_index=None):
     """
     Returns True if the given post has been modified since the given release_date.
 
     This function uses the "08-Sep-2023 12:36" release of the Stack Overflow dataset.
+    When a ReleaseIndex of that release is given, it is used instead of the DB. To check many posts,
+    call release_index.is_modified_since(post_ids, release_date) directly.
     """
-    last_edit_date = qs.execute_and_fetchone(f"SELECT LastEditDate FROM September2023Posts WHERE Id={post_id}")['LastEditDate']
+    if release_index is not None:
+        return bool(release_index.is_modified_since([post_id], release_date)[0])
+    last_edit_date = qs.execute_and_fetchone("SELECT LastEditDate FROM September2023Posts WHERE Id=%s", (post_id,))['LastEditDate']
     if last_edit_date is None:
         modified = False
     else:
@@ -203,13 +220,31 @@ def is_modified_since(post_id: int, release_date: datetime, qs: QueryService):
     return modified
 
 
-def is_deleted(post_id: int, qs: QueryService) -> bool:
+def is_deleted(post_id: int, qs: 'QueryService', release_index=None) -> bool:
     """
     Returns True if the given post has been deleted from the September 2023 release
     of the SO data dump. This dump was released on 08-Sep-2023 at 12:36
+
+    When a ReleaseIndex of that release is given, it is used instead of the DB. To check many posts,
+    call release_index.is_deleted(post_ids) directly.
     """
-    cursor = qs.client.run_query(f"SELECT Id FROM September2023Posts WHERE Id={post_id}")
-    return cursor.rowcount == 0
+    if release_index is not None:
+        return bool(release_index.is_deleted([post_id])[0])
+    return qs.execute_and_fetchone("SELECT Id FROM September2023Posts WHERE Id=%s", (post_id,)) is None
+
+
+def get_release_index(qs: 'QueryService', directory='data/release_index/September2023Posts'):
+    """
+    Loads the ReleaseIndex of the September 2023 release from the given directory, building and saving it
+    there first if it does not exist yet.
+    """
+    from sources.release_index import ReleaseIndex
+
+    if os.path.exists(os.path.join(directory, 'ids.npy')):
+        return ReleaseIndex.load(directory)
+    index = ReleaseIndex.build(qs, 'September2023Posts')
+    index.save(directory)
+    return index
 
 
 def get_release_date(author: str) -> datetime:
@@ -225,11 +260,11 @@ def get_release_date(author: str) -> datetime:
         return None
 
 
-def get_post_version_count(post_id, qs: QueryService):
-    return qs.execute_and_fetchone(f"SELECT COUNT(Id) as count FROM PostVersion WHERE PostId={post_id}")['count']
+def get_post_version_count(post_id, qs: 'QueryService'):
+    return qs.execute_and_fetchone("SELECT COUNT(Id) as count FROM PostVersion WHERE PostId=%s", (post_id,))['count']
 
 
-def test_db_connection(qs: QueryService):
+def test_db_connection(qs: 'QueryService'):
     # Testing that we connected to the correct DB.
     count = qs.execute_and_fetchone(f"select count(Id) as count FROM PostBlockVersion")['count']
     return count
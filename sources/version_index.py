@@ -0,0 +1,126 @@
+"""
+A precomputed index of the version chains of the code snippets in PostBlockVersion.
+
+For every RootPostBlockVersionId, the index holds the ids of the versions that actually changed
+(PredEqual IS NULL OR PredEqual = 0) in PostHistoryId order, plus the id of the version flagged as
+MostRecentVersion. The chains are stored CSR-style in flat numpy arrays: the sorted root ids, the offset
+of each root's chain and the concatenated chains, so tens of millions of versions fit in a few hundred MB.
+
+Build the index once per release and save it; later runs load it memory-mapped, e.g.:
+
+    index = VersionChainIndex.build(qs)
+    index.save('data/version_index')
+    ...
+    qs.use_version_index(VersionChainIndex.load('data/version_index'))
+"""
+import os
+
+import numpy as np
+
+_ARRAYS = ('roots', 'offsets', 'ids', 'most_recent')
+# marks roots without a version flagged as MostRecentVersion
+NO_VERSION = -1
+
+
+class VersionChainIndex():
+    """
+    Args:
+        roots: The sorted, unique RootPostBlockVersionIds.
+        offsets: The chain of roots[i] is ids[offsets[i]:offsets[i + 1]].
+        ids: The concatenated chains of changed version ids.
+        most_recent: The id of the MostRecentVersion of each root, or NO_VERSION.
+    """
+    def __init__(self, roots, offsets, ids, most_recent):
+        self.roots = roots
+        self.offsets = offsets
+        self.ids = ids
+        self.most_recent = most_recent
+
+    @classmethod
+    def build(cls, qs, batch_size=65536):
+        """
+        Builds the index with a single ordered scan of PostBlockVersion through the given QueryService.
+        """
+        query_str = """SELECT RootPostBlockVersionId, Id, (PredEqual IS NULL OR PredEqual = 0) AS Changed, MostRecentVersion
+                       FROM PostBlockVersion
+                       WHERE RootPostBlockVersionId IS NOT NULL
+                       ORDER BY RootPostBlockVersionId ASC, PostHistoryId ASC"""
+        chain_roots, chain_ids, recent_roots, recent_ids = [], [], [], []
+        for _, columns in qs.client.fetch_column_batches(query_str, batch_size=batch_size):
+            roots = np.asarray(columns[0], dtype=np.int64)
+            ids = np.asarray(columns[1], dtype=np.int64)
+            changed = np.asarray(columns[2], dtype=bool)
+            recent = np.asarray(columns[3], dtype=bool)
+            chain_roots.append(roots[changed])
+            chain_ids.append(ids[changed])
+            recent_roots.append(roots[recent])
+            recent_ids.append(ids[recent])
+
+        chain_roots = np.concatenate(chain_roots) if chain_roots else np.empty(0, dtype=np.int64)
+        ids = np.concatenate(chain_ids) if chain_ids else np.empty(0, dtype=np.int64)
+        roots, starts = np.unique(chain_roots, return_index=True)
+        offsets = np.append(starts, len(ids)).astype(np.int64)
+
+        most_recent = np.full(len(roots), NO_VERSION, dtype=np.int64)
+        recent_roots = np.concatenate(recent_roots) if recent_roots else np.empty(0, dtype=np.int64)
+        recent_ids = np.concatenate(recent_ids) if recent_ids else np.empty(0, dtype=np.int64)
+        positions = np.searchsorted(roots, recent_roots)
+        found = positions < len(roots)
+        found[found] = roots[positions[found]] == recent_roots[found]
+        most_recent[positions[found]] = recent_ids[found]
+        return cls(roots, offsets, ids, most_recent)
+
+    def save(self, directory: str):
+        "Saves the index as one .npy file per array"
+        os.makedirs(directory, exist_ok=True)
+        for name in _ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory: str, mmap=True):
+        """
+        Loads a saved index. With mmap, the arrays are memory-mapped instead of read, so the index loads
+        instantly and worker processes share the pages.
+        """
+        mmap_mode = 'r' if mmap else None
+        return cls(*[np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode) for name in _ARRAYS])
+
+    def __len__(self):
+        return len(self.roots)
+
+    def _position(self, rootid) -> int:
+        position = int(np.searchsorted(self.roots, rootid))
+        if position < len(self.roots) and self.roots[position] == rootid:
+            return position
+        return -1
+
+    def __contains__(self, rootid):
+        return self._position(rootid) >= 0
+
+    def versions(self, rootid):
+        "Returns the changed version ids of the given root in PostHistoryId order, or None if the root is not indexed"
+        position = self._position(rootid)
+        if position < 0:
+            return None
+        return self.ids[self.offsets[position]:self.offsets[position + 1]].tolist()
+
+    def count(self, rootid):
+        "Returns the number of changed versions of the given root, or None if the root is not indexed"
+        position = self._position(rootid)
+        if position < 0:
+            return None
+        return int(self.offsets[position + 1] - self.offsets[position])
+
+    def latest(self, rootid):
+        "Returns the last changed version id of the given root, or None if the root is not indexed"
+        position = self._position(rootid)
+        if position < 0:
+            return None
+        return int(self.ids[self.offsets[position + 1] - 1])
+
+    def most_recent_version(self, rootid):
+        "Returns the id of the version flagged as MostRecentVersion, or None if the root is not indexed or has none"
+        position = self._position(rootid)
+        if position < 0 or self.most_recent[position] == NO_VERSION:
+            return None
+        return int(self.most_recent[position])
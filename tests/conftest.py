@@ -0,0 +1,98 @@
+import mysql.connector as mysql
+import pytest
+
+from sources.sotorrent import SOTorrentDB
+
+
+class FakeCursor():
+    "Reads the results of a FakeConnection like the (buffered or unbuffered) cursors of mysql.connector"
+    def __init__(self, connection, dictionary=False, buffered=False, prepared=False):
+        self._connection = connection
+        self._dictionary = dictionary
+        self._buffered = buffered or prepared
+        self._rows = []
+        self.column_names = []
+
+    def execute(self, query_str, params=None):
+        self._connection.handle_unread_result()
+        self._connection.queries.append((query_str, params))
+        self.column_names, rows = self._connection.results.get(' '.join(query_str.split()), ([], []))
+        self._rows = list(rows)
+        if not self._buffered and self.column_names:
+            self._connection.unread_result = True
+            self._connection.pending = self
+
+    def fetchmany(self, size=1):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        if len(rows) < size and self._connection.pending is self:
+            # the end of the result has been read
+            self._connection.unread_result = False
+            self._connection.pending = None
+        return [dict(zip(self.column_names, row)) if self._dictionary else row for row in rows]
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchall(self):
+        return self.fetchmany(len(self._rows) + 1)
+
+    def close(self):
+        self._connection.handle_unread_result()
+
+
+class FakeConnection():
+    """
+    Mimics a mysql.connector connection opened without consume_results: a statement (or closing a cursor) while
+    the rows of an unbuffered result are pending raises InternalError. results maps SQL (with normalized
+    whitespace) to (column_names, rows).
+    """
+    def __init__(self, results=None):
+        self.results = results or {}
+        self.queries = []
+        self.unread_result = False
+        self.pending = None
+        self.rollbacks = 0
+        self.is_closed = False
+
+    def cursor(self, dictionary=False, buffered=False, prepared=False):
+        return FakeCursor(self, dictionary, buffered, prepared)
+
+    def handle_unread_result(self):
+        if self.unread_result:
+            raise mysql.InternalError('Unread result found')
+
+    def consume_results(self):
+        if self.pending is not None:
+            self.pending._rows = []
+        self.unread_result = False
+        self.pending = None
+
+    def rollback(self):
+        self.consume_results()
+        self.rollbacks += 1
+
+    def commit(self):
+        self.handle_unread_result()
+
+    def ping(self):
+        pass
+
+    def close(self):
+        self.is_closed = True
+
+
+@pytest.fixture
+def fake_client():
+    "Returns a factory of SOTorrentDB clients connected to a FakeConnection with the given results"
+    def make(results=None, db='sotorrent22'):
+        client = SOTorrentDB(db=db)
+        client._connection = FakeConnection(results)
+        return client
+    return make
+
+
+@pytest.fixture
+def fake_connection():
+    "Returns the FakeConnection class, for connections the tests put into clients themselves"
+    return FakeConnection
@@ -0,0 +1,22 @@
+import pickle
+
+from sources import cache
+from sources.cache import DiskCache, MISSING
+
+
+def test_disk_cache_counts_the_entries_of_other_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'SIZE_SYNC_PUTS', 1)
+    entry_size = len(pickle.dumps('x' * 100, protocol=pickle.HIGHEST_PROTOCOL))
+    path = str(tmp_path / 'cache.sqlite')
+    first = DiskCache(path, max_bytes=3 * entry_size)
+    second = DiskCache(path, max_bytes=3 * entry_size)
+    first.put('a', 'x' * 100)
+    first.put('b', 'x' * 100)
+    # second has not written anything itself, but the file is full after its next put
+    second.put('c', 'x' * 100)
+    second.put('d', 'x' * 100)
+
+    assert first.get('a') is MISSING
+    assert second.get('d') == 'x' * 100
+    first.close()
+    second.close()
@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+from sources.case_study_1 import cppcheck_cache, util
+from sources.case_study_1.util import run_cpp_check_batch
+
+CPPCHECK = 'fake-cppcheck'
+
+
+class FakeCommand():
+    """
+    Stands in for cppcheck: reports a nullPointer for files named bad_*, hangs (and is terminated) on files named
+    hang_* and prints the file paths without the ./ of the passed ones, as cppcheck does.
+    """
+    calls = []
+
+    def __init__(self, arguments):
+        self.arguments = arguments
+        self.is_terminated = False
+
+    def run(self, timeout=300, workdir=None):
+        file_list = [argument for argument in self.arguments if argument.startswith('--file-list=')][0]
+        with open(file_list[len('--file-list='):]) as f:
+            snippet_files = f.read().split('\n')
+        FakeCommand.calls.append(snippet_files)
+        template = [argument for argument in self.arguments if argument.startswith('--template=')][0]
+        lines = [':::0:::missingIncludeSystem:::information:::Cppcheck cannot find all the include files']
+        for snippet_file in snippet_files:
+            printed_file = os.path.normpath(snippet_file)
+            lines.append(f"Checking {printed_file} ...")
+            name = os.path.basename(snippet_file)
+            if name.startswith('hang_'):
+                self.is_terminated = True
+                return -15, '\n'.join(lines), None
+            if name.startswith('bad_'):
+                lines.append(template[len('--template='):].format(file=printed_file, cwe=476, id='nullPointer',
+                                                                  severity='error', message='Null pointer: p'))
+            lines.append(f"{len(lines)}/{len(snippet_files)} files checked")
+        return 0, '\n'.join(lines), None
+
+
+@pytest.fixture
+def snippets(tmp_path, monkeypatch):
+    "Writes snippet files with the given names and contents and returns their paths, with ./ in them"
+    FakeCommand.calls = []
+    monkeypatch.setattr(util, 'Command', FakeCommand)
+    monkeypatch.setitem(cppcheck_cache._versions, CPPCHECK, 'Cppcheck 2.13.0')
+    monkeypatch.setattr(cppcheck_cache, '_cache_path', None)
+
+    def write(contents):
+        paths = []
+        for name, content in contents.items():
+            (tmp_path / name).write_text(content)
+            paths.append(f"{tmp_path}/./{name}")
+        return paths
+    return write
+
+
+NULL_POINTER = {'cwe': 476, 'message_id': 'nullPointer', 'severity': 'error', 'message': 'Null pointer: p'}
+
+
+def test_results_are_mapped_back_to_the_passed_files(snippets):
+    bad_file, ok_file = snippets({'bad_1.c': 'int *p = 0;', 'ok_2.c': 'int i;'})
+
+    results = run_cpp_check_batch([bad_file, ok_file], cppcheck=CPPCHECK)
+
+    # the message without a file belongs to neither file of the batch
+    assert results == {bad_file: [NULL_POINTER], ok_file: []}
+    assert len(FakeCommand.calls) == 1
+
+
+def test_a_hanging_file_runs_alone_and_is_not_analyzed(snippets):
+    files = snippets({'ok_1.c': 'int a;', 'hang_2.c': 'int b;', 'bad_3.c': 'int *c;', 'ok_4.c': 'int d;'})
+
+    results = run_cpp_check_batch(files, cppcheck=CPPCHECK)
+
+    assert results == {files[0]: [], files[1]: None, files[2]: [NULL_POINTER], files[3]: []}
+    # the completed file is not run again, the hanging one runs alone and the others as a new batch
+    assert FakeCommand.calls == [files, [files[1]], files[2:]]
+
+
+def test_files_with_the_same_content_are_analyzed_once(snippets, tmp_path):
+    cppcheck_cache.use_cpp_check_cache(str(tmp_path / 'cppcheck_cache.sqlite'))
+    files = snippets({'bad_1.c': 'int *p = 0;', 'bad_2.c': 'int *p = 0;', 'hang_3.c': 'for (;;);'})
+
+    results = run_cpp_check_batch(files, cppcheck=CPPCHECK)
+    assert results == {files[0]: [NULL_POINTER], files[1]: [NULL_POINTER], files[2]: None}
+    assert FakeCommand.calls == [[files[0], files[2]], [files[2]]]
+
+    # the results are cached, except for the file that was not analyzed
+    FakeCommand.calls = []
+    assert run_cpp_check_batch(files, cppcheck=CPPCHECK) == results
+    assert FakeCommand.calls == [[files[2]]]
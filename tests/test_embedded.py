@@ -0,0 +1,34 @@
+import pytest
+import pyarrow as pa
+import pyarrow.feather
+
+from sources.queryservice import QueryService
+
+
+def test_feather_tables_are_queryable_without_a_database_file(tmp_path):
+    pyarrow.feather.write_feather(pa.table({'Id': [1, 2], 'ParentId': [None, 1], 'PostTypeId': [1, 2]}),
+                                  str(tmp_path / 'Posts.feather'))
+    qs = QueryService()
+    qs.connect_offline(str(tmp_path))
+
+    assert qs.get_parentId(2) == 1
+    assert list(qs.execute_and_stream('SELECT Id FROM Posts ORDER BY Id')) == [{'Id': 1}, {'Id': 2}]
+    qs.close()
+
+
+def test_offline_connections_read_the_tables_of_their_database(tmp_path, monkeypatch):
+    for db_name, parent_id in [('sotorrent18_12', 1), ('sotorrent22', 3)]:
+        (tmp_path / db_name).mkdir()
+        pyarrow.feather.write_feather(pa.table({'Id': [2], 'ParentId': [parent_id]}),
+                                      str(tmp_path / db_name / 'Posts.feather'))
+    monkeypatch.setenv('SOTORRENT_DATA_DIR', str(tmp_path))
+    qs_18, qs_22 = QueryService(), QueryService()
+    qs_18.connect(port=3307, db_name='sotorrent18_12')
+    qs_22.connect(db_name='sotorrent22')
+
+    assert qs_18.get_parentId(2) == 1
+    assert qs_22.get_parentId(2) == 3
+    with pytest.raises(FileNotFoundError):
+        QueryService().connect(db_name='sotorrent20_03')
+    qs_18.close()
+    qs_22.close()
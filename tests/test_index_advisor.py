@@ -0,0 +1,48 @@
+import json
+
+from sources.index_advisor import IndexSpec, create_index_statement, derive_index, load_query_log
+
+COLUMN_TYPES = {column.lower(): (column, data_type) for column, data_type in [
+    ('Id', 'int'), ('PostId', 'int'), ('PostBlockTypeId', 'tinyint'), ('RootPostBlockVersionId', 'int'),
+    ('LineCount', 'int'), ('Content', 'text'), ('PostHistoryId', 'int'), ('PredEqual', 'tinyint')]}
+
+
+def test_derived_index_covers_the_selected_columns():
+    index = derive_index('SELECT RootPostBlockVersionId, Id, LineCount FROM PostBlockVersion '
+                         'WHERE PostId=? AND PostBlockTypeId=?', COLUMN_TYPES, ['Id'])
+
+    assert index == IndexSpec('PostBlockVersion', ['PostId', 'PostBlockTypeId'], ['RootPostBlockVersionId', 'LineCount'])
+    statement = create_index_statement(index)
+    assert statement.endswith(' ON PostBlockVersion(PostId, PostBlockTypeId, RootPostBlockVersionId, LineCount);')
+    # MySQL limits index names to 64 characters
+    assert len(statement.split()[2]) <= 64
+
+
+def test_derived_index_puts_equality_before_range_columns():
+    index = derive_index('SELECT Content FROM PostBlockVersion WHERE PostHistoryId > ? AND '
+                         '(PredEqual IS NULL OR PredEqual = ?) AND PostBlockTypeId IN (?)', COLUMN_TYPES, ['Id'])
+
+    # Content is a text column and cannot be covered
+    assert index == IndexSpec('PostBlockVersion', ['PredEqual', 'PostBlockTypeId', 'PostHistoryId'], [])
+    assert isinstance(derive_index('SELECT p.Id FROM PostBlockVersion p JOIN Posts q ON q.Id=p.PostId WHERE q.Id=?',
+                                   COLUMN_TYPES, ['Id']), str)
+
+
+def test_shapes_are_loaded_per_database_by_total_time(tmp_path):
+    entries = [{'database': '127.0.0.1:3306/sotorrent22', 'shape': 'SELECT Id FROM Posts WHERE ParentId=?',
+                'calls': 1, 'seconds': 1.0, 'samples': [['SELECT Id FROM Posts WHERE ParentId=%s', [1]]]},
+               {'database': '127.0.0.1:3307/sotorrent18_12', 'shape': 'SELECT Id FROM Posts WHERE Score=?',
+                'calls': 9, 'seconds': 9.0, 'samples': []},
+               {'database': '127.0.0.1:3306/sotorrent22', 'shape': 'SELECT Id FROM Posts WHERE Score=?',
+                'calls': 2, 'seconds': 0.5, 'samples': []},
+               {'database': '127.0.0.1:3306/sotorrent22', 'shape': 'SELECT Id FROM Posts WHERE ParentId=?',
+                'calls': 3, 'seconds': 3.0, 'samples': [['SELECT Id FROM Posts WHERE ParentId=%s', [2]]]}]
+    with open(tmp_path / 'query_log.jsonl', 'w') as f:
+        f.writelines(json.dumps(entry) + '\n' for entry in entries)
+
+    shapes = load_query_log(str(tmp_path / 'query_log.jsonl'), 'sotorrent22')
+
+    assert [(shape.shape, shape.calls, shape.seconds) for shape in shapes] == [
+        ('SELECT Id FROM Posts WHERE ParentId=?', 4, 4.0), ('SELECT Id FROM Posts WHERE Score=?', 2, 0.5)]
+    assert shapes[0].samples == [('SELECT Id FROM Posts WHERE ParentId=%s', (1,)),
+                                 ('SELECT Id FROM Posts WHERE ParentId=%s', (2,))]
@@ -0,0 +1,31 @@
+import json
+
+from sources.instrumentation import QueryStats
+
+
+def test_slow_queries_are_explained_on_their_own_database():
+    stats = QueryStats(slow_query_seconds=1)
+    stats.record_call('analysis.main', 'SELECT Id FROM Posts', None, 2, database='127.0.0.1:3307/sotorrent18_12')
+    stats.record_call('analysis.main', 'SELECT Id FROM Posts', None, 2, database='127.0.0.1:3306/sotorrent22')
+
+    pending = stats.pending_explains('127.0.0.1:3306/sotorrent22')
+
+    assert [query['database'] for query in pending] == ['127.0.0.1:3306/sotorrent22']
+    assert 'on 127.0.0.1:3307/sotorrent18_12' in stats.report()
+
+
+def test_query_log_groups_queries_by_shape(tmp_path):
+    stats = QueryStats(record_shapes=True)
+    for post_id in (1, 2):
+        stats.record_call('qs.get_parentId', 'SELECT ParentId FROM Posts WHERE Id=%s', (post_id,), 0.5,
+                          database='127.0.0.1:3306/sotorrent22')
+    stats.record_call('analysis.main', "SELECT Id FROM Posts WHERE PostTypeId IN (1, 2) AND Title='x'", None, 0.1,
+                      database='127.0.0.1:3306/sotorrent22')
+
+    stats.save_query_log(str(tmp_path / 'query_log.jsonl'))
+
+    entries = [json.loads(line) for line in open(tmp_path / 'query_log.jsonl')]
+    assert [(entry['shape'], entry['calls']) for entry in entries] == [
+        ('SELECT ParentId FROM Posts WHERE Id=?', 2), ('SELECT Id FROM Posts WHERE PostTypeId IN (?) AND Title=?', 1)]
+    assert entries[0]['samples'] == [['SELECT ParentId FROM Posts WHERE Id=%s', [1]],
+                                     ['SELECT ParentId FROM Posts WHERE Id=%s', [2]]]
@@ -0,0 +1,70 @@
+from sources.materialized_views import ViewMaterializer
+from sources.queryservice import QueryService
+from sources.snapshot import SnapshotCursor
+from sources.sotorrent import RoutedDB
+
+VIEW = 'View_JavaCodeSnippets'
+
+
+class StubDB():
+    """
+    Answers the statements of ViewMaterializer from memory. Every PostBlockVersion Id belongs to the view; the
+    metadata written to a primary is not replicated, as on a replica that lags behind.
+    """
+    def __init__(self, post_block_version_ids):
+        self.post_block_version_ids = post_block_version_ids
+        self.metadata = {}
+        self.copied = []
+
+    @property
+    def db(self):
+        return self
+
+    @property
+    def primary(self):
+        return self
+
+    def commit(self):
+        pass
+
+    def run_query(self, query_str, params=None, stream=False, fetch_size=1000):
+        query = ' '.join(query_str.split())
+        rows, rowcount = [], 0
+        if query.startswith('INSERT INTO MaterializedViews'):
+            view_name, table_name, watermark, row_count = params
+            self.metadata[view_name] = {'TableName': table_name, 'Watermark': watermark, 'RowCount': row_count,
+                                        'RefreshedAt': None}
+        elif query.startswith('INSERT INTO MView_JavaCodeSnippets'):
+            low, high = params
+            ids = [post_block_version_id for post_block_version_id in self.post_block_version_ids
+                   if low < post_block_version_id <= high]
+            self.copied.extend(ids)
+            rowcount = len(ids)
+        elif query.startswith('SELECT TableName'):
+            rows = [self.metadata[params[0]]] if params[0] in self.metadata else []
+        elif query.startswith('SELECT MAX(Id)'):
+            rows = [{'MaxId': max(self.post_block_version_ids, default=None)}]
+        cursor = SnapshotCursor(list(rows[0]) if rows else [], list(zip(*[row.values() for row in rows])))
+        cursor.rowcount = rowcount or cursor.rowcount
+        return cursor
+
+    def run_prepared(self, query_str, params=()):
+        return self.run_query(query_str, params)
+
+
+def test_refresh_reads_the_watermark_on_the_primary():
+    primary, replica = StubDB([1, 2, 3, 4, 5]), StubDB([1, 2, 3])
+    qs = QueryService()
+    qs.client = RoutedDB(primary, [replica])
+    materializer = ViewMaterializer(qs, chunk_size=2)
+
+    assert materializer.materialize(VIEW) == 5
+    assert materializer.freshness(VIEW)['Watermark'] == 5 and materializer.freshness(VIEW)['IsFresh']
+
+    primary.post_block_version_ids.extend([6, 7, 8])
+    assert not materializer.freshness(VIEW)['IsFresh']
+    assert materializer.refresh(VIEW) == 3
+
+    assert primary.copied == [1, 2, 3, 4, 5, 6, 7, 8]
+    assert primary.metadata[VIEW]['Watermark'] == 8 and primary.metadata[VIEW]['RowCount'] == 8
+    assert replica.copied == []
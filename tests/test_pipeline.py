@@ -0,0 +1,36 @@
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from sources.case_study_1 import pipeline
+from sources.case_study_1.pipeline import COLUMNS, WeaknessPipeline
+from sources.queryservice import QueryService
+
+SNIPPETS_QUERY = 'SELECT PostId, RootPostBlockVersionId, PostBlockVersionId, Content FROM PostBlockVersion'
+
+
+def test_a_failing_stage_stops_the_pipeline_and_closes_the_snippet_stream(fake_client, tmp_path, monkeypatch):
+    def run_cpp_check_batch(snippet_files, **kwargs):
+        raise RuntimeError('cppcheck failed')
+
+    monkeypatch.setattr(pipeline, 'run_cpp_check_batch', run_cpp_check_batch)
+    snippets = fake_client({SNIPPETS_QUERY: (['PostId', 'RootPostBlockVersionId', 'PostBlockVersionId', 'Content'],
+                                             [(post_id, post_id, post_id, 'int main() {}') for post_id in range(100)])})
+    (tmp_path / 'tables').mkdir()
+    pq.write_table(pa.table({column: pa.array([], pa.int64()) for column in COLUMNS}),
+                   tmp_path / 'tables' / 'CppCheckWeakness.parquet')
+    qs = QueryService()
+    qs.connect_offline(str(tmp_path / 'tables'), db_file=str(tmp_path / 'sotorrent22.duckdb'))
+
+    weakness_pipeline = WeaknessPipeline(2.13, datetime(2022, 6, 30), workers=2, batch_size=2, queue_size=1,
+                                         scratch_directory=str(tmp_path / 'scratch'))
+    with pytest.raises(RuntimeError, match='cppcheck failed'):
+        weakness_pipeline.run(snippets.stream_query(SNIPPETS_QUERY, fetch_size=10), qs)
+
+    # the stream was closed partway, so the connection can run the next query
+    assert not snippets.db.unread_result
+    assert weakness_pipeline.stats[0].items < 100
+    assert qs.execute_and_fetchone('SELECT COUNT(*) AS n FROM CppCheckWeakness')['n'] == 0
+    qs.close()
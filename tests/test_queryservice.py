@@ -0,0 +1,48 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from sources.queryservice import QueryService
+from sources.sotorrent import SOTorrentDB, RoutedDB
+
+
+def test_execute_to_arrow_unifies_the_types_of_the_batches(tmp_path):
+    # ParentId is NULL throughout the first batch, so its type is only known from the second one
+    pq.write_table(pa.table({'Id': [1, 2, 3, 4], 'ParentId': [None, None, 1, 1]}), tmp_path / 'Posts.parquet')
+    qs = QueryService()
+    qs.connect_offline(str(tmp_path))
+
+    table = qs.execute_to_arrow('SELECT Id, ParentId FROM Posts ORDER BY Id', batch_size=2)
+
+    assert table.schema.field('ParentId').type == pa.int64()
+    assert table.column('ParentId').to_pylist() == [None, None, 1, 1]
+    assert list(qs.execute_to_dataframe('SELECT Id, ParentId FROM Posts ORDER BY Id', batch_size=2)['Id']) == [1, 2, 3, 4]
+    qs.close()
+
+
+def test_read_hosts_are_configured_per_database(monkeypatch):
+    monkeypatch.delenv('SOTORRENT_DATA_DIR', raising=False)
+    monkeypatch.setenv('SOTORRENT_READ_HOSTS_SOTORRENT22', '10.0.0.2:3306,10.0.0.3')
+    qs_18, qs_22 = QueryService(), QueryService()
+    qs_18.connect(port=3307, db_name='sotorrent18_12')
+    qs_22.connect(db_name='sotorrent22')
+
+    assert isinstance(qs_18.client, SOTorrentDB)
+    assert isinstance(qs_22.client, RoutedDB)
+    assert [replica.database for replica in qs_22.client._replicas] == ['10.0.0.2:3306/sotorrent22',
+                                                                       '10.0.0.3:3306/sotorrent22']
+
+
+def test_iter_table_selects_the_key_once(tmp_path):
+    pq.write_table(pa.table({'Id': [1, 2, 3], 'Content': ['a', 'b', 'c']}), tmp_path / 'PostBlockVersion.parquet')
+    qs = QueryService()
+    qs.connect_offline(str(tmp_path))
+    queries = []
+    execute_and_fetchall = qs.execute_and_fetchall
+    qs.execute_and_fetchall = lambda query, params=None: queries.append(query) or execute_and_fetchall(query, params)
+
+    assert list(qs.iter_table('PostBlockVersion', columns='Id, Content', batch_size=2)) == [
+        {'Id': 1, 'Content': 'a'}, {'Id': 2, 'Content': 'b'}, {'Id': 3, 'Content': 'c'}]
+    assert list(qs.iter_table('PostBlockVersion', columns='Content', start_after=1)) == [
+        {'Id': 2, 'Content': 'b'}, {'Id': 3, 'Content': 'c'}]
+    assert [query.split(' FROM ')[0] for query in queries] == ['SELECT Id, Content'] * 3
+    qs.close()
@@ -0,0 +1,56 @@
+import types
+
+import pytest
+
+from sources.queryservice import QueryService
+from sources.release_diff import diff_root_snippets, merge_diff, ADDED, REMOVED, CHANGED, UNCHANGED
+
+POSTS_QUERY = 'SELECT Id, Score FROM Posts ORDER BY Id'
+
+
+def test_diff_root_snippets_summarizes_a_streamed_diff():
+    batches = [{'Status': [UNCHANGED, CHANGED, REMOVED], 'OldRootPostBlockVersionId': [1, 2, 3],
+                'NewRootPostBlockVersionId': [10, 20, None]},
+               {'Status': [UNCHANGED, ADDED, ADDED], 'OldRootPostBlockVersionId': [1, None, None],
+                'NewRootPostBlockVersionId': [10, 20, 40]}]
+
+    roots = diff_root_snippets(iter(batches))
+
+    assert isinstance(roots, types.GeneratorType)
+    assert list(roots) == [
+        {'OldRootPostBlockVersionId': 1, 'NewRootPostBlockVersionId': 10, 'Status': UNCHANGED},
+        {'OldRootPostBlockVersionId': 2, 'NewRootPostBlockVersionId': 20, 'Status': CHANGED},
+        {'OldRootPostBlockVersionId': 3, 'NewRootPostBlockVersionId': None, 'Status': REMOVED},
+        {'OldRootPostBlockVersionId': None, 'NewRootPostBlockVersionId': 40, 'Status': ADDED}]
+
+
+def _connect(fake_client, rows):
+    qs = QueryService()
+    qs.client = fake_client({POSTS_QUERY: (['Id', 'Score'], rows)})
+    return qs
+
+
+def test_merge_diff_stopped_partway_releases_both_streams(fake_client):
+    qs_old = _connect(fake_client, [(post_id, 0) for post_id in range(100)])
+    qs_new = _connect(fake_client, [(post_id, post_id % 2) for post_id in range(100)])
+
+    diff = merge_diff(qs_old.execute_and_stream(POSTS_QUERY, fetch_size=10),
+                      qs_new.execute_and_stream(POSTS_QUERY, fetch_size=10), ['Id'], ['Score'])
+    assert [(status, new_row['Id']) for status, _, new_row in [next(diff), next(diff)]] == [(CHANGED, 1),
+                                                                                          (CHANGED, 3)]
+    diff.close()
+
+    for qs in (qs_old, qs_new):
+        assert not qs.client.db.unread_result
+        assert len(qs.execute_and_fetchall(POSTS_QUERY)) == 100
+
+
+def test_merge_diff_raises_the_error_of_a_comparison(fake_client):
+    qs_old = _connect(fake_client, [(post_id, 0) for post_id in range(100)])
+    qs_new = _connect(fake_client, [(str(post_id), 0) for post_id in range(100)])
+
+    with pytest.raises(TypeError):
+        list(merge_diff(qs_old.execute_and_stream(POSTS_QUERY, fetch_size=10),
+                        qs_new.execute_and_stream(POSTS_QUERY, fetch_size=10), ['Id'], ['Score']))
+
+    assert not qs_old.client.db.unread_result and not qs_new.client.db.unread_result
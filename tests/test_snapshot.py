@@ -0,0 +1,42 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from sources.queryservice import QueryService
+from sources.snapshot import SnapshotMissingError, SnapshotStore
+
+DATAFRAME_QUERY = 'SELECT Id, ParentId FROM Posts WHERE PostTypeId=%s ORDER BY Id'
+
+
+def _run_queries(qs):
+    return (qs.execute_to_dataframe(DATAFRAME_QUERY, (2,)).to_dict('list'),
+            qs.get_parentId(3),
+            qs.execute_and_fetchall('SELECT Id FROM Posts WHERE PostTypeId=%s', (5,)))
+
+
+def test_replay_answers_all_read_queries_without_a_database(tmp_path, monkeypatch):
+    data_dir = tmp_path / 'data' / 'sotorrent22'
+    data_dir.mkdir(parents=True)
+    pq.write_table(pa.table({'Id': [1, 2, 3], 'PostTypeId': [1, 2, 2], 'ParentId': [None, 1, 1]}),
+                   data_dir / 'Posts.parquet')
+    monkeypatch.delenv('DB_USER', raising=False)
+    monkeypatch.delenv('SOTORRENT_SNAPSHOT_DIR', raising=False)
+    monkeypatch.setenv('SOTORRENT_DATA_DIR', str(tmp_path / 'data'))
+    qs = QueryService()
+    qs.snapshots = SnapshotStore(str(tmp_path / 'snapshots'), mode='record')
+    qs.connect(db_name='sotorrent22')
+    recorded = _run_queries(qs)
+    qs.close()
+
+    # without exported tables, the MySQL server would be queried, which requires DB_USER
+    monkeypatch.delenv('SOTORRENT_DATA_DIR')
+    qs = QueryService()
+    qs.snapshots = SnapshotStore(str(tmp_path / 'snapshots'), mode='replay')
+    qs.connect(db_name='sotorrent22')
+
+    assert _run_queries(qs) == recorded == ({'Id': [2, 3], 'ParentId': [1, 1]}, 1, [])
+    assert list(qs.execute_to_dataframe('SELECT Id FROM Posts WHERE PostTypeId=%s', (5,)).columns) == ['Id']
+    with pytest.raises(SnapshotMissingError):
+        qs.get_parentId(2)
+    assert not qs.client.client.is_connected
+    qs.close()
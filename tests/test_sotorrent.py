@@ -0,0 +1,58 @@
+from itertools import islice
+
+import mysql.connector as mysql
+
+from sources.sotorrent import SOTorrentDBPool
+
+QUERY = 'SELECT Id FROM Posts ORDER BY Id'
+
+
+def test_closing_a_stream_early_discards_its_unread_rows(fake_client):
+    client = fake_client({QUERY: (['Id'], [(post_id,) for post_id in range(10)])})
+
+    stream = client.stream_query(QUERY, fetch_size=3)
+    assert [row['Id'] for row in islice(stream, 4)] == [0, 1, 2, 3]
+    stream.close()
+
+    assert not client.db.unread_result
+    assert [row['Id'] for row in client.stream_query(QUERY)] == list(range(10))
+
+
+def test_closing_column_batches_early_discards_their_unread_rows(fake_client):
+    client = fake_client({QUERY: (['Id'], [(post_id,) for post_id in range(10)])})
+
+    batches = client.fetch_column_batches(QUERY, batch_size=4)
+    assert next(batches) == (['Id'], [(0, 1, 2, 3)])
+    batches.close()
+
+    assert not client.db.unread_result
+    assert [columns for _, columns in client.fetch_column_batches(QUERY, batch_size=8)] == [[tuple(range(8))],
+                                                                                         [(8, 9)]]
+
+
+def test_released_connections_end_their_transaction(fake_connection):
+    pool = SOTorrentDBPool(max_size=1)
+    client = pool.acquire()
+    client._connection = fake_connection({QUERY: (['Id'], [(post_id,) for post_id in range(10)])})
+    # a stream the borrower did not read to its end
+    next(client.stream_query(QUERY, fetch_size=3))
+
+    pool.release(client)
+
+    assert client.db.rollbacks == 1 and not client.db.unread_result
+    assert pool.acquire(timeout=1) is client
+
+
+def test_connections_failing_to_roll_back_are_not_handed_out_again(fake_connection):
+    def rollback():
+        raise mysql.OperationalError('Lost connection to MySQL server')
+
+    pool = SOTorrentDBPool(max_size=1)
+    client = pool.acquire()
+    connection = client._connection = fake_connection()
+    connection.rollback = rollback
+
+    pool.release(client)
+
+    assert connection.is_closed
+    assert pool.acquire(timeout=1) is not client